@@ -3,16 +3,61 @@ import pandas as pd
 import requests #JSON用
 from openai import OpenAI
 import os
+import queue
+import time
+import hashlib
+import random
+import re
+import threading
+from collections import OrderedDict
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # ######################## analyze.pyの説明 ##########################
 # 
 # 現状は、「指定ユーザーと共通点のある人を探す」機能のみ実装済み。(find_commons関数)
 # 分析もChatGPTに全て任せちゃっています。
 # 
+# 各機能は「プロンプトを作ってAPIを呼ぶだけの関数（request_〜）」と、
+# 「画面に探索中メッセージを出しつつ request_〜 を呼ぶ関数（find_〜 / search_〜）」に分かれている。
+# request_〜 は Streamlit を触らないので、スレッドから呼び出せる。
+# stream_〜 は request_〜 のストリーミング版で、届いた文字列を少しずつ yield する。
+# 画面（モード1の3つのタブ、モード2）は StreamGroup でスレッドから並列に途中経過を受け取る。（start_mode1_streams）
+# 
+# 回答は ANSWER_CACHE（プロセス全体で共有）に (機能, 名前/特徴, データの指紋, モデル) をキーに保存する。
+# 別のブラウザから同じ質問が来たらAPIを呼ばずに返し、同時に来た同じ質問はAPI呼び出し1回にまとめる。
+# チーム提案はランダム性が欲しいので、TEAM_VARIANTS 通りの回答を貯めておき、その中から選ぶ。
+# 
+# プロンプトにはDataFrameをそのまま埋め込まず、member_context で「名前: 特徴, 特徴, ...」の一覧を作る。
+# 質問（名前や特徴）との重なりが大きいメンバーから順に、CONTEXT_MAX_MEMBERS 人・
+# CONTEXT_TOKEN_BUDGET トークン（目安）まで入れる。送ったプロンプトの大きさは毎回ログに出す。
+# 
+# 「似ている人」は network_app と同じ重み付きスコア（表記ゆれ・地名の階層・カテゴリ重み）で
+# 上位 SIMILAR_TOP_K 人を手元で決め、AIにはその人たちと共通点だけを渡して紹介文を書いてもらう。
+# AIを使わない設定（SIMILAR_USE_LLM=False）やAIの呼び出しに失敗したときは、順位をそのまま表示する。
+# 
 # ####################################################################
 
 
+GPT_MODEL = "gpt-4o-mini"
+DEFAULT_TIMEOUT_SEC = 60       # 1リクエストあたりのタイムアウト（秒）
+MAX_PARALLEL_REQUESTS = 8      # プロセス全体での同時リクエスト数の上限
+
+ANSWER_CACHE_TTL_SEC = 6 * 60 * 60   # 回答キャッシュの有効期限（秒）
+ANSWER_CACHE_MAX_ENTRIES = 512      # 回答キャッシュの最大件数（超えたら最近使われていない順に捨てる）
+TEAM_VARIANTS = 3                   # チーム提案で使い回す回答のパターン数（1なら毎回同じ回答）
+CONTEXT_MAX_MEMBERS = 60            # プロンプトに入れるメンバーの最大人数
+CONTEXT_TOKEN_BUDGET = 4000         # プロンプトに入れるメンバー一覧のトークン数の上限（目安）
+SIMILAR_TOP_K = 5                   # 「似ている人」で紹介する人数
+SIMILAR_USE_LLM = True              # False なら「似ている人」はAIを使わず、順位をそのまま表示する
+
+SYSTEM_PROMPT_DEFAULT = "あなたはJSONデータを解析するAIです。親しみやすく楽しい口調のキャラクターです。"
+SYSTEM_PROMPT_COMMONS = "あなたはJSONデータを解析するAIです。親しみやすく楽しい口調で、回答します。"
+
+# 並列リクエスト用のスレッドプール（Streamlit の再実行をまたいで1つだけ使う）
+_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_REQUESTS, thread_name_prefix="analyze")
+
+
 # ######### 関数定義 ##########
 # chatGPTにリクエストするメソッド
 # 使い方
@@ -42,17 +87,340 @@ def read_json():
     return df
 
 
+# chatGPTへのリクエスト（共通部分）。返って来たレスポンスの本文を返す。
+# timeout は1リクエストあたりの秒数（None なら OpenAI クライアントの既定値）
+def _chat(client, request_to_gpt, system_prompt=SYSTEM_PROMPT_DEFAULT, timeout=None):
+    kwargs = {"timeout": timeout} if timeout else {}
+    log_prompt_size(request_to_gpt, system_prompt)
+    response =  client.chat.completions.create(
+        model=GPT_MODEL,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": request_to_gpt}
+        ],
+        **kwargs
+    )
+    return response.choices[0].message.content.strip()
+
+# ストリーミング版（stream=True）。届いた文字列の断片を順に yield する。
+def _chat_stream(client, request_to_gpt, system_prompt=SYSTEM_PROMPT_DEFAULT, timeout=None):
+    kwargs = {"timeout": timeout} if timeout else {}
+    log_prompt_size(request_to_gpt, system_prompt)
+    stream = client.chat.completions.create(
+        model=GPT_MODEL,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": request_to_gpt}
+        ],
+        stream=True,
+        **kwargs
+    )
+    try:
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+    finally:
+        # 途中で読むのをやめた場合も接続を閉じる
+        close = getattr(stream, "close", None)
+        if close is not None:
+            close()
+
+
+# ===================== 回答キャッシュ（プロセス全体で共有） =====================
+# 参照データの指紋。データが変わればキーが変わり、古い回答は使われない。
+def dataset_fingerprint(data_json):
+    if isinstance(data_json, pd.DataFrame):
+        payload = data_json.to_json(orient="records", force_ascii=False)
+    else:
+        payload = str(data_json)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+# 実行中の1リクエスト。後から来た同じ質問は、ここに届く文字列を一緒に受け取る。
+class _Flight:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._chunks = []
+        self._done = False
+        self._error = None
+        self.followers = 0   # 相乗りして読んでいる数（AnswerCache のロックの中で増減する）
+
+    def feed(self, delta):
+        with self._cond:
+            self._chunks.append(delta)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self._done = True
+            self._error = error
+            self._cond.notify_all()
+
+    def text(self):
+        with self._cond:
+            return "".join(self._chunks)
+
+    # 先頭から順に文字列の断片を yield する（先行リクエストが失敗したら同じ例外を投げる）
+    def follow(self, timeout=None):
+        deadline = time.monotonic() + timeout if timeout else None
+        sent = 0
+        while True:
+            with self._cond:
+                while sent == len(self._chunks) and not self._done:
+                    wait = None if deadline is None else deadline - time.monotonic()
+                    if wait is not None and wait <= 0:
+                        raise TimeoutError(f"{timeout}秒以内に応答がありませんでした")
+                    self._cond.wait(wait)
+                chunks = self._chunks[sent:]
+                done, error = self._done, self._error
+            sent += len(chunks)
+            yield from chunks
+            if done and sent == len(self._chunks):
+                if error is not None:
+                    raise error
+                return
+
+class AnswerCache:
+    """APIの回答を保存するTTL付きLRUキャッシュ（スレッドセーフ）。同じキーの同時リクエストは1回にまとめる"""
+
+    def __init__(self, label, max_entries, ttl_sec):
+        self.label = label
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()   # key → (保存時刻, 本文)
+        self._flights = {}              # key → _Flight（実行中）
+        self._lock = threading.Lock()
+
+    # ("hit", 本文) / ("follow", _Flight) / ("lead", _Flight) のどれかを返す
+    # "lead" を受け取った呼び出し元だけがAPIを呼び、最後に complete か abort を呼ぶ
+    def begin(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.monotonic() - entry[0] <= self.ttl_sec:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return "hit", entry[1]
+                del self._entries[key]
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                flight.followers += 1
+                return "follow", flight
+            self.misses += 1
+            flight = self._flights[key] = _Flight()
+            return "lead", flight
+
+    def complete(self, key, flight, text):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._flights.pop(key, None)
+        flight.finish()
+
+    # 失敗した回答は保存しない（次の同じ質問はAPIを呼び直す）
+    def abort(self, key, flight, error):
+        with self._lock:
+            self._flights.pop(key, None)
+        flight.finish(error)
+
+    def unfollow(self, flight):
+        with self._lock:
+            flight.followers -= 1
+
+    # 先行リクエストが途中で読むのをやめたとき、相乗りしている側がいれば True（続きはそちらのために受信する）
+    # いなければ error で打ち切って False を返す（判定と打ち切りの間に新しい相乗りが入らないよう、ロックの中で行う）
+    def abandon(self, key, flight, error):
+        with self._lock:
+            if flight.followers > 0:
+                return True
+            self._flights.pop(key, None)
+        flight.finish(error)
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats_line(self):
+        return (f"{self.label}: ヒット {self.hits}件 / ミス {self.misses}件 / "
+                f"相乗り {self.coalesced}件 / 保持 {len(self._entries)}件")
+
+ANSWER_CACHE = AnswerCache("回答キャッシュ", ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SEC)
+
+def answer_key(kind, arg, data_json, variant=0):
+    return (kind, str(arg), dataset_fingerprint(data_json), GPT_MODEL, variant)
+
+# チーム提案のキー。TEAM_VARIANTS 通りのうち1つをランダムに選ぶ（未保存なら新しく作られる）
+def team_answer_key(name, data_json):
+    return answer_key("team", name, data_json, random.randrange(max(1, TEAM_VARIANTS)))
+
+# キャッシュ経由で回答の断片を yield する。produce は実際にAPIを呼んで断片を返すジェネレータを作る関数
+def _cached_answer(key, produce, timeout=None):
+    state, value = ANSWER_CACHE.begin(key)
+    if state == "hit":
+        yield value
+        return
+    if state == "follow":
+        try:
+            yield from value.follow(timeout)
+        finally:
+            ANSWER_CACHE.unfollow(value)
+        return
+    flight = value
+    it = None
+    try:
+        it = produce()
+        for delta in it:
+            flight.feed(delta)
+            yield delta
+    except GeneratorExit:
+        # 途中で読むのをやめられた場合、相乗りしている側がいれば残りはスレッドプールで受信して保存する
+        if ANSWER_CACHE.abandon(key, flight, RuntimeError("回答の受信が中断されました")):
+            _executor.submit(_finish_flight, key, flight, it)
+        else:
+            close = getattr(it, "close", None)
+            if close is not None:
+                close()
+        raise
+    except BaseException as e:
+        error = e if isinstance(e, Exception) else RuntimeError("回答の受信が中断されました")
+        ANSWER_CACHE.abort(key, flight, error)
+        raise
+    ANSWER_CACHE.complete(key, flight, flight.text().strip())
+
+# 先行リクエストが手放した回答の続きを受信し、相乗りしている側へ渡して保存する
+def _finish_flight(key, flight, it):
+    try:
+        for delta in it:
+            flight.feed(delta)
+    except Exception as e:
+        ANSWER_CACHE.abort(key, flight, e)
+        return
+    ANSWER_CACHE.complete(key, flight, flight.text().strip())
+
+# make_prompt はプロンプトを作る関数（キャッシュにあるときはプロンプトを作らずに済むよう、呼び出しを遅らせる）
+def _cached_chat(key, client, make_prompt, system_prompt=SYSTEM_PROMPT_DEFAULT, timeout=None):
+    produce = lambda: iter([_chat(client, make_prompt(), system_prompt, timeout)])
+    return "".join(_cached_answer(key, produce, timeout)).strip()
+
+def _cached_chat_stream(key, client, make_prompt, system_prompt=SYSTEM_PROMPT_DEFAULT, timeout=None):
+    produce = lambda: _chat_stream(client, make_prompt(), system_prompt, timeout)
+    return _cached_answer(key, produce, timeout)
+
+
+
+# ===================== プロンプトに入れるメンバー一覧 =====================
+# 特徴の列（リストでもカンマ区切りの文字列でもよい）を、重複と空白を除いたリストにする
+def _feature_list(raw):
+    if raw is None:
+        return []
+    items = raw if isinstance(raw, (list, tuple)) else str(raw).split(",")
+    out = []
+    for x in items:
+        x = str(x).strip()
+        if x and x not in out:
+            out.append(x)
+    return out
+
+# [(名前, [特徴, ...]), ...]。同じ名前が複数行ある場合は特徴をまとめる
+def member_rows(data_json):
+    if isinstance(data_json, pd.DataFrame):
+        records = data_json.to_dict("records")
+    else:
+        records = list(data_json or [])
+    rows = {}
+    for r in records:
+        name = str(r.get("Name") or "").strip()
+        if not name:
+            continue
+        feats = rows.setdefault(name, [])
+        feats.extend(f for f in _feature_list(r.get("Features")) if f not in feats)
+    return list(rows.items())
+
+# 文字のbigram集合（日本語は単語の区切りが無いので、部分一致の目安に使う）
+def _bigrams(text):
+    text = str(text).lower()
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+# 質問語とのローカルな重なりスコア。完全一致・包含は1点、bigramのDice係数が0.5以上なら0.5点
+def _overlap_score(features, query_terms):
+    score = 0.0
+    for f in features:
+        fb = _bigrams(f)
+        best = 0.0
+        for term, tb in query_terms:
+            if f == term or (len(term) >= 2 and (term in f or f in term)):
+                best = 1.0
+                break
+            if 2 * len(fb & tb) / (len(fb) + len(tb)) >= 0.5:
+                best = 0.5
+        score += best
+    return score
+
+# プロンプトの大きさの目安（トークン数）。英数字は約4文字で1トークン、それ以外は1文字1トークンとみなす
+def estimate_tokens(text):
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+def log_prompt_size(request_to_gpt, system_prompt=""):
+    text = system_prompt + request_to_gpt
+    print(f"プロンプト: {len(text)}文字 / 約{estimate_tokens(text)}トークン")
+
+# プロンプトに入れるメンバー一覧を作る。
+#   name : 起点のメンバー（その人の特徴と重なる人を優先し、本人は必ず先頭に入れる）
+#   query: 探したい特徴（空白や読点で区切って複数指定できる）
+# 重なりスコアの高い順に max_members 人、token_budget トークンまで「名前: 特徴, 特徴, ...」を1行ずつ並べる。
+# 入りきらなかった人がいる場合は、その人数を最後の行に書く（一覧が全員分ではないことをAIに伝える）
+def member_context(data_json, name=None, query=None,
+                   max_members=CONTEXT_MAX_MEMBERS, token_budget=CONTEXT_TOKEN_BUDGET):
+    rows = member_rows(data_json)
+    features_of = dict(rows)
+    target = str(name).strip() if name is not None else None
+    terms = []
+    if target in features_of:
+        terms.extend(features_of[target])
+    if query:
+        terms.extend(t for t in re.split(r"[\s、,，/・]+", str(query)) if t)
+    query_terms = [(t, _bigrams(t)) for t in dict.fromkeys(terms)]
+
+    # 同点は元の並び順のまま（sorted は安定ソート）
+    scored = [(_overlap_score(feats, query_terms), i) for i, (n, feats) in enumerate(rows) if n != target]
+    order = [i for _, i in sorted(scored, key=lambda x: -x[0])]
+    if target in features_of:
+        order.insert(0, next(i for i, (n, _) in enumerate(rows) if n == target))
+
+    lines = []
+    used = 0
+    for i in order:
+        if len(lines) >= max_members:
+            break
+        n, feats = rows[i]
+        line = f"{n}: {', '.join(feats)}"
+        cost = estimate_tokens(line) + 1
+        if lines and used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+    omitted = len(rows) - len(lines)
+    if omitted > 0:
+        lines.append(f"（ほか{omitted}人は関連が低いため省略）")
+    print(f"メンバー一覧: {len(rows)}人中 {len(rows) - omitted}人 / 約{used}トークン")
+    return "\n".join(lines)
+
 
 # mode_1-1:共通点探し
 # 解説：選んだユーザー起点に、共通点を見つける関数
 # いちばん多くの人とつながりそうな共通点を出力する。
-def find_major_commons(name, client, data_json):
-    #st.sidebar.caption("共通点が多い人を探索中....")
-    placeholder = st.empty()
-    placeholder.info("みんなとの共通点を探索中....")
-
-    # ChatGPTを呼び出しスクリプト
-    request_to_gpt = (
+def prompt_major_commons(name, data_json):
+    return (
         f"「{name}」が持つ特徴のうち、他のメンバーも同じような特徴を持つものを、共通点として３つ教えてください。\n"
         f"#探索条件: 該当人数が多い特徴、話が弾みそうな特徴を優先する。\n"
         f"#回答形式:\n"
@@ -61,68 +429,193 @@ def find_major_commons(name, client, data_json):
         f"これを、３つの共通点について、それぞれ繰り返してください。\n"
         f"全体の文字数は、最大でも500字程度としてください。\n"
         f"結果だけを回答してください。前置きや、締めくくりの言葉は不要です。\n\n"
-        f"#参照データ：以下はメンバーとその特徴のJSONデータです。これを参照して分析してください。\n"
-        f"{data_json}"
+        f"#参照データ：以下はメンバーとその特徴の一覧です（1行に1人、「名前: 特徴, 特徴, ...」）。これを参照して分析してください。\n"
+        f"{member_context(data_json, name=name)}"
         )
-    # 決めた内容を元にchatGPTへリクエスト
-    response =  client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "あなたはJSONデータを解析するAIです。親しみやすく楽しい口調で、回答します。"},
-            {"role": "user", "content": request_to_gpt}
-        ]
-    )
+
+def request_major_commons(name, client, data_json, timeout=None):
+    return _cached_chat(answer_key("commons", name, data_json), client,
+                        lambda: prompt_major_commons(name, data_json), SYSTEM_PROMPT_COMMONS, timeout)
+
+def stream_major_commons(name, client, data_json, timeout=None):
+    return _cached_chat_stream(answer_key("commons", name, data_json), client,
+                               lambda: prompt_major_commons(name, data_json), SYSTEM_PROMPT_COMMONS, timeout)
+
+def find_major_commons(name, client, data_json):
+    #st.sidebar.caption("共通点が多い人を探索中....")
+    placeholder = st.empty()
+    placeholder.info("みんなとの共通点を探索中....")
+    output_content = request_major_commons(name, client, data_json)
     placeholder.empty()
-    # 返って来たレスポンスの内容
-    output_content = response.choices[0].message.content.strip()
     return output_content 
 
 
+# ===================== 似ている人の順位付け（手元で計算） =====================
+# network_app の辞書バンドル（表記ゆれ・地名・カテゴリ重み）。辞書JSONが無い環境では空の辞書で計算する
+_similarity_dicts = {}
+_similarity_dicts_lock = threading.Lock()
+_network_app = []   # 読み込んだ network_app（読み込めなければ None）
+
+# network_app は「似ている人」を初めて計算するときに読み込む
+# （networkx/pyvis などを使うので、analyze を import しただけでは読み込まない）
+def _load_network_app():
+    with _similarity_dicts_lock:
+        if not _network_app:
+            try:
+                import network_app
+            except ImportError as e:
+                print(f"network_app を読み込めないため、似ている人の順位付けもAIに任せます: {e}")
+                network_app = None
+            _network_app.append(network_app)
+        return _network_app[0]
+
+def similarity_dicts():
+    network_app = _load_network_app()
+    key = network_app.source_fingerprint(network_app.DICT_SOURCE_FILES)
+    with _similarity_dicts_lock:
+        bundle = _similarity_dicts.get(key)
+        if bundle is None:
+            try:
+                # バンドルのファイル（.cache/network_dicts.pkl）は繋がり線モード側で作るので、ここでは書かない
+                bundle = network_app.load_dict_bundle(save=False)
+            except Exception as e:
+                print(f"辞書を読み込めなかったため、辞書なしで似ている人を計算します: {e}")
+                bundle = {"CITY_TO_PREF": {}, "PREF_ALIASES": {}, "PREF_TO_REGION": {}, "REGION_SET": set(),
+                          "TOKEN_CATEGORY": {}, "CANONICAL_MAP": {}, "STOPWORDS": set(), "SUBCAT_WEIGHTS": {}}
+            _similarity_dicts.clear()
+            _similarity_dicts[key] = bundle
+        return key, bundle
+
+# 「name」と似ている順に [(名前, スコア, [共通する特徴, ...]), ...] を最大 k 件返す
+# network_app が無いときは None（従来どおりAIに順位付けを任せる）
+def rank_similar_people(name, data_json, k=SIMILAR_TOP_K):
+    network_app = _load_network_app()
+    if network_app is None:
+        return None
+    dict_key, d = similarity_dicts()
+    records = [{"Name": n, "Features": feats} for n, feats in member_rows(data_json)]
+    members = network_app.parse_people(records, d["CANONICAL_MAP"], d["STOPWORDS"],
+                                       d["CITY_TO_PREF"], d["PREF_ALIASES"], d["PREF_TO_REGION"], d["REGION_SET"],
+                                       d["TOKEN_CATEGORY"], True, True,
+                                       cache_key=f"analyze:{dataset_fingerprint(data_json)}:{dict_key}")
+    ranking = []
+    for j, score, ids in network_app.similar_members(members, str(name).strip(), d["TOKEN_CATEGORY"],
+                                                     d["SUBCAT_WEIGHTS"], k=k):
+        shared = []
+        for t in members.decode(ids):
+            label = network_app.pretty_token(t)
+            if label.startswith(("sub1:", "sub2:")):
+                label = f"ジャンル「{label.split(':', 1)[1]}」"
+            if label not in shared:
+                shared.append(label)
+        ranking.append((members.names[j], score, shared))
+    return ranking
+
+# AIを使わずに順位をそのまま表示する文章
+def format_similar_ranking(name, ranking):
+    if not ranking:
+        return f"「{name}」と共通点のある人は見つかりませんでした。"
+    lines = [f"「{name}」と共通点が多い順に並べたよ！"]
+    for rank, (other, score, shared) in enumerate(ranking, 1):
+        lines.append(f"\n**{rank}位 {other}**（スコア {score:.1f}）\n共通点: {'、'.join(shared)}")
+    return "\n".join(lines)
+
+
 # mode_1-2:共通点探し
 # 解説：選んだユーザー起点に、共通点を見つける関数
 #      いちばん共通点が多そうな人をを出力する。
-#      *スクリプト意外はfind_commonsと同じ。
-def find_similar_person(name, client, data_json):
-    #st.sidebar.caption("共通点が多い人を探索中....")
-    placeholder = st.empty()
-    placeholder.info("共通点のある人を探索中....")
-    # ChatGPTを呼び出しスクリプト
-    request_to_gpt = (
-        f"「{name}」と、共通点が多い人を、「似ている人」として1位から5位まで教えてください。"
-        f"#探索条件: 共通点が多い人が5人も見つからない場合は、4位や3位まででも構いません。\n"
+#      順位は rank_similar_people で手元で決め、AIには紹介文だけを書いてもらう。
+def prompt_similar_person(name, data_json, ranking=None):
+    if ranking is None:
+        ranking = rank_similar_people(name, data_json)
+    if ranking is None:
+        # network_app が無い環境: 従来どおりメンバー一覧から順位付けも任せる
+        return (
+            f"「{name}」と、共通点が多い人を、「似ている人」として1位から5位まで教えてください。"
+            f"#探索条件: 共通点が多い人が5人も見つからない場合は、4位や3位まででも構いません。\n"
+            f"#回答形式:"
+            f"まず、共通点の多い人の名前だけを、太字で書いてください。"
+            f"改行してから、その人が{name}とどういう点が共通または類似しているのかを書いてください。\n"
+            f"#前置きは無しで、名前と理由だけ回答してください。\n"
+            f"#1人につき、100文字から150文字程度にしてください。\n\n"
+            f"#参照データ：以下はメンバーとその特徴の一覧です（1行に1人、「名前: 特徴, 特徴, ...」）。これを参照して分析してください。\n"
+            f"{member_context(data_json, name=name)}"
+            )
+    listing = "\n".join(f"{rank}位 {other}: {', '.join(shared)}"
+                         for rank, (other, _, shared) in enumerate(ranking, 1))
+    return (
+        f"「{name}」と共通点が多い人を、「似ている人」として紹介してください。"
+        f"順位と共通点は計算済みなので、以下の順位のまま、全員を紹介してください。\n"
         f"#回答形式:"
-        f"まず、共通点の多い人の名前だけを、太字で書いてください。"
-        f"改行してから、その人が{name}とどういう点が共通または類似しているのかを書いてください。\n"
+        f"まず、その人の名前だけを、太字で書いてください。"
+        f"改行してから、その人が{name}とどういう点が共通または類似しているのかを、共通点をもとに書いてください。\n"
         f"#前置きは無しで、名前と理由だけ回答してください。\n"
         f"#1人につき、100文字から150文字程度にしてください。\n\n"
-        f"#参照データ：以下はメンバーとその特徴のJSONデータです。これを参照して分析してください。\n"
-        f"{data_json}"
+        f"#似ている人の順位と、{name}との共通点（1行に1人、「順位 名前: 共通点, 共通点, ...」）\n"
+        f"{listing}"
         )
-    # 決めた内容を元にchatGPTへリクエスト
-    response =  client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "あなたはJSONデータを解析するAIです。親しみやすく楽しい口調のキャラクターです。"},
-            {"role": "user", "content": request_to_gpt}
-        ]
-    )
+
+def _similar_answer_key(name, data_json):
+    dict_key = similarity_dicts()[0] if _load_network_app() is not None else None
+    return answer_key("similar", (name, SIMILAR_TOP_K, dict_key), data_json)
+
+# 順位が手元で決まっていて、AIを使わない・使えない場合の回答（None ならAIに頼む）
+def _similar_without_llm(name, client, ranking):
+    if ranking is None:
+        return None
+    if not ranking or client is None or not SIMILAR_USE_LLM:
+        return format_similar_ranking(name, ranking)
+    return None
+
+def request_similar_person(name, client, data_json, timeout=None):
+    ranking = rank_similar_people(name, data_json)
+    text = _similar_without_llm(name, client, ranking)
+    if text is not None:
+        return text
+    try:
+        return _cached_chat(_similar_answer_key(name, data_json), client,
+                            lambda: prompt_similar_person(name, data_json, ranking), timeout=timeout)
+    except Exception as e:
+        if ranking is None:
+            raise
+        print(f"似ている人: AIの応答が得られなかったため、順位をそのまま表示します: {e}")
+        return format_similar_ranking(name, ranking)
+
+def stream_similar_person(name, client, data_json, timeout=None):
+    ranking = rank_similar_people(name, data_json)
+    text = _similar_without_llm(name, client, ranking)
+    if text is not None:
+        yield text
+        return
+    sent = False
+    try:
+        for delta in _cached_chat_stream(_similar_answer_key(name, data_json), client,
+                                         lambda: prompt_similar_person(name, data_json, ranking), timeout=timeout):
+            sent = True
+            yield delta
+    except Exception as e:
+        # 途中まで表示した後の失敗は、そのままエラーとして扱う
+        if ranking is None or sent:
+            raise
+        print(f"似ている人: AIの応答が得られなかったため、順位をそのまま表示します: {e}")
+        yield format_similar_ranking(name, ranking)
+
+def find_similar_person(name, client, data_json):
+    #st.sidebar.caption("共通点が多い人を探索中....")
+    placeholder = st.empty()
+    placeholder.info("共通点のある人を探索中....")
+    output_content = request_similar_person(name, client, data_json)
     placeholder.empty()
-    # 返って来たレスポンスの内容
-    output_content = response.choices[0].message.content.strip()
     return output_content 
 
 
 # mode_1-3:チーム提案
 # 解説：チームメンバーを提案してもらう機能
 #      共通点探しモードのタブ3として追加
-def find_team_member(name, client, data_json):
-    #st.sidebar.caption("共通点が多い人を探索中....")
-    placeholder = st.empty()
-    placeholder.info("最適なチーム員を探索中....")
-    # ChatGPTを呼び出しスクリプト
-    request_to_gpt = (
+def prompt_team_member(name, data_json):
+    return (
         f"「{name}」さんは、これから3人のチームを組んで、ソフトウェアの開発を行います。\n"
-        f"JSONデータを参照して、「{name}」さんと一緒に面白い開発が出来そうな人を教えてください。\n"
+        f"参照データを見て、「{name}」さんと一緒に面白い開発が出来そうな人を教えてください。\n"
         f"#分析条件: "
         f"個人としてだけでなく、3人の特徴から、チーム全体のバランスも考慮してください。\n"
         f"毎回同じ回答にならないように、ランダム性を入れてください。\n"
@@ -130,33 +623,138 @@ def find_team_member(name, client, data_json):
         f"前置きは無しで、まず2人のメンバーを提案してください。その後、おすすめした理由を説明してください。\n"
         f"文字数は、最大でも400文字程度にしてください。\n"
         f"回答の最初は、「今回のおすすめは...」という言い方にしてください。\n\n"
-        f"#参照データ：以下はメンバーとその特徴のJSONデータです。これを参照して分析してください。\n"
-        f"{data_json}"
+        f"#参照データ：以下はメンバーとその特徴の一覧です（1行に1人、「名前: 特徴, 特徴, ...」）。これを参照して分析してください。\n"
+        f"{member_context(data_json, name=name)}"
         )
-    # 決めた内容を元にchatGPTへリクエスト
-    response =  client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "あなたはJSONデータを解析するAIです。親しみやすく楽しい口調のキャラクターです。"},
-            {"role": "user", "content": request_to_gpt}
-        ]
-    )
+
+def request_team_member(name, client, data_json, timeout=None):
+    return _cached_chat(team_answer_key(name, data_json), client,
+                        lambda: prompt_team_member(name, data_json), timeout=timeout)
+
+def stream_team_member(name, client, data_json, timeout=None):
+    return _cached_chat_stream(team_answer_key(name, data_json), client,
+                               lambda: prompt_team_member(name, data_json), timeout=timeout)
+
+def find_team_member(name, client, data_json):
+    #st.sidebar.caption("共通点が多い人を探索中....")
+    placeholder = st.empty()
+    placeholder.info("最適なチーム員を探索中....")
+    output_content = request_team_member(name, client, data_json)
     placeholder.empty()
-    # 返って来たレスポンスの内容
-    output_content = response.choices[0].message.content.strip()
     return output_content
 
 
+# ストリーミングの途中経過を、スレッドから画面（メインスレッド）へ渡すための入れ物
+#  - 各リクエストはスレッドプールで動き、届いた文字列をキューに入れる
+#  - 画面側は updates() を回し、(key, ここまでの本文, 完了したか, 例外) を受け取って表示を更新する
+#  - 1回の更新でキューに溜まった分をまとめて読み、キーごとに最新の本文だけ返す（描画回数を抑える）
+#  - タイムアウトは各リクエストが実際に動き始めてから数える（プールが混んでいて待たされた時間は含めない）
+#  - 時間切れになったり、画面側が途中で読むのをやめたりしたリクエストは、次の断片が届いた時点で止める
+_STARTED = object()   # キューに入れる「動き始めた」の合図
+
+class StreamGroup:
+    def __init__(self, jobs, timeout=DEFAULT_TIMEOUT_SEC):
+        """jobs: {key: (stream_〜 関数, 引数のタプル)}。引数の最後に timeout を付けて呼ぶ"""
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._pending = set(jobs)
+        self._deadlines = {}
+        self._cancelled = {key: threading.Event() for key in jobs}
+        for key, (func, args) in jobs.items():
+            _executor.submit(self._pump, key, func, args)
+
+    def cancel(self, key=None):
+        """key（省略時は全部）のリクエストを止める"""
+        for k, event in self._cancelled.items():
+            if key is None or k == key:
+                event.set()
+
+    def _pump(self, key, func, args):
+        cancelled = self._cancelled[key]
+        if cancelled.is_set():
+            return
+        self._queue.put((key, _STARTED, False, None))
+        text = ""
+        stream = None
+        try:
+            stream = func(*args, self.timeout)
+            for delta in stream:
+                if cancelled.is_set():
+                    return
+                text += delta
+                self._queue.put((key, text, False, None))
+            self._queue.put((key, text.strip(), True, None))
+        except Exception as e:
+            self._queue.put((key, text, True, e))
+        finally:
+            # 途中でやめた場合も、ジェネレータを閉じてAPIの接続を切る
+            close = getattr(stream, "close", None)
+            if close is not None:
+                close()
+
+    def _next_wait(self):
+        if not self.timeout:
+            return None
+        started = [self._deadlines[k] for k in self._pending if k in self._deadlines]
+        if not started:
+            return None   # まだどれも動き始めていない（合図が来たら起きる）
+        return max(0.0, min(started) - time.monotonic())
+
+    def updates(self):
+        try:
+            while self._pending:
+                wait = self._next_wait()
+                items = []
+                try:
+                    items.append(self._queue.get(timeout=wait) if wait != 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                while True:
+                    try:
+                        items.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                latest = {}
+                for key, text, done, error in items:
+                    if key not in self._pending:
+                        continue
+                    if text is _STARTED:
+                        self._deadlines[key] = time.monotonic() + self.timeout if self.timeout else None
+                        continue
+                    # 完了の通知は上書きしない（途中経過より後に来るので、そのまま最新になる）
+                    latest[key] = (text, done, error)
+                for key, (text, done, error) in latest.items():
+                    if done:
+                        self._pending.discard(key)
+                    yield key, text, done, error
+                # 時間切れ: 動き始めてから timeout 秒たっても終わらないものはエラーとして返し、止める
+                now = time.monotonic()
+                for key in sorted(self._pending):
+                    deadline = self._deadlines.get(key)
+                    if deadline is not None and deadline <= now:
+                        self._pending.discard(key)
+                        self.cancel(key)
+                        yield key, "", True, TimeoutError(f"{self.timeout}秒以内に応答がありませんでした")
+        finally:
+            # 画面側が途中で読むのをやめた（再実行など）場合も、残りのリクエストを止める
+            self.cancel()
+
+# mode_1:共通点探しの3つのリクエストをストリーミングで並列に開始する
+MODE1_STREAMS = {
+    "commons": stream_major_commons,
+    "similar": stream_similar_person,
+    "team": stream_team_member,
+}
+
+def start_mode1_streams(name, client, data_json, timeout=DEFAULT_TIMEOUT_SEC):
+    return StreamGroup({key: (func, (name, client, data_json)) for key, func in MODE1_STREAMS.items()}, timeout)
+
+
 # mode_2:特徴探し
 # 解説：共通点を入力して、同じ共通点を持つ人を探す機能
-def search_by_common(common_point, client, data_json):
-    #st.sidebar.caption("メンバーを探索中....")
-    placeholder = st.empty()
-    placeholder.info("同じ共通点を持つ人を探索中....")
-    # ChatGPTを呼び出しスクリプト
-    print("特徴", common_point)
-    request_to_gpt = (
-        f"JSONデータを参照して、「{common_point}」を特徴に持つ人を探してください。"
+def prompt_search_by_common(common_point, data_json):
+    return (
+        f"参照データを見て、「{common_point}」を特徴に持つ人を探してください。"
         f"#分析条件: 私が誰かを考慮する必要がありません。フラットに「{common_point}」という特徴の人を探してください。"
         f"#分析条件: 似たキーワードも対象に含めてください。例えば「阪神ファン」と「甲子園出場」は、どちらも野球に関心がある点で共通しています。\n"
         f"#分析条件: 該当する人を漏らさないように、最大10人まで教えてください。"
@@ -164,19 +762,25 @@ def search_by_common(common_point, client, data_json):
         f"{common_point}に関係する人を調べたよ！\n"
         f"（1人目の名前）\n（その人を選んだ理由）\n\n（2人目の名前）\n（その人を選んだ理由）\n"
         f"\n"
-        f"#メンバーとその特徴はデータ（JSON）\n"
-        f"{data_json}"
+        f"#参照データ：メンバーとその特徴の一覧（1行に1人、「名前: 特徴, 特徴, ...」）\n"
+        f"{member_context(data_json, query=common_point)}"
         )
-    # 決めた内容を元にchatGPTへリクエスト
-    response =  client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "あなたはJSONデータを解析するAIです。親しみやすく楽しい口調のキャラクターです。"},
-            {"role": "user", "content": request_to_gpt}
-        ]
-    )
+
+def request_search_by_common(common_point, client, data_json, timeout=None):
+    return _cached_chat(answer_key("search", common_point, data_json), client,
+                        lambda: prompt_search_by_common(common_point, data_json), timeout=timeout)
+
+def stream_search_by_common(common_point, client, data_json, timeout=None):
+    return _cached_chat_stream(answer_key("search", common_point, data_json), client,
+                               lambda: prompt_search_by_common(common_point, data_json), timeout=timeout)
+
+def search_by_common(common_point, client, data_json):
+    #st.sidebar.caption("メンバーを探索中....")
+    placeholder = st.empty()
+    placeholder.info("同じ共通点を持つ人を探索中....")
+    # ChatGPTを呼び出しスクリプト
+    print("特徴", common_point)
+    output_content = request_search_by_common(common_point, client, data_json)
     placeholder.empty()
-    # 返って来たレスポンスの内容
-    output_content = response.choices[0].message.content.strip()
     
     return output_content
@@ -0,0 +1,89 @@
+import argparse
+import glob
+import os
+import time
+
+from extraction_cache import PageStore, DEFAULT_CACHE_DIR, PAGE_STORE_FILE
+from html_extract import html_to_text, html_to_text_legacy, lxml
+
+# ############### bench_html_extract.pyの説明 ################
+#
+# LPのHTML→テキスト抽出のマイクロベンチマーク。
+# 従来の抽出処理（BeautifulSoup + html.parser）と、html_extract の各エンジンを比較する。
+#
+# 使用方法:
+#   python bench_html_extract.py                 # data_extraction.py が保存したページ(.cache/)を使う
+#   python bench_html_extract.py --pages dir/    # dir/*.html を使う
+#
+# 保存済みページが無い場合は、ナビ・フッター付きのダミーページを生成して計測する。
+#
+# ###########################################################
+
+
+def load_pages(pages_dir=None):
+    if pages_dir:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(pages_dir, "*.html"))):
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                pages.append(f.read())
+        return pages
+    path = os.path.join(DEFAULT_CACHE_DIR, PAGE_STORE_FILE)
+    if not os.path.exists(path):
+        return []
+    store = PageStore(path)
+    pages = [html for html in (store.get_html(url) for url in store.urls()) if html]
+    store.close()
+    return pages
+
+# ナビ・フッター・非表示要素を含むダミーページ
+def synthetic_pages(n=20, sections=200):
+    nav = "<nav><ul>" + "".join(f"<li><a href='/p{i}'>メニュー{i}</a></li>" for i in range(10)) + "</ul></nav>"
+    footer = "<footer><p>© なかまっぷ</p><p>プライバシーポリシー</p></footer>"
+    pages = []
+    for p in range(n):
+        body = []
+        for s in range(sections):
+            body.append(nav if s % 20 == 0 else "")
+            body.append(f"<section><h2>見出し{p}-{s}</h2><p>温泉とサウナが好きです。趣味{s}の話。</p>"
+                        f"<div style='display: none'>非表示{s}</div><script>var x={s};</script></section>")
+        pages.append(f"<html><head><title>LP{p}</title><style>p{{}}</style></head><body>"
+                     f"{''.join(body)}{footer}</body></html>")
+    return pages
+
+
+def bench(name, func, pages, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        outputs = [func(html) for html in pages]
+    elapsed = time.perf_counter() - start
+    per_page_ms = elapsed / (repeat * len(pages)) * 1000
+    avg_chars = sum(len(t) for t in outputs) / len(outputs)
+    print(f"{name:<28} {per_page_ms:8.2f} ms/page   平均 {avg_chars:9.0f} 文字")
+    return per_page_ms
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="LPのHTML→テキスト抽出の速度比較")
+    parser.add_argument("--pages", help="*.html を置いたディレクトリ（省略時は .cache/ の保存済みページ）")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    pages = load_pages(args.pages)
+    if not pages:
+        print("保存済みページが無いため、ダミーページで計測します。")
+        pages = synthetic_pages()
+    print(f"{len(pages)}ページ x {args.repeat}回, 平均 {sum(map(len, pages)) / len(pages) / 1024:.1f}KB/page\n")
+
+    base = bench("従来 (bs4, 上限なし)", html_to_text_legacy, pages, args.repeat)
+    bench("bs4 (重複除去+上限)", lambda h: html_to_text(h, engine="bs4"), pages, args.repeat)
+    if lxml is not None:
+        fast = bench("lxml (重複除去+上限)", lambda h: html_to_text(h, engine="lxml"), pages, args.repeat)
+        bench("lxml (重複除去なし,上限なし)",
+              lambda h: html_to_text(h, engine="lxml", max_chars=0, dedupe=False), pages, args.repeat)
+        print(f"\nlxml は従来比 {base / fast:.1f}倍速")
+    else:
+        print("lxml がインストールされていないため、lxml エンジンは計測しません。")
+
+
+if __name__ == "__main__":
+    main()
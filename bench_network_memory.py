@@ -0,0 +1,127 @@
+import argparse
+import random
+import time
+import tracemalloc
+
+from network_app import (canonicalize_token, geo_canonicalize, geo_expand_tokens, normalize_key,
+                         parse_people, score_member_pairs)
+
+# ############### bench_network_memory.pyの説明 ################
+#
+# 繋がり線モードのメンバー特徴の持ち方を比較するベンチマーク。
+#   - 従来: メンバーごとに set[str]（"geo:pref:愛知県" のような文字列の集合）。
+#           解析も従来どおりキーワード1つずつ正規化・地理展開する（legacy_parse_features）
+#   - 現在: 全員で共有する語彙 + メンバーごとのトークン番号配列 array('I')（MemberFeatures）
+#
+# 使用方法:
+#   python bench_network_memory.py               # 10,000人のダミー名簿
+#   python bench_network_memory.py --members 3000
+#
+# 実データは使わず、市区町村・都道府県・趣味などのダミー辞書とダミー名簿を生成して計測する。
+#
+# ##############################################################
+
+
+REGIONS = ["北海道", "東北", "関東", "中部", "近畿", "中国", "四国", "九州"]
+
+
+def synthetic_dicts(n_prefs=47, n_cities=400, n_tokens=3000):
+    prefs = [f"県{p:02d}県" for p in range(n_prefs)]
+    pref_to_region = {p: REGIONS[k % len(REGIONS)] for k, p in enumerate(prefs)}
+    city_to_pref = {f"市{c:03d}": prefs[c % n_prefs] for c in range(n_cities)}
+    categories = ["hobby", "role", "industry", "education", "other"]
+    token_category = {}
+    for t in range(n_tokens):
+        token_category[f"趣味{t:04d}"] = (categories[t % len(categories)], f"sub1_{t % 40}", f"sub2_{t % 150}")
+    return {
+        "CANONICAL_MAP": {}, "STOPWORDS": set(),
+        "CITY_TO_PREF": city_to_pref, "PREF_ALIASES": {}, "PREF_TO_REGION": pref_to_region,
+        "REGION_SET": set(REGIONS), "TOKEN_CATEGORY": token_category,
+    }
+
+
+def synthetic_roster(dicts, members, features, seed=0):
+    rng = random.Random(seed)
+    cities = list(dicts["CITY_TO_PREF"])
+    tokens = list(dicts["TOKEN_CATEGORY"])
+    records = []
+    for m in range(members):
+        feats = [rng.choice(cities)] + rng.sample(tokens, features - 1)
+        records.append({"Name": f"メンバー{m}", "Features": feats})
+    return records
+
+
+def legacy_parse_features(raw, CANONICAL_MAP, STOPWORDS, CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET,
+                          token_category, enable_link_sub1, enable_link_sub2):
+    """展開表（TokenExpander）を入れる前の parse_features と同じ処理（比較用）"""
+    if raw is None: return set()
+    items = raw if isinstance(raw, list) else [x for x in str(raw).split(",")]
+    toks = set()
+    for x in items:
+        if not str(x).strip(): continue
+        norm = normalize_key(x)
+        canon = canonicalize_token(norm, CANONICAL_MAP)
+        if not canon or normalize_key(canon) in STOPWORDS: continue
+        c, p, r = geo_canonicalize(normalize_key(canon), CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET)
+        if c or p or r:
+            toks |= geo_expand_tokens(normalize_key(canon), CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET)
+        else:
+            tok = normalize_key(canon)
+            toks.add(tok)
+            cat, sub1, sub2 = token_category.get(tok, ("other","other","other"))
+            if enable_link_sub1 and sub1 and sub1 != "other":
+                toks.add(f"link:sub1:{sub1}")
+            if enable_link_sub2 and sub2 and sub2 != "other":
+                toks.add(f"link:sub2:{sub2}")
+    return toks
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="メンバー特徴の持ち方によるメモリ量の比較")
+    parser.add_argument("--members", type=int, default=10000)
+    parser.add_argument("--features", type=int, default=20, help="1人あたりの生キーワード数")
+    args = parser.parse_args(argv)
+
+    d = synthetic_dicts()
+    records = synthetic_roster(d, args.members, args.features)
+    dict_args = (d["CANONICAL_MAP"], d["STOPWORDS"], d["CITY_TO_PREF"], d["PREF_ALIASES"],
+                 d["PREF_TO_REGION"], d["REGION_SET"], d["TOKEN_CATEGORY"], True, True)
+
+    # 従来: 1人ずつ・キーワード1つずつ解析して set[str] で持つ（トークン文字列も1人ずつ作られる）
+    def build_sets():
+        return [(r["Name"], legacy_parse_features(r["Features"], *dict_args)) for r in records]
+
+    # 現在: 共有の展開表で解析し、語彙 + array('I') にまとめる
+    def build_compact():
+        return parse_people(records, *dict_args)
+
+    people, before, t_before = measure(build_sets)
+    members, after, t_after = measure(build_compact)
+    assert all(members.tokens(i) == sorted(feats) for i, (_, feats) in enumerate(people))
+
+    n = len(records)
+    print(f"{n}人 / 1人あたり平均 {sum(members.size(i) for i in range(n)) / n:.1f}トークン "
+          f"/ 語彙 {len(members.vocab)}語\n")
+    print(f"{'set[str]':<24} {before / n:8.0f} bytes/人   合計 {before / 1024 / 1024:7.1f}MB   解析 {t_before:.2f}秒")
+    print(f"{'語彙 + array(I)':<24} {after / n:8.0f} bytes/人   合計 {after / 1024 / 1024:7.1f}MB   解析 {t_after:.2f}秒")
+    print(f"\nメモリは従来の {after / before:.2f} 倍")
+
+    # 参考: 先頭1000人での全ペアのスコア計算時間
+    sample = members.subset(members.names[:1000])
+    start = time.perf_counter()
+    pairs = score_member_pairs(sample, 0.0, d["TOKEN_CATEGORY"], {}, 0.6, 0.6, engine="python")
+    print(f"先頭{len(sample)}人の全ペア計算 (python): {time.perf_counter() - start:.2f}秒, {len(pairs)}ペア")
+
+
+if __name__ == "__main__":
+    main()
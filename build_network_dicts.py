@@ -0,0 +1,48 @@
+import argparse
+import os
+import sys
+import time
+
+from network_app import DICT_BUNDLE_FILE, DICT_SOURCE_FILES, OPTIONAL_DICT_SOURCE_FILES, compile_dict_bundle
+
+# ############### build_network_dicts.pyの説明 ################
+#
+# 繋がり線モードで使う7つの辞書JSON（geo_*.json, token_category.json, canonical_map.json,
+# stopwords.json, subcategory_weights.json）を、正規化済みの1つのpickle（辞書バンドル）にまとめる。
+#
+# 使用方法:
+#   python build_network_dicts.py
+#
+# main.py / network_app.py は、元JSONが更新されていればバンドルを自動で作り直すので、
+# このスクリプトは事前に作っておきたいとき（初回表示を速くしたいとき）だけ実行すればよい。
+#
+# ##############################################################
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="繋がり線モード用の辞書バンドルを作る")
+    parser.add_argument("--out", default=DICT_BUNDLE_FILE, help=f"出力先（既定: {DICT_BUNDLE_FILE}）")
+    args = parser.parse_args(argv)
+
+    # 必須の辞書が無いとバンドルは作れないので、先に確かめる
+    missing = [p for p in DICT_SOURCE_FILES if not os.path.exists(p) and p not in OPTIONAL_DICT_SOURCE_FILES]
+    if missing:
+        print(f"必須の辞書JSONが見つかりません: {', '.join(missing)}")
+        return 1
+
+    start = time.perf_counter()
+    bundle = compile_dict_bundle(args.out)
+    elapsed = time.perf_counter() - start
+
+    for path in DICT_SOURCE_FILES:
+        print(f"  {path:<28} {'読み込み' if bundle['sources'][path] else '無し（空として扱う）'}")
+    print(f"辞書バンドルを作成しました: {args.out} ({elapsed:.2f}秒)")
+    # 内容ハッシュは、元JSONの更新時刻だけが変わったときに作り直しを省く判定に使う
+    print(f"  バージョン {bundle['version']} / 内容ハッシュ {bundle['content_hash'][:16]}")
+    print(f"  市区町村 {len(bundle['CITY_TO_PREF'])}件 / トークン分類 {len(bundle['TOKEN_CATEGORY'])}件 / "
+          f"同義語 {len(bundle['CANONICAL_MAP'])}件 / ストップワード {len(bundle['STOPWORDS'])}件")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
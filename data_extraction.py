@@ -1,10 +1,25 @@
 import streamlit as st 
 import pandas as pd
+import numpy as np
 import requests
-from bs4 import BeautifulSoup
 from openai import OpenAI
 import os
 import toml
+import argparse
+import threading
+import json
+import codecs
+import time
+import csv
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+try:
+    import tiktoken  # 任意。無い場合は文字数でトークン数を見積もる
+except ImportError:
+    tiktoken = None
+from extraction_cache import KeywordCache, PageStore, content_key, DEFAULT_MAX_AGE_DAYS, DEFAULT_MAX_MB
+from html_extract import html_to_text, extractor_signature, DEFAULT_ENGINE, DEFAULT_MAX_CHARS
 
 # ############### data_extraction.pyの説明 ################
 #
@@ -15,6 +30,20 @@ import toml
 # 
 # 使用方法:
 #  .envに OPENAI_API_KEY を保存する必要があります。
+#  python data_extraction.py --workers 8 のように指定すると、
+#  スクレイピングとキーワード抽出をメンバー単位で並列実行します。（既定は直列）
+#  GPTの応答は .cache/ に保存され、入力が変わらなければ再実行時はAPIを呼びません。
+#  LPも .cache/ に保存し、次回は条件付きGET（ETag/Last-Modified）で変わったページだけ取り直します。
+#  （--no-cache で無効化）
+#  --batch-intro を付けると、自己紹介文を複数人分まとめて1リクエストで抽出します。（往復回数の削減）
+#  --lp-chunk-tokens 3000 のように指定すると、長いLPは分割して並列に抽出し、結果をまとめます。
+#  --incremental を付けると、前回実行時のマニフェスト(extraction_manifest.json)と比べて
+#  追加・変更された行だけを再抽出し、削除されたメンバーは出力から外します。
+#  マニフェストは --incremental のとき（または --save-manifest を付けたとき）だけ書き出します。
+#  差分更新でもLPは毎回条件付きGETで確認します（変わっていなければ304で本文は届きません）。
+#  --lp-fresh-hours 24 のように指定すると、その時間内に取得済みのLPは通信せずにそのまま使います。
+#  処理済みのメンバーは1人ずつ out_records.jsonl に追記されるので、途中で止まっても結果は残ります。
+#  止まった場合は --resume を付けて再実行すると、処理済みのメンバーを飛ばして続きから再開します。
 # 
 # #########################################################
 
@@ -28,6 +57,40 @@ load_dotenv()
 api_key = os.getenv("OPENAI_API_KEY")
 client = OpenAI(api_key=api_key)
 
+# キーワード抽出に使うモデル
+# 5-nanoから4o-miniに変更しています。
+# 5-nanoだと、謎キーワードがいくつか生じる印象
+GPT_MODEL = "gpt-4o-mini"
+
+# 並列実行の設定（コマンドライン引数で上書き可能）
+DEFAULT_WORKERS = 1           # メンバー単位の並列数。1なら従来どおり直列実行
+DEFAULT_PER_HOST_LIMIT = 2    # 同一ホストへの同時スクレイピング数の上限
+DEFAULT_LLM_CONCURRENCY = 4   # OpenAI APIへの同時リクエスト数の上限（全体）
+
+# LP取得の設定
+LP_TIMEOUT = 10                        # 秒
+DEFAULT_LP_MAX_BYTES = 2 * 1024 * 1024  # これを超える分はダウンロードしない
+DEFAULT_LP_FRESH_HOURS = 0             # この時間内に取得済みのLPは通信せずに使う（0なら毎回確認する）
+
+# 処理済みメンバーを1行ずつ追記するファイル（JSON Lines）
+RECORDS_FILE = "out_records.jsonl"
+
+# LPから抽出するキーワードの上限（script_for_LP の指示と合わせる）
+LP_KEYWORD_LIMIT = 40
+
+# 長いLPの分割抽出（--lp-chunk-tokens）の設定
+DEFAULT_LP_CHUNK_TOKENS = 0     # 0なら分割しない
+DEFAULT_LP_MAX_CHUNKS = 8       # 1ページあたりの最大分割数（これを超える後半部分は使わない）
+
+# 自己紹介文のまとめ抽出（--batch-intro）の設定
+DEFAULT_BATCH_TOKENS = 3000     # 1リクエストに詰める自己紹介文の合計トークン数の目安
+DEFAULT_BATCH_MAX_MEMBERS = 20  # 1リクエストに詰める最大人数
+
+# 差分更新用のマニフェスト（行ごとの指紋と抽出結果のキーワードだけを保存する。LP本文は保存しない）
+MANIFEST_FILE = "extraction_manifest.json"
+MANIFEST_VERSION = 1
+MANIFEST_FIELDS = ('Name', 'url', 'intro_hash', 'intro_keywords', 'lp_hash', 'lp_keywords')
+
 # 自己紹介文からキーワード抽出するスクリプト
 script_for_introduction = (
     f"以下のデータは、ある人の自己紹介です。\n"
@@ -38,6 +101,19 @@ script_for_introduction = (
     f"人名（趣味に関する芸名・アーティスト名は除く）と会社名・所属組織名は、日本語・英語表記問わず抽出しないでください。\n"
 )
 
+# 自己紹介文を複数人分まとめてキーワード抽出するスクリプト（--batch-intro 用）
+# 抽出条件は script_for_introduction と同じで、出力だけJSON形式にしている。
+script_for_introduction_batch = (
+    f"以下のデータは、複数の人の自己紹介です。各自己紹介は「### ID」の行から始まります。\n"
+    f"それぞれの人について、その人の特徴を表すキーワードを抽出してください。\n"
+    f"キーワードは8文字以内を目安に、キーワード数は1人につき最大20個までとしてください。\n"
+    f"その人の特徴を現わさないものはキーワードにしないでください。（例: 「よろしく」などの挨拶文, 息子の年齢）\n"
+    f"人名（趣味に関する芸名・アーティスト名は除く）と会社名・所属組織名は、日本語・英語表記問わず抽出しないでください。\n"
+    f"他の人の自己紹介の内容を混ぜないでください。\n"
+    f"出力はJSONオブジェクトのみとし、キーをID、値をキーワードを,（半角カンマ）で区切った文字列にしてください。\n"
+    f"（例: {{\"3\": \"温泉,サウナ\", \"5\": \"ランニング,野球観戦\"}}）\n"
+)
+
 # スクレイピングデータからキーワード抽出するスクリプト
 script_for_LP = (
     f"以下のURLは、ある人が自分の仕事や趣味などを紹介するために作成したwebページのデータです。\n"
@@ -48,10 +124,92 @@ script_for_LP = (
     f"人名（趣味に関する芸名・アーティスト名は除く）と会社名・所属組織名は、日本語・英語表記問わず抽出しないでください。\n"
 )
 
+# 長いLPを分割して抽出するとき（--lp-chunk-tokens）に、script_for_LP の後ろに付ける補足
+script_for_LP_chunk_note = (
+    f"※ページが長いため、ページの一部分だけを渡しています。この部分から読み取れるキーワードだけを出力してください。\n"
+)
+
 
 
 # ################### 関数定義 #####################
 
+# ---- GPT応答のキャッシュ ----
+# configure_cache() で有効化する。None の場合はキャッシュなし（毎回APIを呼ぶ）。
+# page_store も同様に、None なら毎回LPをダウンロードする。
+keyword_cache = None
+page_store = None
+
+def configure_cache(enabled=True, max_age_days=DEFAULT_MAX_AGE_DAYS, max_mb=DEFAULT_MAX_MB):
+    global keyword_cache, page_store
+    if keyword_cache is not None:
+        keyword_cache.close()
+    if page_store is not None:
+        page_store.close()
+    keyword_cache = KeywordCache(max_age_days=max_age_days, max_mb=max_mb) if enabled else None
+    page_store = PageStore() if enabled else None
+    return keyword_cache
+
+# ---- 同時実行数の制御 ----
+# OpenAI APIは全体で、スクレイピングはホストごとに同時実行数を制限する。
+# (netlifyなど同じホストにLPが集中しているため、ホスト単位で絞らないと相手先に負荷をかける)
+_llm_semaphore = threading.BoundedSemaphore(DEFAULT_LLM_CONCURRENCY)
+_per_host_limit = DEFAULT_PER_HOST_LIMIT
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+_lp_max_bytes = DEFAULT_LP_MAX_BYTES
+# HTML→テキスト抽出の設定（html_extract.html_to_text に渡す）
+_extract_options = {'engine': DEFAULT_ENGINE, 'max_chars': DEFAULT_MAX_CHARS, 'dedupe': True}
+# 長いLPの分割抽出の設定
+_lp_chunk_options = {'chunk_tokens': DEFAULT_LP_CHUNK_TOKENS, 'max_chunks': DEFAULT_LP_MAX_CHUNKS}
+# LPの再利用（--resume / --lp-fresh-hours）。reuse_after 以降にダウンロード済みのページは通信せずに使う
+_page_reuse = {'reuse_after': None}
+
+# run_started（中断した実行の開始時刻）以降か、fresh_hours 時間以内に取得したページを再利用する
+def configure_page_reuse(run_started=None, fresh_hours=DEFAULT_LP_FRESH_HOURS, now=None):
+    since = [run_started] if run_started is not None else []
+    if fresh_hours and fresh_hours > 0:
+        since.append((time.time() if now is None else now) - fresh_hours * 3600)
+    _page_reuse['reuse_after'] = min(since) if since else None
+
+def configure_concurrency(llm_concurrency=DEFAULT_LLM_CONCURRENCY, per_host_limit=DEFAULT_PER_HOST_LIMIT,
+                          lp_max_bytes=DEFAULT_LP_MAX_BYTES, html_engine=DEFAULT_ENGINE,
+                          lp_max_chars=DEFAULT_MAX_CHARS, dedupe=True,
+                          lp_chunk_tokens=DEFAULT_LP_CHUNK_TOKENS, lp_max_chunks=DEFAULT_LP_MAX_CHUNKS):
+    global _llm_semaphore, _per_host_limit, _lp_max_bytes, _http_session
+    _llm_semaphore = threading.BoundedSemaphore(max(1, int(llm_concurrency)))
+    _per_host_limit = max(1, int(per_host_limit))
+    _lp_max_bytes = int(lp_max_bytes)
+    _extract_options.update(engine=html_engine, max_chars=int(lp_max_chars), dedupe=bool(dedupe))
+    _lp_chunk_options.update(chunk_tokens=int(lp_chunk_tokens), max_chunks=max(1, int(lp_max_chunks)))
+    with _host_semaphores_lock:
+        _host_semaphores.clear()
+        _http_session = None
+
+def _host_semaphore(request_url):
+    host = urlparse(str(request_url).strip()).netloc.lower()
+    with _host_semaphores_lock:
+        sem = _host_semaphores.get(host)
+        if sem is None:
+            sem = threading.BoundedSemaphore(_per_host_limit)
+            _host_semaphores[host] = sem
+        return sem
+
+# ---- HTTPセッション ----
+# 全スレッドで1つのセッションを共有し、同じホストへの接続（keep-alive）を使い回す。
+_http_session = None
+
+def _get_http_session():
+    global _http_session
+    with _host_semaphores_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=max(_per_host_limit, 4))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _http_session = session
+        return _http_session
+
+
 # 与えられたテキストからキーワードを抽出する関数。
 # 引数：Notion自己紹介文(Introduction)とLPからスクレイピングしたテキスト群(LP_text)
 # exclude_keywords に既存のキーワードを渡すと、それらを除外するようGPTへ指示します。
@@ -70,6 +228,14 @@ def run_gpt_to_keywords(text, script="", exclude_keywords=None):
             exclude_list = [kw.strip() for kw in exclude_keywords.split(',') if kw.strip()]
         else:
             exclude_list = [str(kw).strip() for kw in exclude_keywords if str(kw).strip()]
+
+    # キャッシュ確認（キーはモデル・スクリプト・除外キーワード・入力テキストから作る）
+    cache_key = content_key(GPT_MODEL, script, exclude_list, text)
+    if keyword_cache is not None:
+        cached = keyword_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
     if exclude_list:
         listed = ', '.join(exclude_list)
         script += (
@@ -79,36 +245,222 @@ def run_gpt_to_keywords(text, script="", exclude_keywords=None):
         script + '\n\n' + text
     )
 
-    response = client.chat.completions.create(
-        # モデル選択
-        # 5-nanoから4o-miniに変更しています。
-        # 5-nanoだと、謎キーワードがいくつか生じる印象
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "user", "content": request_to_gpt},
-        ],
-    )
-    output_content = response.choices[0].message.content.strip()
+    output_content = _chat(request_to_gpt)
+    if keyword_cache is not None:
+        keyword_cache.put(cache_key, output_content)
     return output_content
 
+# GPTへの1リクエスト（同時実行数は _llm_semaphore で制限）
+def _chat(request_to_gpt, **kwargs):
+    with _llm_semaphore:
+        response = client.chat.completions.create(
+            model=GPT_MODEL,
+            messages=[
+                {"role": "user", "content": request_to_gpt},
+            ],
+            **kwargs,
+        )
+    return (response.choices[0].message.content or "").strip()
+
+# トークン数を数える（tiktokenが無い環境では文字数で代用。日本語はほぼ1文字1トークン以上なので安全側）
+_encoding = None
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.encoding_for_model(GPT_MODEL)
+        except KeyError:
+            _encoding = tiktoken.get_encoding("o200k_base")
+    return _encoding
+
+def count_tokens(text):
+    if tiktoken is None:
+        return len(text)
+    return len(_get_encoding().encode(text))
+
+# テキストを最大 chunk_tokens トークンずつに分割する
+# トークン境界は文字の途中（日本語のマルチバイト文字など）にあることがあるので、
+# バイト列で復元し、切れた文字の残りバイトは次のチャンクの先頭に回す（U+FFFDにしない）。
+def split_by_tokens(text, chunk_tokens):
+    if tiktoken is None:
+        return [text[i:i + chunk_tokens] for i in range(0, len(text), chunk_tokens)]
+    encoding = _get_encoding()
+    tokens = encoding.encode(text)
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = []
+    for i in range(0, len(tokens), chunk_tokens):
+        final = i + chunk_tokens >= len(tokens)
+        chunk = decoder.decode(encoding.decode_bytes(tokens[i:i + chunk_tokens]), final=final)
+        if chunk:
+            chunks.append(chunk)
+    return chunks
+
+
+# ---- LPからのキーワード抽出（長いページは分割して並列に抽出→統合） ----
+# 戻り値は run_gpt_to_keywords と同じカンマ区切り文字列。
+# 分割数は max_chunks までに抑えるので、ページがどれだけ長くても1人あたりの待ち時間は
+# 「1チャンク分の抽出」×（max_chunks / LLM同時実行数）程度で頭打ちになる。
+def run_gpt_to_lp_keywords(lp_text, exclude_keywords=None):
+    chunk_tokens = _lp_chunk_options['chunk_tokens']
+    if not chunk_tokens or count_tokens(str(lp_text)) <= chunk_tokens:
+        return run_gpt_to_keywords(lp_text, script_for_LP, exclude_keywords=exclude_keywords)
+
+    chunks = [c for c in split_by_tokens(str(lp_text).strip(), chunk_tokens) if c.strip()]
+    if len(chunks) > _lp_chunk_options['max_chunks']:
+        print(f"  LPが長いため、先頭 {_lp_chunk_options['max_chunks']}/{len(chunks)} チャンクのみ使います。")
+        chunks = chunks[:_lp_chunk_options['max_chunks']]
+    script = script_for_LP + script_for_LP_chunk_note
+    with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+        chunk_results = list(executor.map(
+            lambda chunk: run_gpt_to_keywords(chunk, script, exclude_keywords=exclude_keywords), chunks))
+
+    # チャンク順に統合（重複・自己紹介で抽出済みのキーワードは除き、上限で打ち切る）
+    excluded = set(split_keywords(exclude_keywords) if isinstance(exclude_keywords, str)
+                   else [str(kw).strip() for kw in (exclude_keywords or [])])
+    merged = []
+    for result in chunk_results:
+        for kw in split_keywords(result):
+            if kw not in excluded and kw not in merged:
+                merged.append(kw)
+    return ','.join(merged[:LP_KEYWORD_LIMIT])
+
+
+# ---- 自己紹介文のまとめ抽出（--batch-intro） ----
+# items: [(ID, 自己紹介文), ...]  戻り値: {ID: キーワード文字列}
+# まとめ抽出の結果は単発抽出とはプロンプトが違うので、別のキー（intro_batch_key）で保存する。
+# 読み出し時は単発抽出の結果があればそれを優先して使う（単発モード側にまとめ抽出の結果は混ざらない）。
+def intro_batch_key(text):
+    return content_key(GPT_MODEL, script_for_introduction_batch, "batch", [], text)
+
+def run_gpt_to_keywords_batched(items, max_tokens=DEFAULT_BATCH_TOKENS, max_members=DEFAULT_BATCH_MAX_MEMBERS,
+                                workers=1):
+    results = {}
+    pending = []
+    for member_id, text in items:
+        text = str(text).strip()
+        cached = None
+        if keyword_cache is not None:
+            cached = keyword_cache.get(content_key(GPT_MODEL, script_for_introduction, [], text))
+            if cached is None:
+                cached = keyword_cache.get(intro_batch_key(text))
+        if cached is not None:
+            results[member_id] = cached
+        else:
+            pending.append((str(member_id), text))
+
+    # トークン数の目安を超えない範囲で詰めていく
+    batches, batch, batch_tokens = [], [], 0
+    for member_id, text in pending:
+        tokens = count_tokens(text)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_members):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append((member_id, text))
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    if batches:
+        print(f"自己紹介文 {len(pending)}件を {len(batches)}リクエストにまとめて抽出します。")
+
+    if workers <= 1:
+        batch_results = [_run_intro_batch(b) for b in batches]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            batch_results = list(executor.map(_run_intro_batch, batches))
+    for batch, batch_result in zip(batches, batch_results):
+        for member_id, text in batch:
+            keywords = batch_result[member_id]
+            if keyword_cache is not None:
+                keyword_cache.put(intro_batch_key(text), keywords)
+            results[member_id] = keywords
+    return results
+
+# 1バッチ分のリクエスト。応答が壊れていたり欠けていたりしたら、足りない分を半分に分けて再リクエストする。
+def _run_intro_batch(batch):
+    if len(batch) == 1:
+        # 1人だけなら通常の抽出と同じリクエストにする
+        member_id, text = batch[0]
+        return {member_id: run_gpt_to_keywords(text, script_for_introduction, None)}
+
+    request_to_gpt = script_for_introduction_batch + "\n" + "\n\n".join(
+        f"### {member_id}\n{text}" for member_id, text in batch)
+    try:
+        parsed = json.loads(_chat(request_to_gpt, response_format={"type": "json_object"}))
+    except ValueError:
+        parsed = None
+    results = {}
+    if isinstance(parsed, dict):
+        for member_id, _ in batch:
+            value = parsed.get(member_id)
+            if isinstance(value, list):
+                value = ','.join(str(v) for v in value)
+            if isinstance(value, str):
+                results[member_id] = ','.join(split_keywords(value))
+
+    missing = [item for item in batch if item[0] not in results]
+    if missing:
+        print(f"  まとめ抽出の応答が不完全でした（{len(missing)}/{len(batch)}件）。分割して再試行します。")
+        if len(missing) == len(batch):
+            mid = len(batch) // 2
+            results.update(_run_intro_batch(batch[:mid]))
+            results.update(_run_intro_batch(batch[mid:]))
+        else:
+            results.update(_run_intro_batch(missing))
+    return results
+
 # LPテキストを取得する関数を定義
+# page_store が有効なら条件付きGETを送り、304なら保存済みのテキストを返す。
+# 抽出設定が前回と違う場合は、保存済みHTMLから抽出し直す。
+# 再開時や --lp-fresh-hours の指定時は、基準時刻以降にダウンロード済みのページを通信せずにそのまま使う。
 def fetch_lp_text(request_url):
-    res = requests.get(request_url, timeout=10)
-    # resの文字データがISO-8859-1のケースがあるので、utf-8に変換して文字化けを防止
-    res.encoding = "utf-8"
-    soup = BeautifulSoup(res.text, "html.parser")
-
-    # 画面非表示の典型タグを削除
-    for tag in soup(["script", "style", "noscript", "svg", "meta", "title", "head"]):
-        tag.decompose()
-
-    # hidden/aria-hidden/display:none/visibility:hidden を削除
-    for el in soup.select("[hidden], [aria-hidden='true'], [style*='display:none'], [style*='visibility:hidden']"):
-        el.decompose()
-
-    # 表示テキストのみを取得して整形
-    return "".join(s for s in soup.stripped_strings)
+    url = str(request_url).strip()
+    signature = extractor_signature(**_extract_options)
+    cached = page_store.get(url) if page_store is not None else None
+    reuse_after = _page_reuse['reuse_after']
+    if (cached is not None and reuse_after is not None and cached.get('fetched', 0) >= reuse_after
+            and cached.get('extractor') == signature):
+        page_store.record_reused(cached)
+        return cached['text']
+    headers = PageStore.conditional_headers(cached)
+    with _host_semaphore(url):
+        res = _get_http_session().get(url, timeout=LP_TIMEOUT, headers=headers, stream=True)
+        try:
+            if res.status_code == 304 and cached is not None:
+                page_store.record_not_modified(cached)
+                if cached.get('extractor') == signature:
+                    return cached['text']
+                html = page_store.get_html(url)
+                if html is None:
+                    return cached['text']
+                text = html_to_text(html, **_extract_options)
+                page_store.update_text(url, text, signature)
+                return text
+            body = _read_capped(res, _lp_max_bytes)
+        finally:
+            res.close()
 
+    # resの文字データがISO-8859-1のケースがあるので、utf-8に変換して文字化けを防止
+    html = body.decode("utf-8", errors="replace")
+    text = html_to_text(html, **_extract_options)
+    if page_store is not None and res.status_code == 200:
+        page_store.put(url, res.headers.get("ETag"), res.headers.get("Last-Modified"), html, text, len(body),
+                       extractor=signature)
+    return text
+
+# レスポンス本文を最大 max_bytes まで読み込む（巨大なページで止まらないように）
+def _read_capped(res, max_bytes):
+    chunks = []
+    total = 0
+    for chunk in res.iter_content(chunk_size=64 * 1024):
+        if not chunk:
+            continue
+        if max_bytes and total + len(chunk) > max_bytes:
+            chunks.append(chunk[:max_bytes - total])
+            print(f"  {max_bytes}バイトを超えたため、以降は読み込みません: {res.url}")
+            break
+        chunks.append(chunk)
+        total += len(chunk)
+    return b"".join(chunks)
 
 ## 有効データが入っていたらTrueを返す関数
 def has_text(value):
@@ -122,25 +474,21 @@ def has_text(value):
     return True
 
 
-################ これ以下が実行コード ################
+## キーワード文字列（カンマ区切り）をリストに分割
+def split_keywords(text):
+    return [kw.strip() for kw in str(text).split(',') if kw.strip()]
 
-print("準備中... out.csvファイルは閉じておいてね。")
 
-# 元データの読み込み
-input_df = pd.read_csv("DB.csv")
-
-# 特徴を抽出したデータの格納先準備
-out_df = pd.DataFrame(columns=['Name', 'Features'])
-scraping_df = pd.DataFrame(columns=['Name', 'LP_text'])
-
-# ---- input_dfの各行についてキーワード抽出を行う処理 ----
-for index, row in input_df.iterrows():
+## 1メンバー分の処理（キーワード抽出→スクレイピング→LPからのキーワード抽出）
+# 並列実行時もこの関数をメンバー単位で呼び出す。
+# previous に前回の抽出結果（マニフェストのエントリ）を渡すと、
+# 自己紹介文・LP本文が変わっていない部分はGPTを呼ばずに前回のキーワードを再利用する。
+# 戻り値: {'Name', 'Features', 'LP_text', ...} の辞書。データが入っていない行は None
+# intro_features にまとめ抽出済みの自己紹介キーワード（--batch-intro）を渡すと、それを使う。
+def process_member(index, row, previous=None, intro_features=None):
     # データが入っていない行は無視
     if not (has_text(row.get('Introduction')) or has_text(row.get('URL'))):
-        continue
-
-    # 現在の行数（出力ファイル基準）
-    out_index = len(out_df)
+        return None
 
     # 名前の格納
     name_value = row.get('Name', '')
@@ -149,17 +497,21 @@ for index, row in input_df.iterrows():
     # ニックネームの取りだし。"/" で分割し、スラッシュが2つある (=分割後に3要素ある) 場合のみ真ん中を取る
     if isinstance(name, str) and name.count('/') ==2:
         name = name.split('/')[1] 
-    out_df.loc[out_index, 'Name'] = name
-    scraping_df.loc[out_index, 'Name'] = name
 
     # 自己紹介文からのキーワード抽出処理
-    print(f"{index}: {name}さんのキーワード抽出中...")
     intro_text = row.get('Introduction')
+    intro_hash = intro_hash_of(row)
+    intro_reused = previous is not None and previous.get('intro_hash') == intro_hash
     feature_list = []
-    if has_text(intro_text):
-        intro_features = run_gpt_to_keywords(intro_text, script_for_introduction, None)
+    if intro_reused:
+        feature_list = list(previous.get('intro_keywords', []))
+    elif has_text(intro_text):
+        if intro_features is None:
+            print(f"{index}: {name}さんのキーワード抽出中...")
+            intro_features = run_gpt_to_keywords(intro_text, script_for_introduction, None)
         if intro_features:
-            feature_list = [kw.strip() for kw in intro_features.split(',') if kw.strip()]
+            feature_list = split_keywords(intro_features)
+    intro_keywords = list(feature_list)
 
     # スクレイピング処理
     print(f"{index}: {name}さんのURLからスクレイピング中...")
@@ -168,81 +520,402 @@ for index, row in input_df.iterrows():
     except Exception as exc:
         print(f"  取得に失敗しました: {exc}")
         lp_text = ""
-    scraping_df.at[out_index, 'LP_text'] = lp_text
 
     # スクレイピングTextからのキーワード抽出処理
-    print(f"{index}: スクレイピング情報からキーワード抽出中...")
-    if has_text(lp_text):
-        lp_features = run_gpt_to_keywords(lp_text, script_for_LP, exclude_keywords=feature_list)
+    # LPのキーワードは自己紹介のキーワードを除外リストにしているため、両方変わっていない場合のみ再利用する
+    lp_hash = content_key(lp_text)
+    lp_keywords = []
+    if intro_reused and previous.get('lp_hash') == lp_hash:
+        lp_keywords = list(previous.get('lp_keywords', []))
+    elif has_text(lp_text):
+        print(f"{index}: スクレイピング情報からキーワード抽出中...")
+        lp_features = run_gpt_to_lp_keywords(lp_text, exclude_keywords=feature_list)
         if lp_features:
-            for kw in [item.strip() for item in lp_features.split(',') if item.strip()]:
-                if kw not in feature_list:
-                    feature_list.append(kw)
-
-    out_df.loc[out_index, 'Features'] = ','.join(feature_list)
-
-# CSVファイルに出力
-out_df.to_csv("out.csv", encoding="utf-8-sig")
-# スクレイピングデータの出力 (アプリでは直接使わない。検証用データ)
-scraping_df.to_csv("LP_text.csv", encoding="utf-8-sig")
-print("キーワードをout.csvへ出力しました")
-
-
-# ---------------CSVの特徴をカンマで分割--------------
-# カンマで分割してDataFrameに展開
-features_df = out_df["Features"].str.split(",", expand=True)
-
-# 特徴を1つずつ列に横展開
-# 列名を「Feature_1」「Feature_2」…のようにする
-features_df.columns = [f"Feature_{i+1}" for i in range(features_df.shape[1])]
-# Name列と結合
-df_wide = pd.concat([out_df["Name"], features_df], axis=1)
-
-# 出力
-print(df_wide.head())
-df_wide.to_csv("out_splited_wide.csv", index=False, encoding="utf-8-sig")
-print("キーワードを分割したout_sprited_wide.csvを出力しました")
-
-
-# ------------- JSONファイルに出力 ----------------
-df_json = out_df.copy()
-
-# --- カンマで分割してリストに変換 ---
-df_json["Features"] = df_json["Features"].apply(lambda x: [item.strip() for item in x.split(",")])
-
-# --- JSONに変換してファイルに出力 ---
-# orient="records" → 各行を辞書形式のリストにする
-# force_ascii=False → 日本語をそのまま出力
-df_json.to_json("out.json", orient="records", force_ascii=False, indent=4)
-print("DataFrameをout.jsonに出力しました")
-
-
-
-# ---------------- TOML化 ---------------------------
-# DataFrame を辞書形式に変換
-data_dict = features_df.to_dict(orient='records')
+            lp_keywords = split_keywords(lp_features)
+    for kw in lp_keywords:
+        if kw not in feature_list:
+            feature_list.append(kw)
+
+    return {
+        'Name': name, 'Features': ','.join(feature_list), 'LP_text': lp_text,
+        # 以下は差分更新・再開用（マニフェストと out_records.jsonl に保存する）
+        'url': url_of(row),
+        'intro_hash': intro_hash, 'intro_keywords': intro_keywords,
+        'lp_hash': lp_hash, 'lp_keywords': lp_keywords,
+    }
+
+
+## 行の入力内容の指紋（差分更新・再開時の比較用）
+def intro_hash_of(row):
+    intro_text = row.get('Introduction')
+    return content_key(str(intro_text).strip() if has_text(intro_text) else "")
 
-# TOML 形式用にラップ（好みでキー名を指定）
-toml_data = {"users": data_dict}
+def url_of(row):
+    url_value = row.get('URL')
+    return str(url_value).strip() if has_text(url_value) else ""
 
-# ファイルに保存する場合
-with open("out.toml", "w", encoding="utf-8") as f:
-    toml.dump(toml_data, f)
 
-print('out.toml出力しました。')
+## マニフェストで行を識別するキー（DB.csvのName列。同名が複数ある場合は連番を付ける）
+def member_keys(input_df):
+    seen = {}
+    keys = []
+    for _, row in input_df.iterrows():
+        raw = str(row.get('Name', '')).strip() if has_text(row.get('Name', '')) else ''
+        seen[raw] = seen.get(raw, 0) + 1
+        keys.append(raw if seen[raw] == 1 else f"{raw}#{seen[raw]}")
+    return keys
 
 
+## 前回の抽出結果が前回と同じかどうか（マニフェスト比較用）
+def same_fingerprint(record, previous):
+    if previous is None:
+        return False
+    return all(record.get(k) == previous.get(k) for k in ('Name', 'url', 'intro_hash', 'lp_hash'))
 
 
-# -------------ワンホット化（カンマ区切りを列に展開して0/1化）---------------
-onehot = out_df["Features"].fillna("").str.get_dummies(sep=",")
-# 余分なスペースを除去（列名の前後空白を削る）
-onehot = onehot.rename(columns=lambda c: c.strip())
-# Nameをインデックスにして結合（行＝人）
-result = pd.concat([out_df["Name"], onehot], axis=1).set_index("Name")
-# CSVに保存（Excelで文字化けしにくいUTF-8 BOM付き）
-result.to_csv("onehot.csv", encoding="utf-8-sig")
+## マニフェストの読み込み・保存
+def load_manifest(path=MANIFEST_FILE):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            obj = json.load(f)
+    except (OSError, ValueError) as exc:
+        print(f"マニフェストを読み込めませんでした（全件処理します）: {exc}")
+        return {}
+    if obj.get('version') != MANIFEST_VERSION:
+        return {}
+    return obj.get('members', {})
+
+def save_manifest(members, path=MANIFEST_FILE):
+    members = {key: {k: record[k] for k in MANIFEST_FIELDS if k in record} for key, record in members.items()}
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({'version': MANIFEST_VERSION, 'members': members}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+## 処理済みメンバーの追記先（JSON Lines）
+# 1人終わるごとに1行書き込んでflushするので、途中でクラッシュしてもそこまでの結果はディスクに残る。
+class RecordSink:
+    def __init__(self, path=RECORDS_FILE, mode="w"):
+        self._lock = threading.Lock()
+        self._f = open(path, mode, encoding="utf-8")
+
+    def write(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+## 追記ファイルの各行（先頭には実行開始時刻の行 {'run_started': ...} が入る）
+def _read_jsonl(path):
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # 書き込み途中で止まった最終行などは読み飛ばす
+                continue
+
+## 追記ファイルの読み込み（DB.csvの行順に並べ直す）
+def load_records(path=RECORDS_FILE):
+    records = [r for r in _read_jsonl(path) if 'position' in r]
+    records.sort(key=lambda r: r['position'])
+    return records
+
+
+## 中断した実行の再開（--resume）
+# out_records.jsonl のうち、今のDB.csvの行と入力（キー・自己紹介文・URL）が一致するものだけ残して書き直す。
+# 戻り値: (処理済みとして扱うキーの集合, 中断した実行の開始時刻。不明なら None)
+def prepare_resume(keys, input_df, path=RECORDS_FILE):
+    current = {}
+    for position, (key, (_, row)) in enumerate(zip(keys, input_df.iterrows())):
+        current[key] = (position, intro_hash_of(row), url_of(row))
+    kept = {}
+    run_started = None
+    for record in _read_jsonl(path):
+        if 'position' not in record:
+            run_started = record.get('run_started', run_started)
+            continue
+        info = current.get(record.get('key'))
+        if info is None or record.get('intro_hash') != info[1] or record.get('url') != info[2]:
+            continue
+        record['position'] = info[0]
+        kept[record['key']] = record
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        if run_started is not None:
+            f.write(json.dumps({'run_started': run_started}) + "\n")
+        for record in sorted(kept.values(), key=lambda r: r['position']):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, path)
+    return set(kept), run_started
+
+
+## メンバーごとの処理を実行し、終わったものから (position, key, 結果) を返すジェネレータ
+# jobs: [(position, key, process_memberの引数タプル), ...]
+# 並列時も同時に抱える件数を workers*2 件までに抑え、結果を溜め込まない。
+def iter_member_results(jobs, workers=1):
+    if workers <= 1:
+        for position, key, job_args in jobs:
+            yield position, key, process_member(*job_args)
+        return
+    print(f"{workers}並列で処理します。")
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = {}
+        jobs_iter = iter(jobs)
+        while True:
+            while len(in_flight) < workers * 2:
+                job = next(jobs_iter, None)
+                if job is None:
+                    break
+                position, key, job_args = job
+                in_flight[executor.submit(process_member, *job_args)] = (position, key)
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                position, key = in_flight.pop(future)
+                yield position, key, future.result()
+
+
+## コマンドライン引数
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="DB.csvからメンバーの特徴キーワードを抽出します。")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="メンバー単位の並列数（1なら直列実行）")
+    parser.add_argument("--per-host", type=int, default=DEFAULT_PER_HOST_LIMIT,
+                        help="同一ホストへの同時スクレイピング数の上限")
+    parser.add_argument("--llm-concurrency", type=int, default=DEFAULT_LLM_CONCURRENCY,
+                        help="OpenAI APIへの同時リクエスト数の上限")
+    parser.add_argument("--lp-max-bytes", type=int, default=DEFAULT_LP_MAX_BYTES,
+                        help="LP 1ページあたりの最大ダウンロードサイズ（バイト）")
+    parser.add_argument("--html-engine", choices=["auto", "lxml", "bs4"], default=DEFAULT_ENGINE,
+                        help="LPのHTML→テキスト抽出エンジン（auto: lxmlがあればlxml）")
+    parser.add_argument("--lp-max-chars", type=int, default=DEFAULT_MAX_CHARS,
+                        help="LPから取り出すテキストの最大文字数（0なら無制限）")
+    parser.add_argument("--no-lp-dedupe", action="store_true",
+                        help="LP内で繰り返し出てくる同じ文字列（ナビ・フッター等）を除去しない")
+    parser.add_argument("--lp-chunk-tokens", type=int, default=DEFAULT_LP_CHUNK_TOKENS,
+                        help="LPがこのトークン数を超えたら分割して並列に抽出する（0なら分割しない）")
+    parser.add_argument("--lp-max-chunks", type=int, default=DEFAULT_LP_MAX_CHUNKS,
+                        help="LP 1ページあたりの最大分割数")
+    parser.add_argument("--batch-intro", action="store_true",
+                        help="自己紹介文を複数人分まとめて1リクエストでキーワード抽出する")
+    parser.add_argument("--batch-tokens", type=int, default=DEFAULT_BATCH_TOKENS,
+                        help="まとめ抽出1リクエストあたりの自己紹介文の合計トークン数の目安")
+    parser.add_argument("--batch-max-members", type=int, default=DEFAULT_BATCH_MAX_MEMBERS,
+                        help="まとめ抽出1リクエストあたりの最大人数")
+    parser.add_argument("--incremental", action="store_true",
+                        help="前回のマニフェストと比べて、追加・変更された行だけを再抽出する")
+    parser.add_argument("--save-manifest", action="store_true",
+                        help="--incremental を付けない実行でも、次回の差分更新用にマニフェストを書き出す")
+    parser.add_argument("--lp-fresh-hours", type=float, default=DEFAULT_LP_FRESH_HOURS,
+                        help="この時間内に取得済みのLPは通信せずに使う（0なら毎回条件付きGETで確認する）")
+    parser.add_argument("--resume", action="store_true",
+                        help="前回中断した実行を、処理済みのメンバーを飛ばして再開する")
+    parser.add_argument("--no-onehot-csv", action="store_true",
+                        help="密なワンホットCSV（onehot.csv）を出力しない（onehot.npz は常に出力）")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="GPT応答のキャッシュを使わない")
+    parser.add_argument("--cache-max-age-days", type=float, default=DEFAULT_MAX_AGE_DAYS,
+                        help="キャッシュの有効期限（日）")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_MAX_MB,
+                        help="キャッシュの最大サイズ（MB）。超えたら古い順に削除")
+    return parser.parse_args(argv)
+
+
+# ---- 出力ステージ ----
+# 全メンバーのキーワードを1回だけ分割し、トークン語彙（トークン→列番号）を作ってから全形式を書き出す。
+# ワンホットは疎行列（CSR形式）で onehot.npz に保存する。scipy.sparse.load_npz でそのまま読める形式。
+# 密なCSV（onehot.csv）は1行ずつ書き出すので、メモリは非ゼロ要素数ぶんしか使わない。
+ONEHOT_NPZ = "onehot.npz"
+ONEHOT_VOCAB_JSON = "onehot_vocab.json"
+
+# トークン語彙とCSR形式のワンホット行列を作る
+# 戻り値: (vocab, indptr, indices)  vocab は列名のソート済みリスト（pandasのget_dummiesと同じ並び）
+def build_onehot_csr(token_lists):
+    vocab = sorted({tok for tokens in token_lists for tok in tokens if tok})
+    token_ids = {tok: i for i, tok in enumerate(vocab)}
+    indptr = np.zeros(len(token_lists) + 1, dtype=np.int64)
+    indices = []
+    for row, tokens in enumerate(token_lists):
+        ids = sorted({token_ids[tok] for tok in tokens if tok})
+        indices.extend(ids)
+        indptr[row + 1] = indptr[row] + len(ids)
+    return vocab, indptr, np.asarray(indices, dtype=np.int32)
+
+# 抽出結果を各形式のファイルに出力する
+def write_outputs(records, dense_onehot=True):
+    names = [r['Name'] for r in records]
+    features = [r['Features'] for r in records]
+    # 各メンバーのキーワードをここで1回だけ分割する（以降の全形式で使い回す）
+    raw_tokens = [str(f).split(",") for f in features]
+    token_lists = [[item.strip() for item in tokens] for tokens in raw_tokens]
+
+    # CSVファイルに出力
+    out_df = pd.DataFrame({'Name': names, 'Features': features}, columns=['Name', 'Features'])
+    out_df.to_csv("out.csv", encoding="utf-8-sig")
+    # スクレイピングデータの出力 (アプリでは直接使わない。検証用データ)
+    scraping_df = pd.DataFrame({'Name': names, 'LP_text': [r['LP_text'] for r in records]},
+                               columns=['Name', 'LP_text'])
+    scraping_df.to_csv("LP_text.csv", encoding="utf-8-sig")
+    print("キーワードをout.csvへ出力しました")
+
+
+    # ---------------CSVの特徴をカンマで分割--------------
+    # 特徴を1つずつ列に横展開
+    # 列名を「Feature_1」「Feature_2」…のようにする
+    width = max((len(tokens) for tokens in raw_tokens), default=0)
+    feature_columns = [f"Feature_{i+1}" for i in range(width)]
+    with open("out_splited_wide.csv", "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["Name"] + feature_columns)
+        for name, tokens in zip(names, raw_tokens):
+            writer.writerow([name] + tokens + [""] * (width - len(tokens)))
+    print(pd.DataFrame([[name] + tokens for name, tokens in zip(names[:5], raw_tokens[:5])],
+                       columns=(["Name"] + feature_columns) if names else None))
+    print("キーワードを分割したout_sprited_wide.csvを出力しました")
+
+
+    # ------------- JSONファイルに出力 ----------------
+    # orient="records" → 各行を辞書形式のリストにする
+    # force_ascii=False → 日本語をそのまま出力
+    df_json = pd.DataFrame({'Name': names, 'Features': token_lists}, columns=['Name', 'Features'])
+    df_json.to_json("out.json", orient="records", force_ascii=False, indent=4)
+    print("DataFrameをout.jsonに出力しました")
+
+
+    # ---------------- TOML化 ---------------------------
+    # TOML 形式用にラップ（好みでキー名を指定）
+    toml_data = {"users": [dict(zip(feature_columns, tokens)) for tokens in raw_tokens]}
+
+    # ファイルに保存する場合
+    with open("out.toml", "w", encoding="utf-8") as f:
+        toml.dump(toml_data, f)
+
+    print('out.toml出力しました。')
+
+
+    # -------------ワンホット化（疎行列 + 語彙ファイル）---------------
+    vocab, indptr, indices = build_onehot_csr(token_lists)
+    np.savez_compressed(
+        ONEHOT_NPZ,
+        format=b"csr", shape=np.array([len(names), len(vocab)]),
+        data=np.ones(len(indices), dtype=np.uint8), indices=indices, indptr=indptr,
+    )
+    with open(ONEHOT_VOCAB_JSON, "w", encoding="utf-8") as f:
+        json.dump({"rows": names, "columns": vocab}, f, ensure_ascii=False)
+    print(f"ワンホット化したデータを{ONEHOT_NPZ}（語彙: {ONEHOT_VOCAB_JSON}）に出力しました。"
+          f" {len(names)}人 x {len(vocab)}語, 非ゼロ {len(indices)}件")
+
+    # 密なCSV（Excelで見る用）。Nameを先頭列にして、1行ずつ0/1を書き出す
+    if dense_onehot:
+        with open("onehot.csv", "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(["Name"] + vocab)
+            row_values = [0] * len(vocab)
+            for row, name in enumerate(names):
+                ids = indices[indptr[row]:indptr[row + 1]]
+                for i in ids:
+                    row_values[i] = 1
+                writer.writerow([name] + row_values)
+                for i in ids:
+                    row_values[i] = 0
+        print("ワンホット化したデータをonehot.csv に出力しました。")
 
-print("ワンホット化したデータをonehot.csv に出力しました。")
 
+################ これ以下が実行コード ################
 
+def main(argv=None):
+    args = parse_args(argv)
+    configure_concurrency(args.llm_concurrency, args.per_host, args.lp_max_bytes,
+                          args.html_engine, args.lp_max_chars, not args.no_lp_dedupe,
+                          args.lp_chunk_tokens, args.lp_max_chunks)
+    configure_cache(not args.no_cache, args.cache_max_age_days, args.cache_max_mb)
+
+    print("準備中... out.csvファイルは閉じておいてね。")
+
+    # 元データの読み込み
+    input_df = pd.read_csv("DB.csv")
+
+    # 差分更新モードでは前回のマニフェストを読み込む
+    keys = member_keys(input_df)
+    manifest = load_manifest() if args.incremental else {}
+    if args.incremental:
+        print(f"差分更新モード: 前回の記録 {len(manifest)}件")
+
+    # 再開モードでは、前回の実行で処理済みのメンバーを飛ばす
+    done_keys, run_started = prepare_resume(keys, input_df) if args.resume else (set(), None)
+    if args.resume:
+        print(f"再開モード: 処理済みの {len(done_keys)}件をスキップします。")
+    # 中断した実行でダウンロード済みのLPと、--lp-fresh-hours 以内に取得したLPは取り直さない
+    configure_page_reuse(run_started, args.lp_fresh_hours)
+
+    # ---- input_dfの各行についてキーワード抽出を行う処理 ----
+    rows = [(index, row, manifest.get(key)) for key, (index, row) in zip(keys, input_df.iterrows())]
+
+    # 自己紹介文のまとめ抽出（前回の結果を使い回せる行は除く）
+    if args.batch_intro:
+        targets = []
+        for key, (index, row, previous) in zip(keys, rows):
+            intro_text = row.get('Introduction')
+            if not has_text(intro_text) or key in done_keys:
+                continue
+            if previous is not None and previous.get('intro_hash') == intro_hash_of(row):
+                continue
+            targets.append((str(index), intro_text))
+        batched = run_gpt_to_keywords_batched(targets, args.batch_tokens, args.batch_max_members, args.workers)
+        rows = [(index, row, previous, batched.get(str(index))) for index, row, previous in rows]
+
+    # 終わったメンバーから順に追記していく（完了順はバラバラでも position でDB.csvの行順に戻せる）
+    jobs = [(position, key, job_args) for position, (key, job_args) in enumerate(zip(keys, rows))
+            if key not in done_keys]
+    sink = RecordSink(RECORDS_FILE, mode="a" if args.resume else "w")
+    if not args.resume:
+        sink.write({'run_started': time.time()})
+    try:
+        for position, key, record in iter_member_results(jobs, args.workers):
+            if record is not None:
+                sink.write({'position': position, 'key': key, **record})
+    finally:
+        sink.close()
+
+    # 追記ファイルから、DB.csvの行順で全メンバーの結果を読み直す
+    records = load_records(RECORDS_FILE)
+
+    # マニフェストの更新（DB.csvから消えたメンバーはここで落ちる。書き出すのは差分更新用に求められたときだけ）
+    members = {r['key']: {k: v for k, v in r.items() if k not in ('position', 'key')} for r in records}
+    if args.incremental:
+        unchanged = sum(1 for key, record in members.items() if same_fingerprint(record, manifest.get(key)))
+        added = sum(1 for key in members if key not in manifest)
+        deleted = sum(1 for key in manifest if key not in members)
+        print(f"差分: 追加 {added}件 / 変更 {len(members) - unchanged - added}件 / "
+              f"変更なし {unchanged}件 / 削除 {deleted}件")
+    if args.incremental or args.save_manifest:
+        save_manifest(members)
+
+    # 各形式のファイルに出力（DataFrameは出力時に1回だけ作る）
+    write_outputs(records, dense_onehot=not args.no_onehot_csv)
+
+    # キャッシュの整理と、ヒット/ミス件数の表示
+    if keyword_cache is not None:
+        keyword_cache.evict()
+        print(keyword_cache.stats_line())
+    if page_store is not None:
+        print(page_store.stats_line())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# ############### extraction_cache.pyの説明 ################
+#
+# data_extraction.py で使う永続キャッシュをまとめたモジュール。
+#   - KeywordCache: run_gpt_to_keywords の応答をSQLiteに保存する。
+#     キーは (モデル, スクリプト, 除外キーワード, 入力テキスト) のハッシュ値なので、
+#     どれか1つでも変われば別エントリになり、古い応答が使われることはない。
+#   - PageStore: fetch_lp_text で取得したLPのHTML・抽出テキストと ETag/Last-Modified を保存する。
+#     次回は条件付きGETを送り、304 Not Modified なら保存済みのテキストを返す。
+#
+# キャッシュは .cache/ 以下に作られる。消しても次回実行で作り直されるだけなので、
+# 挙動がおかしいときはディレクトリごと削除してOK。
+#
+# #########################################################
+
+
+DEFAULT_CACHE_DIR = ".cache"
+KEYWORD_CACHE_FILE = "keyword_cache.sqlite"
+PAGE_STORE_FILE = "page_store.sqlite"
+
+# エビクション（追い出し）の既定値
+DEFAULT_MAX_AGE_DAYS = 90      # これより古い応答は捨てる
+DEFAULT_MAX_MB = 50            # 合計サイズがこれを超えたら、最近使われていない順に捨てる
+
+
+# 任意個の値からキャッシュキー（sha256の16進文字列）を作る
+def content_key(*parts) -> str:
+    payload = json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class KeywordCache:
+    """run_gpt_to_keywords の応答を保存するSQLiteキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, path=None, max_age_days=DEFAULT_MAX_AGE_DAYS, max_mb=DEFAULT_MAX_MB):
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, KEYWORD_CACHE_FILE)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_age_sec = float(max_age_days) * 24 * 60 * 60
+        self.max_bytes = int(float(max_mb) * 1024 * 1024)
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS keywords ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM keywords WHERE key = ?", (key,)).fetchone()
+            if row is None or now - row[1] > self.max_age_sec:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE keywords SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        value = str(value)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO keywords (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now))
+            self._conn.commit()
+            self.stores += 1
+
+    # 期限切れ → サイズ超過（最終アクセスが古い順）の順に追い出す
+    def evict(self):
+        with self._lock:
+            cur = self._conn.execute(
+                "DELETE FROM keywords WHERE created < ?", (time.time() - self.max_age_sec,))
+            self.evicted += cur.rowcount
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM keywords").fetchone()[0]
+            if total > self.max_bytes:
+                doomed = []
+                for key, size in self._conn.execute("SELECT key, size FROM keywords ORDER BY accessed"):
+                    if total <= self.max_bytes:
+                        break
+                    doomed.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM keywords WHERE key = ?", doomed)
+                self.evicted += len(doomed)
+            self._conn.commit()
+
+    def stats_line(self):
+        return (f"キーワードキャッシュ: ヒット {self.hits}件 / ミス {self.misses}件 / "
+                f"保存 {self.stores}件 / 追い出し {self.evicted}件")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class PageStore:
+    """LPのHTML・抽出テキストとキャッシュ検証用ヘッダを保存するSQLiteストア（スレッドセーフ）"""
+
+    def __init__(self, path=None):
+        if path is None:
+            path = os.path.join(DEFAULT_CACHE_DIR, PAGE_STORE_FILE)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.fetched = 0          # 200で本文をダウンロードした件数
+        self.not_modified = 0     # 304で保存済みテキストを使った件数
+        self.reused = 0           # 再開時に通信せず保存済みテキストを使った件数
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0      # 304のおかげでダウンロードせずに済んだバイト数
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, html BLOB,"
+            " text TEXT NOT NULL, size INTEGER NOT NULL, fetched REAL NOT NULL, extractor TEXT)"
+        )
+        # 古いバージョンで作ったストアには extractor 列が無いので追加する
+        columns = {r[1] for r in self._conn.execute("PRAGMA table_info(pages)")}
+        if "extractor" not in columns:
+            self._conn.execute("ALTER TABLE pages ADD COLUMN extractor TEXT")
+        self._conn.commit()
+
+    # 保存済みページ。{'etag', 'last_modified', 'text', 'size', 'extractor', 'fetched'} か None
+    # extractor は text を作ったときの抽出設定（html_extract.extractor_signature）
+    # fetched は本文をダウンロードした時刻（time.time()）
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, text, size, extractor, fetched FROM pages WHERE url = ?",
+                (url,)).fetchone()
+        if row is None:
+            return None
+        return {'etag': row[0], 'last_modified': row[1], 'text': row[2], 'size': row[3], 'extractor': row[4],
+                'fetched': row[5]}
+
+    # 保存済みHTML（ベンチマークや抽出方法を変えたときの再抽出用）
+    def get_html(self, url):
+        with self._lock:
+            row = self._conn.execute("SELECT html FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return zlib.decompress(row[0]).decode("utf-8", errors="replace")
+
+    def urls(self):
+        with self._lock:
+            return [r[0] for r in self._conn.execute("SELECT url FROM pages ORDER BY url")]
+
+    # 条件付きGETで使うリクエストヘッダ
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def put(self, url, etag, last_modified, html, text, size, extractor=None):
+        blob = zlib.compress(html.encode("utf-8")) if html is not None else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, etag, last_modified, html, text, size, fetched, extractor)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, blob, text, int(size), time.time(), extractor))
+            self._conn.commit()
+            self.fetched += 1
+            self.bytes_downloaded += int(size)
+
+    # 抽出設定を変えたときに、保存済みHTMLから作り直したテキストで置き換える
+    def update_text(self, url, text, extractor):
+        with self._lock:
+            self._conn.execute("UPDATE pages SET text = ?, extractor = ? WHERE url = ?", (text, extractor, url))
+            self._conn.commit()
+
+    def record_not_modified(self, entry):
+        with self._lock:
+            self.not_modified += 1
+            self.bytes_saved += int(entry.get('size') or 0)
+
+    def record_reused(self, entry):
+        with self._lock:
+            self.reused += 1
+            self.bytes_saved += int(entry.get('size') or 0)
+
+    def stats_line(self):
+        return (f"ページキャッシュ: ダウンロード {self.fetched}件 ({self.bytes_downloaded / 1024:.1f}KB) / "
+                f"304 {self.not_modified}件 / 再利用 {self.reused}件 / 節約 {self.bytes_saved / 1024:.1f}KB")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,133 @@
+import re
+from bs4 import BeautifulSoup
+try:
+    import lxml.html  # 任意。あれば高速な抽出エンジンを使う
+    from lxml import etree
+except ImportError:
+    lxml = None
+
+# ############### html_extract.pyの説明 ################
+#
+# LPのHTMLから「画面に表示されるテキスト」だけを取り出すモジュール。
+# data_extraction.py の fetch_lp_text と、ベンチマーク(bench_html_extract.py)から使う。
+#
+#   - lxml エンジン: 木を1回だけ走査し、非表示要素は部分木ごと読み飛ばす（高速）
+#   - bs4 エンジン : 従来どおり BeautifulSoup の html.parser を使う（lxmlが無い環境用）
+#
+# どちらのエンジンでも、ナビ・フッターのように繰り返し出てくる同じ文字列は1回だけ残し、
+# 出力を max_chars 文字で打ち切る（後でGPTのプロンプトに貼るため）。
+#
+# ######################################################
+
+
+# 画面非表示の典型タグ
+HIDDEN_TAGS = {"script", "style", "noscript", "svg", "meta", "title", "head", "template"}
+# style属性のうち、非表示を表すもの（空白を除いて小文字にした状態で判定）
+HIDDEN_STYLES = ("display:none", "visibility:hidden")
+
+DEFAULT_ENGINE = "auto"       # auto / lxml / bs4
+DEFAULT_MAX_CHARS = 20000     # 0 なら打ち切らない
+
+_space_re = re.compile(r"\s+")
+
+
+# 実際に使うエンジン名（auto は lxml があれば lxml）
+def resolve_engine(engine=DEFAULT_ENGINE):
+    if engine == "auto":
+        return "lxml" if lxml is not None else "bs4"
+    if engine == "lxml" and lxml is None:
+        return "bs4"
+    return engine
+
+# 抽出設定を表す文字列（ページキャッシュのテキストがどの設定で作られたかの記録用）
+def extractor_signature(engine=DEFAULT_ENGINE, max_chars=DEFAULT_MAX_CHARS, dedupe=True):
+    return f"{resolve_engine(engine)}:{int(max_chars or 0)}:{int(bool(dedupe))}"
+
+
+# HTMLから表示テキストを取り出す
+def html_to_text(html, engine=DEFAULT_ENGINE, max_chars=DEFAULT_MAX_CHARS, dedupe=True):
+    if not html or not html.strip():
+        return ""
+    if resolve_engine(engine) == "lxml":
+        try:
+            segments = _visible_strings_lxml(html)
+        except (ValueError, etree.ParserError):
+            # 壊れたHTMLやXML宣言付きの文字列など、lxmlで読めないものは bs4 に任せる
+            segments = _visible_strings_bs4(html)
+    else:
+        segments = _visible_strings_bs4(html)
+    return _join_segments(segments, max_chars, dedupe)
+
+
+# 従来の抽出処理（比較・ベンチマーク用に残している）
+def html_to_text_legacy(html):
+    soup = BeautifulSoup(html, "html.parser")
+
+    # 画面非表示の典型タグを削除
+    for tag in soup(["script", "style", "noscript", "svg", "meta", "title", "head"]):
+        tag.decompose()
+
+    # hidden/aria-hidden/display:none/visibility:hidden を削除
+    for el in soup.select("[hidden], [aria-hidden='true'], [style*='display:none'], [style*='visibility:hidden']"):
+        el.decompose()
+
+    # 表示テキストのみを取得して整形
+    return "".join(s for s in soup.stripped_strings)
+
+
+def _is_hidden_attrs(attrs):
+    if "hidden" in attrs or str(attrs.get("aria-hidden", "")).lower() == "true":
+        return True
+    style = attrs.get("style")
+    if style:
+        style = _space_re.sub("", str(style)).lower()
+        return any(s in style for s in HIDDEN_STYLES)
+    return False
+
+# lxml版: 要素を1回ずつだけ訪問する。非表示要素は中身を読まず、後ろのテキスト(tail)だけ拾う。
+def _visible_strings_lxml(html):
+    root = lxml.html.document_fromstring(html)
+    out = []
+    stack = [root]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            out.append(item)
+            continue
+        if item.tail:
+            stack.append(item.tail)
+        # コメントや処理命令は tag が文字列ではない
+        if not isinstance(item.tag, str) or item.tag.lower() in HIDDEN_TAGS or _is_hidden_attrs(item.attrib):
+            continue
+        if item.text:
+            out.append(item.text)
+        stack.extend(reversed(item))
+    return out
+
+# bs4版: 非表示要素を削除してから文字列を集める
+def _visible_strings_bs4(html):
+    soup = BeautifulSoup(html, "html.parser")
+    for el in soup.find_all(lambda tag: tag.name in HIDDEN_TAGS or _is_hidden_attrs(tag.attrs)):
+        if not el.decomposed:
+            el.decompose()
+    return list(soup.stripped_strings)
+
+# 文字列を整形してつなぐ。重複除去と文字数の上限もここで行う。
+def _join_segments(segments, max_chars, dedupe):
+    seen = set()
+    out = []
+    total = 0
+    for s in segments:
+        s = s.strip()
+        if not s:
+            continue
+        if dedupe:
+            if s in seen:
+                continue
+            seen.add(s)
+        if max_chars and total + len(s) >= max_chars:
+            out.append(s[:max_chars - total])
+            break
+        out.append(s)
+        total += len(s)
+    return "".join(out)
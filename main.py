@@ -8,7 +8,6 @@
 # ################################################################
 
 import streamlit as st 
-import pandas as pd
 import requests #JSON用
 from openai import OpenAI
 import os
@@ -62,6 +61,17 @@ def show_temporary_success(message_holder, message="処理が完了しました
     time.sleep(delay)
     message_holder.empty()
 
+# 結果をカード形式で表示する（ストリーミング中は途中までの本文を表示し、末尾にカーソルを付ける）
+def show_card(holder, title, text, streaming=False):
+    cursor = " ▌" if streaming else ""
+    card_html = f"""
+    <div style="background-color:#F8D7B3; color:#E2873B; border:1px solid #ccc; padding:20px; border-radius:10px; box-shadow:2px 2px 10px rgba(0,0,0,0.1);">
+    <h3>{title}</h3>
+    <p>{text}{cursor}</p>
+    </div>
+    """
+    holder.markdown(card_html, unsafe_allow_html=True)
+
 # 動作モードの選択　# 09/23よこ修正
 # ローカルかどうかでメニュー変更 25/09/28まっちゃん修正
 env_flg = ''
@@ -92,10 +102,10 @@ if env_flg == "local":
         # --- network_app から相関図表示に必要な関数・定数を最小限取り込み --- 25/09/29まっと（コード記載位置変更）
         from network_app import (
             OUT_NETWORK_JSON,  # JSON版で定義されているパス 例: out_network.json
-            CITY_TO_PREF_JSON, PREF_ALIASES_JSON, PREF_TO_REGION_JSON,
-            TOKEN_CATEGORY_JSON, CANONICAL_MAP_JSON, STOPWORDS_JSON, SUBCAT_WEIGHTS_JSON,
-            load_json_any, load_token_category_json, load_kv_from_json, load_stopwords, load_canonical_map, load_subcat_weights_json,
-            build_geo_dicts_from_json, build_graph, show_pyvis
+            load_json_any, show_pyvis, source_fingerprint,
+            # 辞書JSONは network_dicts()（正規化済みバンドル）経由で読む
+            pair_score_table, budget_pair_table, graph_from_table, edge_table_df, network_dicts, show_budget_summary,
+            LAYOUT_CHOICES
         )
         
         # --- 外部辞書/データファイルの読み込み（サイドバーの選択肢にも必要） --- 09/28まっと追記
@@ -247,9 +257,23 @@ with st.sidebar:
     elif operation_mode == mode_3:
         st.caption('繋がりを線で描こう')
         st.header("表示パラメータ")
-        min_edge_score = st.slider("エッジ採用しきい値（合計スコア）", 0.0, 20.0, 6.0, 0.5) #初期表示を2.0から6.0に修正09/29よこ修正
+        # しきい値は手で決めるか、描画するエッジ数の上限から自動で決める
+        threshold_mode = st.radio("しきい値の決め方", ["スライダで指定", "エッジ数の上限から自動"], horizontal=True)
+        if threshold_mode == "スライダで指定":
+            min_edge_score = st.slider("エッジ採用しきい値（合計スコア）", 0.0, 20.0, 6.0, 0.5) #初期表示を2.0から6.0に修正09/29よこ修正
+            edge_budget = None
+        else:
+            edge_budget = st.number_input("描画するエッジ数の上限", min_value=10, max_value=100000, value=500, step=50)
+            min_edge_score = None  # グラフ構築の前に、ペアスコア表から決める
+        # 人気のある人にエッジが集中して図が毛玉になるときは、1人あたりのエッジ数を制限する
+        top_k = st.number_input("1人あたりの最大エッジ数（0なら制限なし）", min_value=0, max_value=50, value=0, step=1)
+        mutual_knn = st.checkbox("お互いに上位同士のペアだけ繋ぐ（相互kNN）", value=False, disabled=top_k == 0)
         graph_height   = st.number_input("グラフ高さ(px)", min_value=400, max_value=1600, value=400, step=50) #初期表示を800から400に修正09/29よこ修正
         label_font_size = st.number_input("ラベル文字サイズ", min_value=8, max_value=30, value=16, step=1)
+        # 人数が多いときはサーバーで配置を計算すると、ブラウザでの表示が速い
+        layout = LAYOUT_CHOICES[st.selectbox("ノードの配置", list(LAYOUT_CHOICES))]
+        # オンにすると、一度描いた後はパラメータを変えるたびに「探そう！」を押さずに描き直す
+        auto_redraw = st.checkbox("パラメータを変えたら自動で描き直す", value=False)
         st.divider()
         # ★ メンバー選択リストをサイドバーに追加（修正） 09/28まっと追加
         # all_names = sorted({str(r.get("Name","")).strip() for r in data_json.get("records", []) if str(r.get("Name","")).strip()}) # data_jsonから名前リストを構築
@@ -296,6 +320,13 @@ if "search_triggered" not in st.session_state:
 if search_clicked:
     st.session_state.search_triggered = True
 
+# 繋がり線モードで「自動で描き直す」をオンにした場合だけ、一度描いた後は
+# サイドバーの値を変えただけの再実行でも描き直す（既定は従来どおり「探そう！」で描く）
+if operation_mode != mode_3:
+    st.session_state.network_drawn = False
+redraw_network = (operation_mode == mode_3 and auto_redraw
+                  and st.session_state.get("network_drawn", False))
+
 # 表示制御
 if st.session_state.search_triggered == False:
     st.image("img/top_image.png")
@@ -327,16 +358,15 @@ if search_clicked:
 # データ分析を実行し、表示
 # ユーザー名を引数に渡して、共通点を探した結果をテキストで返す
 # # 09/23よこ編集 「探そう！」をクリックすることで処理が走るように改修
-if search_clicked:
+if search_clicked or redraw_network:
     try:
         # 画面上に結果を出力
         # tab1, tab2, tab3 = st.tabs(["共通点","特徴","相関"])
         #　mode_1:共通点探しを選択した場合の結果表示
         if operation_mode == mode_1:
             #共通点を取得する関数を呼び出す
-            out_text1 = analyze.find_major_commons(name, client, data_json)
-            out_text2 = analyze.find_similar_person(name, client, data_json)
-            out_text3 = analyze.find_team_member(name, client, data_json)
+            # 3つのリクエストは並列に、ストリーミングで投げる（届いた文字から順にタブに表示する）
+            streams = analyze.start_mode1_streams(name, client, data_json)
 
             #関数の取得結果を表示
             # 09/28 出力するタブにcssを適用
@@ -380,56 +410,48 @@ if search_clicked:
                 unsafe_allow_html=True
             )
 
-            # 処理完了後にGIFを非表示する関数を呼び出す 09/29よこ修正
-            show_temporary_success(message_holder,"仲間が見つかりました！",delay=0.3)
-            
             # 関数の取得結果を表示
             # 09/28 出力エリアをカード形式に変更
             tab1, tab2, tab3 = st.tabs(["みんなとの共通点","似ている人","チーム提案"])
-            with tab1:
-                card_html = f"""
-                <div style="background-color:#F8D7B3; color:#E2873B; border:1px solid #ccc; padding:20px; border-radius:10px; box-shadow:2px 2px 10px rgba(0,0,0,0.1);">
-                <h3>共通点を見つけたよ！！</h3>
-                <p>{out_text1}</p>
-                </div>
-                """
-                st.markdown(card_html, unsafe_allow_html=True)
-            with tab2:
-                #st.write(out_text2)
-                card_html = f"""
-                <div style="background-color:#F8D7B3; color:#E2873B; border:1px solid #ccc; padding:20px; border-radius:10px; box-shadow:2px 2px 10px rgba(0,0,0,0.1);">
-                <h3>似ている人を見つけたよ！！</h3>
-                <p>{out_text2}</p>
-                </div>
-                """
-                st.markdown(card_html, unsafe_allow_html=True)
-            with tab3:
-                #st.write(out_text3)
-                card_html = f"""
-                <div style="background-color:#F8D7B3; color:#E2873B; border:1px solid #ccc; padding:20px; border-radius:10px; box-shadow:2px 2px 10px rgba(0,0,0,0.1);">
-                <h3>この人と組んでみる？？</h3>
-                <p>{out_text3}</p>
-                </div>
-                """
-                st.markdown(card_html, unsafe_allow_html=True)
-        #mode_2:特徴探しを選択した場合の結果表示
-        elif operation_mode == mode_2:
-            #特徴を取得する関数を呼び出す
-            out_text3 = analyze.search_by_common(common_point, client, data_json)
+            # 結果が届くまでは各タブに探索中メッセージを出しておく
+            card_holders = {}
+            for key, tab, waiting in [("commons", tab1, "みんなとの共通点を探索中...."),
+                                      ("similar", tab2, "共通点のある人を探索中...."),
+                                      ("team", tab3, "最適なチーム員を探索中....")]:
+                with tab:
+                    card_holders[key] = st.empty()
+                    card_holders[key].info(waiting)
+            card_titles = {"commons": "共通点を見つけたよ！！",
+                           "similar": "似ている人を見つけたよ！！",
+                           "team": "この人と組んでみる？？"}
+            for key, out_text, done, error in streams.updates():
+                # 最初の文字が届いたらGIFは消す
+                gif_holder.empty()
+                if error is not None:
+                    card_holders[key].error(f"うまく探せませんでした:{error}")
+                    continue
+                show_card(card_holders[key], card_titles[key], out_text, streaming=not done)
 
             # 処理完了後にGIFを非表示する関数を呼び出す 09/29よこ修正
             show_temporary_success(message_holder,"仲間が見つかりました！",delay=0.3)
+        #mode_2:特徴探しを選択した場合の結果表示
+        elif operation_mode == mode_2:
+            #特徴を取得する関数を呼び出す（ストリーミングで、届いた文字から順に表示する）
+            streams = analyze.StreamGroup({"search": (analyze.stream_search_by_common, (common_point, client, data_json))})
 
             #関数の取得結果を表示
             # 09/28 出力エリアをカード形式に変更
-            #st.write(out_text3)
-            card_html = f"""
-            <div style="background-color:#F8D7B3; color:#E2873B; border:1px solid #ccc; padding:20px; border-radius:10px; box-shadow:2px 2px 10px rgba(0,0,0,0.1);">
-            <h3>同じ特徴の仲間を見つけたよ</h3>
-            <p>{out_text3}</p>
-            </div>
-            """
-            st.markdown(card_html, unsafe_allow_html=True)
+            card_holder = st.empty()
+            card_holder.info("同じ共通点を持つ人を探索中....")
+            for key, out_text3, done, error in streams.updates():
+                gif_holder.empty()
+                if error is not None:
+                    card_holder.error(f"うまく探せませんでした:{error}")
+                    continue
+                show_card(card_holder, "同じ特徴の仲間を見つけたよ", out_text3, streaming=not done)
+
+            # 処理完了後にGIFを非表示する関数を呼び出す 09/29よこ修正
+            show_temporary_success(message_holder,"仲間が見つかりました！",delay=0.3)
             
         #mode_3:相関図を選択した場合の結果表示
         elif operation_mode == mode_3:
@@ -442,17 +464,18 @@ if search_clicked:
                 print('相関図を描画します。')
                 # ---- 相関図（network_app の処理を main から呼び出し） ----
                 # 必要JSONを読み込み（重複読み込みを整理：canonical_mapは load_canonical_map で統一）
+                # 読み込む前にフィンガープリントを取り、特徴解析のキャッシュキーにする
+                parse_cache_key = source_fingerprint()
                 data_records = load_json_any(OUT_NETWORK_JSON)
-                TOKEN_CATEGORY = load_token_category_json(TOKEN_CATEGORY_JSON)
-                CANONICAL_MAP  = load_canonical_map(CANONICAL_MAP_JSON)
-                STOPWORDS      = load_stopwords(STOPWORDS_JSON)
-                CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET = build_geo_dicts_from_json(
-                    CITY_TO_PREF_JSON, PREF_ALIASES_JSON, PREF_TO_REGION_JSON
-                )
-                try:
-                    SUBCAT_WEIGHTS = load_subcat_weights_json(SUBCAT_WEIGHTS_JSON)
-                except Exception:
-                    SUBCAT_WEIGHTS = {}
+                # 7つの辞書JSONは正規化済みのバンドル（.cache/network_dicts.pkl）からプロセス内で1回だけ読む
+                # 元JSONの更新時刻が変わっていれば自動で作り直される
+                dicts = network_dicts()
+                TOKEN_CATEGORY = dicts["TOKEN_CATEGORY"]
+                CANONICAL_MAP  = dicts["CANONICAL_MAP"]
+                STOPWORDS      = dicts["STOPWORDS"]
+                CITY_TO_PREF, PREF_ALIASES = dicts["CITY_TO_PREF"], dicts["PREF_ALIASES"]
+                PREF_TO_REGION, REGION_SET = dicts["PREF_TO_REGION"], dicts["REGION_SET"]
+                SUBCAT_WEIGHTS = dicts["SUBCAT_WEIGHTS"]
 
                 # ---------- メンバー選択処理（大幅に簡略化） ---------- 09/28まっと修正
                 if st.session_state.get("selected_people_default"):
@@ -462,14 +485,23 @@ if search_clicked:
                     subset = None
 
                 # ---------- グラフ構築 ----------
-                G = build_graph(
-                    data_records, min_edge_score,
-                    TOKEN_CATEGORY, SUBCAT_WEIGHTS, CANONICAL_MAP, STOPWORDS,
-                    CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET,
-                    subset=subset,
-                    enable_link_sub1=enable_link_sub1, enable_link_sub2=enable_link_sub2,
-                    link_sub1_weight=link_sub1_weight, link_sub2_weight=link_sub2_weight
-                )
+                # ペアスコア表はしきい値以外の設定ごとにキャッシュされるので、
+                # しきい値スライダを動かしたときは表から切り出すだけで済む
+                # （表にはしきい値付近より上のペアだけを入れ、それより下げたときだけ作り直す）
+                table_args = (data_records,
+                              TOKEN_CATEGORY, SUBCAT_WEIGHTS, CANONICAL_MAP, STOPWORDS,
+                              CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET)
+                table_kwargs = dict(subset=subset,
+                                    enable_link_sub1=enable_link_sub1, enable_link_sub2=enable_link_sub2,
+                                    link_sub1_weight=link_sub1_weight, link_sub2_weight=link_sub2_weight,
+                                    parse_cache_key=parse_cache_key)
+                if edge_budget:
+                    # スコアの分布からエッジ数が上限に収まるしきい値を決め、サイドバーに表示する
+                    table, min_edge_score = budget_pair_table(edge_budget, *table_args, **table_kwargs)
+                    show_budget_summary(table, min_edge_score)
+                else:
+                    table = pair_score_table(*table_args, min_edge_score=min_edge_score, **table_kwargs)
+                G = graph_from_table(table, min_edge_score, top_k, mutual_knn)
                 
                 # もしフィルタで0件なら、明示メッセージを出す（空白/表記ゆれの切り分け用） *メンバー選択時表示用修正 09/28まっと追記
                 if G.number_of_nodes() == 0:
@@ -482,29 +514,24 @@ if search_clicked:
                     
                 # ---------- レイアウト：図＋エッジ一覧 ----------
                 # 処理完了後にGIFを非表示する関数を呼び出す 09/29よこ修正
-                show_temporary_success(message_holder,"繋がりを見つけたよ",delay=0.5)
+                # （スライダ操作による描き直しでは待たない）
+                if search_clicked:
+                    show_temporary_success(message_holder,"繋がりを見つけたよ",delay=0.5)
+                st.session_state.network_drawn = True
 
                 col1, col2 = st.columns([3,3], gap="large")# タイトルが収まるように表示を半々に修正 09/29よこ修正
                 with col1:
                     st.subheader("ネットワーク図")
                     st.caption("趣味や特徴の傾向が似ている仲間を繋げました")# 説明を追加 09/29よこ修正
-                    show_pyvis(G, height_px=int(graph_height), label_font_size=int(label_font_size))
+                    show_pyvis(G, height_px=int(graph_height), label_font_size=int(label_font_size), layout=layout)
                 with col2:
                     st.subheader("エッジ一覧（重い順）")
                     st.caption("特徴が似ている仲間を順番に表示しています")# 説明を追加 09/29よこ修正
                     if G.number_of_edges() == 0:
                         st.info("エッジがありません。選択メンバーやしきい値を見直してください。")
                     else:
-                        rows = []
-                        for u, v, d in G.edges(data=True):
-                            rows.append({
-                                "A": u, "B": v,
-                                "score": d.get("weight", 0),
-                                "common_count": d.get("common_count", 0),
-                                "common_features": d.get("common_features", "")
-                                })
                         import io
-                        edge_df = pd.DataFrame(rows).sort_values(["score","common_count"], ascending=False)
+                        edge_df = edge_table_df(table, min_edge_score, top_k, mutual_knn)
                         st.dataframe(edge_df, use_container_width=True)
                         csv_buf = io.StringIO()
                         edge_df.to_csv(csv_buf, index=False)
@@ -1,10 +1,22 @@
 
-import unicodedata, re, io, itertools, json
+import unicodedata, re, io, itertools, json, hashlib, threading, bisect, pickle, sys, heapq, math
+from array import array
+from collections import OrderedDict
 import pandas as pd
 import networkx as nx
 from pyvis.network import Network
 import streamlit as st
 import os
+try:
+    # 任意（スコアのヒストグラムなどに使う）
+    import numpy as np
+except ImportError:
+    np = None
+try:
+    # 任意（無ければ sparse エンジンは使わず、index エンジンで計算する）
+    import scipy.sparse as sp
+except ImportError:
+    sp = None
 
 # --------------------------------------------------------
 # 固定ファイル名（JSON）
@@ -242,6 +254,125 @@ def geo_expand_tokens(tok_norm: str, CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION,
     return out
 
 
+# ===================== 辞書バンドル（7つの辞書JSONをまとめたpickle） =====================
+#  - 辞書JSONを毎回読み直して正規化するのは遅いので、正規化済みの辞書を1つのpickleにまとめる
+#  - バンドルには元JSONのサイズ・更新時刻を記録し、どれかが変わっていれば自動で作り直す
+#  - 文字列は sys.intern して、同じカテゴリ名などがメモリ上で1つになるようにする
+#  - 手動で作り直す場合は "python build_network_dicts.py"
+DICT_SOURCE_FILES = (CITY_TO_PREF_JSON, PREF_ALIASES_JSON, PREF_TO_REGION_JSON,
+                     TOKEN_CATEGORY_JSON, CANONICAL_MAP_JSON, STOPWORDS_JSON, SUBCAT_WEIGHTS_JSON)
+# 無くてもよい辞書（無ければ空として扱う）。それ以外が無い場合、バンドルは作れない
+OPTIONAL_DICT_SOURCE_FILES = (SUBCAT_WEIGHTS_JSON,)
+DICT_BUNDLE_FILE = os.path.join(".cache", "network_dicts.pkl")
+DICT_BUNDLE_VERSION = 1
+
+def _source_stats(paths):
+    stats = {}
+    for path in paths:
+        try:
+            info = os.stat(path)
+            stats[path] = (info.st_size, info.st_mtime_ns)
+        except OSError:
+            stats[path] = None
+    return stats
+
+def _intern_obj(obj, seen):
+    """文字列を intern し、同じ内容のタプルは1つのオブジェクトにまとめる"""
+    if isinstance(obj, str):
+        return sys.intern(obj)
+    if isinstance(obj, tuple):
+        t = tuple(_intern_obj(x, seen) for x in obj)
+        return seen.setdefault(t, t)
+    if isinstance(obj, dict):
+        return {_intern_obj(k, seen): _intern_obj(v, seen) for k, v in obj.items()}
+    if isinstance(obj, set):
+        return {_intern_obj(x, seen) for x in obj}
+    return obj
+
+def _content_hash(paths, stats):
+    """元JSONの中身のハッシュ（更新時刻だけ変わった場合に、作り直しが要らないことを確かめる）"""
+    h = hashlib.sha256()
+    for src_path in paths:
+        h.update(f"{src_path}\n".encode("utf-8"))
+        if stats[src_path] is not None:
+            with open(src_path, "rb") as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+def _save_dict_bundle(bundle, path):
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError as e:
+        # 書き込めない環境でも、作ったバンドルはそのまま使う
+        print(f"辞書バンドルを保存できませんでした: {e}")
+
+def compile_dict_bundle(path=DICT_BUNDLE_FILE):
+    """辞書JSONを読み込んで正規化し、バンドル（dict）を作って path に保存する（path=None なら保存しない）"""
+    stats = _source_stats(DICT_SOURCE_FILES)
+    content_hash = _content_hash(DICT_SOURCE_FILES, stats)
+    CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET = build_geo_dicts_from_json(
+        CITY_TO_PREF_JSON, PREF_ALIASES_JSON, PREF_TO_REGION_JSON)
+    try:
+        SUBCAT_WEIGHTS = load_subcat_weights_json(SUBCAT_WEIGHTS_JSON)
+    except Exception:
+        SUBCAT_WEIGHTS = {}
+    seen = {}
+    bundle = {
+        "version": DICT_BUNDLE_VERSION,
+        "sources": stats,
+        "content_hash": content_hash,
+        "CITY_TO_PREF": _intern_obj(CITY_TO_PREF, seen),
+        "PREF_ALIASES": _intern_obj(PREF_ALIASES, seen),
+        "PREF_TO_REGION": _intern_obj(PREF_TO_REGION, seen),
+        "REGION_SET": _intern_obj(REGION_SET, seen),
+        "TOKEN_CATEGORY": _intern_obj(load_token_category_json(TOKEN_CATEGORY_JSON), seen),
+        "CANONICAL_MAP": _intern_obj(load_canonical_map(CANONICAL_MAP_JSON), seen),
+        "STOPWORDS": _intern_obj(load_stopwords(STOPWORDS_JSON), seen),
+        "SUBCAT_WEIGHTS": _intern_obj(SUBCAT_WEIGHTS, seen),
+    }
+    if path:
+        _save_dict_bundle(bundle, path)
+    return bundle
+
+def load_dict_bundle(path=DICT_BUNDLE_FILE, save=True):
+    """
+    保存済みバンドルを読み込む。無い・古い・元JSONの中身が変わっている場合は作り直す。
+    元JSONの更新時刻だけが変わった場合（チェックアウトし直した等）は、内容ハッシュが同じなら作り直さない。
+    save=False なら、作り直したバンドルをファイルに書かない
+    """
+    try:
+        with open(path, "rb") as f:
+            bundle = pickle.load(f)
+        if isinstance(bundle, dict) and bundle.get("version") == DICT_BUNDLE_VERSION:
+            stats = _source_stats(DICT_SOURCE_FILES)
+            if bundle.get("sources") == stats:
+                return bundle
+            if bundle.get("content_hash") == _content_hash(DICT_SOURCE_FILES, stats):
+                bundle["sources"] = stats
+                if save:
+                    _save_dict_bundle(bundle, path)
+                return bundle
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        pass
+    print("辞書バンドルを作り直します。")
+    return compile_dict_bundle(path if save else None)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _cached_dict_bundle(source_key):
+    return load_dict_bundle()
+
+def network_dicts():
+    """
+    辞書バンドルをプロセス内で1回だけ読み込んで返す（st.cache_resource）。
+    元JSONの更新時刻が変わればキーが変わるので、次の呼び出しで読み直される。
+    返り値は共有オブジェクトなので書き換えないこと。
+    """
+    return _cached_dict_bundle(source_fingerprint(DICT_SOURCE_FILES))
+
 
 # --------------------------------------------------------
 # 特徴解析（parse_features）
@@ -251,34 +382,227 @@ def geo_expand_tokens(tok_norm: str, CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION,
 #    ・“ゆるいつながり”用の合成トークンを付与:
 #       link:sub1:<name>, link:sub2:<name>
 #    ・重みはサイドバーのスライダで調整
+#  - 1トークンの展開結果は TokenExpander が表引きで返す（同じトークンを何度も正規化しない）
 # --------------------------------------------------------
 
+# ===================== トークン展開表 =====================
+#  - 辞書に載っている語（同義語・カテゴリ・市/県/地方名）は、展開後のトークン集合を最初にまとめて計算する
+#  - 辞書に無い語は初出時に計算し、上限付きLRUに入れる（キーは生の文字列なので2回目以降は正規化もしない）
+#  - 地方名は「正規化した地方名→表示名」の逆引き表で引く（PREF_TO_REGION を毎回なめない）
+TOKEN_EXPANDER_MAX_UNSEEN = 50000
+_NO_TOKENS = frozenset()
+
+class TokenExpander:
+    """生のトークン1つ → parse_features が追加するトークン集合（frozenset）を返す表"""
+
+    def __init__(self, CANONICAL_MAP, STOPWORDS,
+                 CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET,
+                 token_category, enable_link_sub1: bool, enable_link_sub2: bool,
+                 precompute=True, max_unseen=TOKEN_EXPANDER_MAX_UNSEEN):
+        self.CANONICAL_MAP = CANONICAL_MAP
+        self.STOPWORDS = STOPWORDS
+        self.CITY_TO_PREF = CITY_TO_PREF
+        self.PREF_ALIASES = PREF_ALIASES
+        self.PREF_TO_REGION = PREF_TO_REGION
+        self.token_category = token_category
+        self.enable_link_sub1 = enable_link_sub1
+        self.enable_link_sub2 = enable_link_sub2
+        self.max_unseen = max_unseen
+        # 逆引き: 正規化した地方名 → 表示用の地方名
+        self._region_by_norm = {}
+        for v in PREF_TO_REGION.values():
+            k = normalize_key(v)
+            if k in REGION_SET: self._region_by_norm.setdefault(k, v)
+        self._table = {}
+        self._unseen = OrderedDict()
+        self._lock = threading.Lock()   # 辞書外の語のLRUだけ（複数スレッドから同じ表を使う場合のため）
+        if precompute:
+            vocab = set(CANONICAL_MAP) | set(token_category) | set(CITY_TO_PREF) | set(PREF_ALIASES) | set(REGION_SET)
+            for k in vocab:
+                # 正規化済みの形のキーだけ入れる（生の文字列でそのまま引けるように）
+                if k and normalize_key(k) == k:
+                    self._table[k] = self._expand_norm(k)
+
+    def expand(self, x) -> frozenset:
+        if x is None:
+            # 従来の処理と同じく normalize_key(None)（＝空文字）として展開する
+            return self._expand_norm(normalize_key(None))
+        key = x if isinstance(x, str) else str(x)
+        toks = self._table.get(key)
+        if toks is not None:
+            return toks
+        with self._lock:
+            toks = self._unseen.get(key)
+            if toks is not None:
+                self._unseen.move_to_end(key)
+                return toks
+        toks = self._expand_norm(normalize_key(key))
+        with self._lock:
+            self._unseen[key] = toks
+            if len(self._unseen) > self.max_unseen:
+                self._unseen.popitem(last=False)
+        return toks
+
+    def _expand_norm(self, norm: str) -> frozenset:
+        canon = canonicalize_token(norm, self.CANONICAL_MAP)
+        if not canon: return _NO_TOKENS
+        tok = normalize_key(canon)
+        if tok in self.STOPWORDS: return _NO_TOKENS
+        city, pref, region = self._geo(tok)
+        if city or pref or region:
+            out = set()
+            if city:   out.add(f"geo:city:{city}")
+            if pref:   out.add(f"geo:pref:{pref}")
+            if region: out.add(f"geo:region:{region}")
+            return frozenset(out)
+        out = {tok}
+        cat, sub1, sub2 = self.token_category.get(tok, ("other","other","other"))
+        if self.enable_link_sub1 and sub1 and sub1 != "other":
+            out.add(f"link:sub1:{sub1}")
+        if self.enable_link_sub2 and sub2 and sub2 != "other":
+            out.add(f"link:sub2:{sub2}")
+        return frozenset(out)
+
+    def _geo(self, tok_norm: str):
+        """geo_canonicalize と同じ判定（地方名は逆引き表で引く）"""
+        if tok_norm in self.CITY_TO_PREF:
+            pref_disp = self.CITY_TO_PREF[tok_norm]
+            return (tok_norm, pref_disp, self.PREF_TO_REGION.get(normalize_key(pref_disp), ""))
+        if is_prefecture(tok_norm, self.PREF_ALIASES):
+            pref_disp = self.PREF_ALIASES.get(tok_norm, tok_norm)
+            return (None, pref_disp, self.PREF_TO_REGION.get(normalize_key(pref_disp), ""))
+        region = self._region_by_norm.get(tok_norm)
+        if region is not None:
+            return (None, None, region)
+        return (None, None, None)
+
+    def stats_line(self):
+        return f"トークン展開表: 辞書 {len(self._table)}語 / 辞書外 {len(self._unseen)}語"
+
+def default_token_expander(CANONICAL_MAP, STOPWORDS, CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET,
+                           token_category, enable_link_sub1: bool, enable_link_sub2: bool) -> "TokenExpander":
+    """同じ辞書オブジェクト・フラグの組なら、前回作った TokenExpander をそのまま返す（辞書外の語だけ都度計算）"""
+    dicts = (CANONICAL_MAP, STOPWORDS, CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET, token_category)
+    key = tuple(id(d) for d in dicts) + (bool(enable_link_sub1), bool(enable_link_sub2))
+    hit = _DEFAULT_EXPANDERS.get(key)
+    # id は辞書が解放されると使い回されるので、同じオブジェクトかどうかも確かめる
+    if hit is not None and all(a is b for a, b in zip(hit[0], dicts)):
+        return hit[1]
+    expander = TokenExpander(CANONICAL_MAP, STOPWORDS, CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET,
+                             token_category, enable_link_sub1, enable_link_sub2, precompute=False)
+    _DEFAULT_EXPANDERS.put(key, (dicts, expander))
+    return expander
+
 def parse_features(raw, CANONICAL_MAP, STOPWORDS,
                    CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET,
                    token_category,
-                   enable_link_sub1: bool, enable_link_sub2: bool) -> set[str]:
+                   enable_link_sub1: bool, enable_link_sub2: bool, expander=None) -> set[str]:
+    """expander（TokenExpander）を渡すと、全員分の解析で展開表を使い回せる（省略時は default_token_expander）"""
     if raw is None: return set()
+    if expander is None:
+        expander = default_token_expander(CANONICAL_MAP, STOPWORDS, CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION,
+                                          REGION_SET, token_category, enable_link_sub1, enable_link_sub2)
     # raw can be list or string
     items = raw if isinstance(raw, list) else [x for x in str(raw).split(",")]
     toks = set()
     for x in items:
+        # 要素の扱いは従来どおり（None も normalize_key に任せる。TokenExpander.expand 参照）
         if not str(x).strip(): continue
-        norm = normalize_key(x)
-        canon = canonicalize_token(norm, CANONICAL_MAP)
-        if not canon or normalize_key(canon) in STOPWORDS: continue
-        c, p, r = geo_canonicalize(normalize_key(canon), CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET)
-        if c or p or r:
-            toks |= geo_expand_tokens(normalize_key(canon), CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET)
-        else:
-            tok = normalize_key(canon)
-            toks.add(tok)
-            cat, sub1, sub2 = token_category.get(tok, ("other","other","other"))
-            if enable_link_sub1 and sub1 and sub1 != "other":
-                toks.add(f"link:sub1:{sub1}")
-            if enable_link_sub2 and sub2 and sub2 != "other":
-                toks.add(f"link:sub2:{sub2}")
+        toks |= expander.expand(x)
     return toks
 
+# ===================== 特徴解析のキャッシュ =====================
+#  - しきい値やリンク重みを変えただけの再実行では、parse_features をやり直さない
+#  - キーは「入力JSONのフィンガープリント」と enable_link_sub1/2 の組
+#  - Streamlit の再実行をまたいで残るよう、モジュール変数として持つ（セッション間で共有）
+NETWORK_SOURCE_FILES = (OUT_NETWORK_JSON,) + DICT_SOURCE_FILES
+PARSE_CACHE_MAX_ENTRIES = 8
+PAIR_TABLE_CACHE_MAX_ENTRIES = 4
+
+def source_fingerprint(paths=NETWORK_SOURCE_FILES) -> str:
+    """ファイルのパス・サイズ・更新時刻から作るフィンガープリント（無いファイルは missing として扱う）"""
+    h = hashlib.sha256()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            h.update(f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode("utf-8"))
+        except OSError:
+            h.update(f"{path}\0missing\n".encode("utf-8"))
+    return h.hexdigest()
+
+class ResultCache:
+    """再実行間で計算結果を使い回すための小さなLRUキャッシュ（スレッドセーフ）"""
+
+    def __init__(self, label, max_entries):
+        self.label = label
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            people = self._entries.get(key)
+            if people is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return people
+
+    def put(self, key, people):
+        with self._lock:
+            self._entries[key] = people
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats_line(self):
+        return f"{self.label}: ヒット {self.hits}件 / ミス {self.misses}件 / 保持 {len(self._entries)}件"
+
+# (フィンガープリント, sub1有効, sub2有効) → MemberFeatures
+PARSE_CACHE = ResultCache("特徴解析キャッシュ", PARSE_CACHE_MAX_ENTRIES)
+# (辞書オブジェクトの id, sub1有効, sub2有効) → (辞書, TokenExpander)。expander を渡さない parse_features 用
+_DEFAULT_EXPANDERS = ResultCache("トークン展開表キャッシュ", 4)
+# (フィンガープリント, sub1有効, sub2有効, sub1重み, sub2重み, 表示する人) → PairScoreTable
+PAIR_TABLE_CACHE = ResultCache("ペアスコア表キャッシュ", PAIR_TABLE_CACHE_MAX_ENTRIES)
+
+def parse_people(data_records: list, CANONICAL_MAP: dict, STOPWORDS: set,
+                 CITY_TO_PREF: dict, PREF_ALIASES: dict, PREF_TO_REGION: dict, REGION_SET: set,
+                 token_category: dict, enable_link_sub1: bool, enable_link_sub2: bool,
+                 cache_key=None):
+    """全レコードを解析して MemberFeatures を返す。cache_key（source_fingerprint）があればキャッシュを使う"""
+    key = None
+    if cache_key is not None:
+        key = (cache_key, bool(enable_link_sub1), bool(enable_link_sub2))
+        members = PARSE_CACHE.get(key)
+        if members is not None:
+            print(PARSE_CACHE.stats_line())
+            return members
+    expander = TokenExpander(CANONICAL_MAP, STOPWORDS, CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET,
+                             token_category, enable_link_sub1, enable_link_sub2)
+    people = []
+    for r in data_records:
+        name = str(r.get("Name","")).strip()
+        if not name: continue
+        feats = parse_features(
+            r.get("Features"), CANONICAL_MAP, STOPWORDS,
+            CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET,
+            token_category,enable_link_sub1, enable_link_sub2, expander=expander
+        )
+        people.append((name, feats))
+    # 語彙を共有したトークン番号の配列にまとめて持つ（キャッシュに残るのはこちらだけ）
+    members = MemberFeatures.from_people(people)
+    if key is not None:
+        PARSE_CACHE.put(key, members)
+        print(PARSE_CACHE.stats_line())
+    return members
+
 
 
 # --------------------------------------------------------
@@ -327,46 +651,509 @@ def pair_score_and_common(f1: set, f2: set, token_category: dict, subcat_weights
     score = sum(token_weight(t, token_category, subcat_weights, link_sub1_weight, link_sub2_weight) for t in common)
     return score, common
 
+# ===================== メンバー特徴のコンパクト表現 =====================
+#  - 全員分のトークンを1つの語彙（文字列の昇順に並べたリスト）にまとめ、各メンバーは
+#    トークン番号の昇順配列 array('I') で持つ（set[str] よりずっと小さい）
+#  - 番号は文字列の昇順に振るので、番号の昇順＝従来の sorted(共通トークン) の順になり、
+#    重みを足す順番（＝浮動小数の結果）も従来と変わらない
+#  - 共通トークンは番号どうしの積集合で求め、表示用の文字列には必要なときだけ戻す
+class MemberFeatures:
+    """名前の並びと、メンバーごとのトークン番号配列（語彙は全員で共有）"""
+
+    def __init__(self, names: list, rows: list, vocab: list):
+        self.names = names
+        self.rows = rows        # [array('I'), ...]（各配列は昇順）
+        self.vocab = vocab      # 番号 → トークン文字列（昇順）
+
+    @classmethod
+    def from_people(cls, people):
+        """[(name, feats), ...] から作る"""
+        vocab = sorted(set().union(*(feats for _, feats in people))) if people else []
+        ids = {t: k for k, t in enumerate(vocab)}
+        names = [name for name, _ in people]
+        rows = [array("I", sorted(ids[t] for t in feats)) for _, feats in people]
+        return cls(names, rows, vocab)
+
+    def __len__(self):
+        return len(self.names)
+
+    def size(self, i) -> int:
+        """i 番目のメンバーの特徴数"""
+        return len(self.rows[i])
+
+    def tokens(self, i) -> list:
+        """i 番目のメンバーのトークン（昇順の文字列リスト）"""
+        vocab = self.vocab
+        return [vocab[k] for k in self.rows[i]]
+
+    def decode(self, ids) -> list:
+        vocab = self.vocab
+        return [vocab[k] for k in ids]
+
+    def common(self, i, j) -> list:
+        """i 番目と j 番目のメンバーに共通するトークン番号（昇順）。昇順の配列どうしをマージして求める"""
+        a, b = self.rows[i], self.rows[j]
+        na, nb = len(a), len(b)
+        out = []
+        x = y = 0
+        while x < na and y < nb:
+            ka, kb = a[x], b[y]
+            if ka < kb:
+                x += 1
+            elif kb < ka:
+                y += 1
+            else:
+                out.append(ka)
+                x += 1
+                y += 1
+        return out
+
+    def subset(self, names):
+        """指定した名前のメンバーだけを残す（語彙はそのまま共有）"""
+        names = set(names)
+        keep = [i for i, name in enumerate(self.names) if name in names]
+        return MemberFeatures([self.names[i] for i in keep], [self.rows[i] for i in keep], self.vocab)
+
+# ===================== ペアのスコア計算エンジン =====================
+#  - python: 全ペアを itertools.combinations で比較（従来の実装）
+#  - sparse: メンバー×トークンの疎行列 X とトークン重み w から、全ペアのスコアを
+#            X·diag(w)·Xᵀ の1回の疎行列積で求める（scipy が必要）
+#  - index : トークン→メンバーの転置インデックスから、共通トークンを持つペアだけを候補にする
+#            （多くのペアが何も共有しないコミュニティ向け。scipy 不要）
+#  - auto  : scipy があれば sparse、無ければ index
+#  sparse/index は候補ペアを絞り込むだけで、残ったペアは従来と同じ順序で足し直すので、
+#  エッジの重み・共通特徴・追加順は python エンジンと完全に一致する。
+SCORE_ENGINES = ("auto", "python", "sparse", "index")
+
+# index エンジンで「高頻度トークン」とみなす出現人数の割合（と最低人数）
+#  例: geo:pref:* や link:sub1:* のように多くの人が持つトークンは、トークンごとに全ペアを列挙せず、
+#      同じ高頻度トークンの組を持つメンバーをまとめて扱う
+HEAVY_TOKEN_RATIO = 0.1
+HEAVY_TOKEN_MIN_DF = 32
+
+def score_pairs(people, min_edge_score: float, token_category: dict, subcat_weights: dict,
+                link_sub1_weight: float, link_sub2_weight: float, engine: str = "auto"):
+    """people=[(name, feats), ...] または MemberFeatures → しきい値以上の (i, j, score, common) を i<j の辞書順で返す"""
+    members = people if isinstance(people, MemberFeatures) else MemberFeatures.from_people(people)
+    return [(i, j, score, members.decode(ids))
+            for i, j, score, ids in score_member_pairs(members, min_edge_score, token_category, subcat_weights,
+                                                       link_sub1_weight, link_sub2_weight, engine=engine)]
+
+def score_member_pairs(members: MemberFeatures, min_edge_score: float, token_category: dict, subcat_weights: dict,
+                       link_sub1_weight: float, link_sub2_weight: float, engine: str = "auto"):
+    """score_pairs の本体。共通トークンは番号のリスト（昇順）のまま返す"""
+    if engine == "auto":
+        engine = "sparse" if sp is not None else "index"
+    if engine == "sparse" and sp is None:
+        engine = "index"
+
+    # トークンごとの重みは1回だけ計算する（番号で引ける配列）
+    w = [token_weight(t, token_category, subcat_weights, link_sub1_weight, link_sub2_weight) for t in members.vocab]
+
+    if engine == "sparse":
+        candidates = _candidate_pairs_sparse(members, w, min_edge_score)
+    elif engine == "index":
+        candidates = _candidate_pairs_index(members, w, min_edge_score)
+    else:
+        candidates = itertools.combinations(range(len(members)), 2)
+
+    # 共通トークン番号の取り出しは int の集合との積で行う（C実装なので速い）。
+    # 候補は i の昇順に並んでいるので、集合は i が変わったときに1つだけ作る（全員分は持たない）
+    rows = members.rows
+    out = []
+    cur_i, cur = -1, None
+    for i, j in candidates:
+        if i != cur_i:
+            cur_i, cur = i, frozenset(rows[i])
+        common = cur.intersection(rows[j])
+        if not common: continue
+        ids = sorted(common)
+        score = sum(w[k] for k in ids)
+        if score >= min_edge_score:
+            out.append((i, j, score, ids))
+    return out
+
+def _candidate_pairs_sparse(members: MemberFeatures, w: list, min_edge_score: float):
+    """X·diag(w)·Xᵀ でスコアを一括計算し、しきい値付近以上の (i, j) を i<j の辞書順で返す"""
+    n = len(members)
+    lengths = np.fromiter((len(row) for row in members.rows), dtype=np.int64, count=n)
+    cols = np.fromiter(itertools.chain.from_iterable(members.rows), dtype=np.int64, count=int(lengths.sum()))
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    X = sp.csr_matrix((np.ones(len(cols), dtype=np.float64), cols, indptr), shape=(n, len(w)))
+    weights = np.array(w, dtype=np.float64)
+
+    # 重みを実部、1を虚部にした対角行列を挟むと、1回の積で
+    #   実部 = 共通トークンの重みの合計（スコア）、虚部 = 共通トークン数
+    # が同時に求まる（上三角＝i<j のペアだけ使う）
+    products = sp.triu(X @ sp.diags(weights + 1j) @ X.T, k=1).tocoo()
+    pair_i, pair_j = products.row, products.col
+    scores, common_counts = products.data.real, products.data.imag
+
+    keep = (common_counts > 0.5) & (scores >= min_edge_score - _score_tolerance(min_edge_score, w))
+    order = np.lexsort((pair_j[keep], pair_i[keep]))
+    return zip(pair_i[keep][order].tolist(), pair_j[keep][order].tolist())
+
+def _score_tolerance(min_edge_score: float, w: list) -> float:
+    """浮動小数の足し算の順序の差で境界のペアを落とさないよう、候補は少し緩めに取る"""
+    return 1e-9 * max(1.0, abs(min_edge_score), sum(abs(x) for x in w))
+
+def _candidate_pairs_index(members: MemberFeatures, w: list, min_edge_score: float):
+    """転置インデックス（トークン番号→メンバー番号）から候補ペアを作り、i<j の辞書順で返す"""
+    n = len(members)
+    postings = [[] for _ in w]
+    for i, row in enumerate(members.rows):
+        for k in row:
+            postings[k].append(i)
+    heavy_df = max(HEAVY_TOKEN_MIN_DF, int(n * HEAVY_TOKEN_RATIO))
+    heavy = [len(ids) > heavy_df for ids in postings]
+    threshold = min_edge_score - _score_tolerance(min_edge_score, w)
+
+    # 低頻度トークン: 同じリストに載っているペアを列挙し、スコアを積み上げる
+    light_score = {}
+    for k, ids in enumerate(postings):
+        if heavy[k]: continue
+        wk = w[k]
+        for a in range(len(ids)):
+            ia = ids[a]
+            for b in range(a + 1, len(ids)):
+                key = (ia, ids[b])
+                light_score[key] = light_score.get(key, 0.0) + wk
+
+    # 高頻度トークン: ペアは列挙せず、メンバーを「持っている高頻度トークンの組（シグネチャ）」でまとめる
+    #  （都道府県・地方・link:* の組み合わせは人数よりずっと少ない）
+    signature = [tuple(k for k in row if heavy[k]) for row in members.rows]
+    groups = {}
+    for i, sig in enumerate(signature):
+        if sig: groups.setdefault(sig, []).append(i)
+    shared_cache = {}
+    def shared(sa, sb):
+        """2つのシグネチャに共通する高頻度トークンの重み合計（共通が無ければ None）"""
+        key = (sa, sb) if sa <= sb else (sb, sa)
+        s = shared_cache.get(key, False)
+        if s is False:
+            common = sorted(set(sa).intersection(sb))
+            s = shared_cache[key] = sum(w[k] for k in common) if common else None
+        return s
+
+    # 低頻度トークンを共有するペアは、高頻度トークンの分を足した正確なスコアで判定する
+    candidates = {key for key, s in light_score.items()
+                  if s + (shared(signature[key[0]], signature[key[1]]) or 0.0) >= threshold}
+    # 高頻度トークンしか共有しないペアは、グループの組ごとに1回だけ判定し、しきい値に届く組の中だけ列挙する
+    sigs = list(groups)
+    for a in range(len(sigs)):
+        ga = groups[sigs[a]]
+        for b in range(a, len(sigs)):
+            s = shared(sigs[a], sigs[b])
+            if s is None or s < threshold: continue
+            gb = groups[sigs[b]]
+            pairs = itertools.combinations(ga, 2) if a == b else itertools.product(ga, gb)
+            for i, j in pairs:
+                key = (i, j) if i < j else (j, i)
+                if key not in light_score:
+                    candidates.add(key)
+    return sorted(candidates)
+
+# ===================== ペアスコア表 =====================
+#  - 共通トークンを持つペアのうち、スコアが floor 以上のものを1回だけ計算し、スコアの降順に並べて持つ
+#    （floor を付けると index エンジンの高頻度トークンの枝刈りが効く。floor より下のしきい値が来たら作り直す）
+#  - しきい値を変えたときは二分探索で「しきい値以上」の範囲を求めてスライスするだけ
+#  - 取り出したペアはスコアの降順（同点は i<j の辞書順）のまま返す（並べ直さない）
+#  - ペアごとの共通トークン番号と表示用文字列は、初めて取り出したときに求めて覚えておく
+class PairScoreTable:
+    """MemberFeatures と、共通トークンを持つ全ペアの (i, j, score)（i<j の辞書順）をまとめた表"""
+
+    def __init__(self, members: MemberFeatures, pairs, floor: float = float("-inf")):
+        self.members = members
+        self.floor = floor    # この表に入っているのはスコアが floor 以上のペアだけ
+        # ペアは数百万件になりうるので、タプルではなく列ごとの配列で持つ（共通トークンは取り出すときに求める）
+        self._i, self._j, self._score = array("I"), array("I"), array("d")
+        for i, j, score in pairs:
+            self._i.append(i); self._j.append(j); self._score.append(score)
+        # スコアの降順（同点は辞書順のまま）に並べた添字と、二分探索用の符号反転スコア
+        scores = self._score
+        self._order = array("I", sorted(range(len(scores)), key=lambda k: -scores[k]))
+        self._neg_scores = array("d", (-scores[k] for k in self._order))
+        self._pretty = {}
+        self._common = {}   # ペアの添字 → (共通トークン番号, 表示用の共通特徴)
+        self._last = None   # 直近の切り出し条件と結果（グラフとエッジ一覧で同じものを使う）
+
+    def __len__(self):
+        return len(self._score)
+
+    def covers(self, min_edge_score: float) -> bool:
+        """しきい値 min_edge_score のエッジをこの表だけで切り出せるか"""
+        return min_edge_score >= self.floor
+
+    def count(self, min_edge_score: float) -> int:
+        """スコアが min_edge_score 以上のペア数"""
+        return bisect.bisect_right(self._neg_scores, -min_edge_score)
+
+    def threshold_for_budget(self, max_edges: int) -> float:
+        """
+        エッジ数が max_edges 本以下になる最小のしきい値（エッジ数の上限モード用）。
+        表はスコアの降順に並んでいるので、max_edges 番目のスコアを見るだけで決まる。
+        同点が上限をまたぐ場合は、その点数より1段上のスコアをしきい値にする
+        floor 付きの表では、ペアが max_edges 本より多く入っているときだけ正しい（budget_pair_table を使う）
+        """
+        neg = self._neg_scores
+        if not neg:
+            return 0.0
+        if max_edges >= len(neg):
+            return -neg[-1]
+        if max_edges <= 0:
+            return math.nextafter(-neg[0], math.inf)
+        score = -neg[max_edges]              # 上限の1本外側のペアのスコア
+        first = bisect.bisect_left(neg, -score)
+        if first == 0:
+            # 最高点のペアだけで上限を超える
+            return math.nextafter(score, math.inf)
+        return -neg[first - 1]
+
+    def score_histogram(self, bins: int = 20):
+        """全ペアのスコアのヒストグラム (counts, edges)。numpy が無ければ空を返す"""
+        if np is None or not len(self._score):
+            return [], []
+        counts, edges = np.histogram(np.frombuffer(self._score, dtype=np.float64), bins=bins)
+        return counts.tolist(), edges.tolist()
+
+    def select(self, min_edge_score: float, top_k: int = 0, mutual: bool = False) -> list:
+        """
+        スコアが min_edge_score 以上のペアを (i, j, score, common_ids, common_features) として
+        スコアの降順（同点は i<j の辞書順）で返す。top_k>0 なら各メンバーの上位 top_k 本だけに絞る（top_k_pairs）
+        """
+        cond = (min_edge_score, int(top_k or 0), bool(mutual))
+        last = self._last
+        if last is not None and last[0] == cond:
+            return last[1]
+        ks = self._order[:self.count(min_edge_score)]
+        if top_k and top_k > 0:
+            # 並びがスコアの降順・同点は辞書順なので、top_k_pairs の同点の扱い（前にあるペアを優先）も変わらない
+            _i, _j, _score = self._i, self._j, self._score
+            picked = top_k_pairs([(_i[k], _j[k], _score[k], k) for k in ks], len(self.members), top_k, mutual)
+            ks = [p[3] for p in picked]
+        out = [self._pair(k) for k in ks]
+        self._last = (cond, out)
+        return out
+
+    def _pair(self, k):
+        common = self._common.get(k)
+        i, j = self._i[k], self._j[k]
+        if common is None:
+            ids = self.members.common(i, j)
+            common = self._common[k] = (ids, _join_pretty(self.members, ids, self._pretty))
+        return (i, j, self._score[k], common[0], common[1])
+
+# ===================== 上位k本だけ残すモード =====================
+#  - 人気のあるメンバーにエッジが集中して図が毛玉になるのを防ぐ
+#  - 各メンバーについて、スコアの高い順に k 本までのエッジを残す（全体のエッジ数は n·k 本以下）
+#  - mutual=True なら「お互いの上位 k 本に入っている」ペアだけ残す（相互kNN）
+#  - 全エッジを並べ替えず、メンバーごとに heapq.nlargest で上位 k 本だけ選ぶ
+def top_k_pairs(pairs: list, n: int, k: int, mutual: bool = False) -> list:
+    """(i, j, score, ...) のリストから、各メンバーの上位 k 本に入るペアだけを元の順序のまま返す"""
+    if not k or k <= 0:
+        return pairs
+    incident = [[] for _ in range(n)]
+    for p, pair in enumerate(pairs):
+        incident[pair[0]].append(p)
+        incident[pair[1]].append(p)
+    votes = bytearray(len(pairs))
+    for ps in incident:
+        if len(ps) > k:
+            # 同点のときは先に並んでいる（辞書順で前の）ペアを優先する
+            ps = heapq.nlargest(k, ps, key=lambda p: (pairs[p][2], -p))
+        for p in ps:
+            votes[p] += 1
+    need = 2 if mutual else 1
+    return [pair for p, pair in enumerate(pairs) if votes[p] >= need]
+
+# ===================== 1人を起点にした類似度ランキング =====================
+#  - 起点のメンバーと他の全員の「共通トークンの重み合計」を計算する（エッジの重みと同じ式・同じ足し順）
+#  - 全ペアの表は作らないので、人数×特徴数の計算で済む（analyze.py の「似ている人」で使う）
+def similar_members(members: MemberFeatures, name: str, token_category: dict, subcat_weights: dict,
+                    link_sub1_weight: float = 0.6, link_sub2_weight: float = 0.6, k: int = 5) -> list:
+    """name と似ている順に [(j, score, common_ids), ...] を最大 k 件返す（同点は名前の並び順。name がいなければ空）"""
+    try:
+        target = members.names.index(name)
+    except ValueError:
+        return []
+    w = {}
+    mine = frozenset(members.rows[target])
+    scored = []
+    for j, row in enumerate(members.rows):
+        if j == target: continue
+        ids = sorted(mine.intersection(row))
+        if not ids: continue
+        for t in ids:
+            if t not in w:
+                w[t] = token_weight(members.vocab[t], token_category, subcat_weights or {},
+                                    link_sub1_weight, link_sub2_weight)
+        scored.append((sum(w[t] for t in ids), j, ids))
+    top = heapq.nsmallest(k, scored, key=lambda x: (-x[0], x[1])) if k and k > 0 else \
+        sorted(scored, key=lambda x: (-x[0], x[1]))
+    return [(j, score, ids) for score, j, ids in top]
+
+def _join_pretty(members: MemberFeatures, ids, pretty: dict) -> str:
+    vocab = members.vocab
+    for k in ids:
+        if k not in pretty: pretty[k] = pretty_token(vocab[k])
+    return "、".join(pretty[k] for k in ids)
+
+def build_pair_table(members: MemberFeatures, token_category: dict, subcat_weights: dict,
+                     link_sub1_weight: float, link_sub2_weight: float, engine: str = "auto",
+                     floor: float = float("-inf")):
+    """MemberFeatures から PairScoreTable を作る（スコアが floor 以上のペアだけ。既定は全ペア）"""
+    pairs = score_member_pairs(members, floor, token_category, subcat_weights or {},
+                               link_sub1_weight, link_sub2_weight, engine=engine)
+    return PairScoreTable(members, ((i, j, score) for i, j, score, _ in pairs), floor)
+
+# 表の floor（どのスコア以上のペアを表に入れるか）
+#  全ペアの表は、県・地方・link:* のように大半の人が持つトークンがあるとほぼ n² 件になり、
+#  メモリも作成時間も人数の2乗で増える。そこで表は「スライダの値を切り下げた floor 以上」のペアだけで作る。
+#  floor 以上の範囲でしきい値を動かす・エッジ数の上限を変えるのは、従来どおり二分探索とスライスだけで済む。
+#  floor より下にスライダを下げたときだけ、floor を下げて1回作り直す（以降はその表を使い回す）。
+#  floor はこの刻みに切り下げる（スライダを少し下げるたびに表を作り直さないように）
+PAIR_TABLE_FLOOR_STEP = 2.0
+# エッジ数の上限モードで最初に試す floor（ペアが足りなければ半分ずつ下げ、最後は全ペア）
+PAIR_TABLE_BUDGET_START_FLOOR = 8.0
+
+def _table_floor(min_edge_score: float) -> float:
+    if not math.isfinite(min_edge_score) or min_edge_score < 0:
+        return float("-inf")
+    return math.floor(min_edge_score / PAIR_TABLE_FLOOR_STEP) * PAIR_TABLE_FLOOR_STEP
+
+def pair_score_table(data_records: list,
+                     token_category: dict, subcat_weights: dict, CANONICAL_MAP: dict, STOPWORDS: set,
+                     CITY_TO_PREF: dict, PREF_ALIASES: dict, PREF_TO_REGION: dict, REGION_SET: set,
+                     subset=None,
+                     enable_link_sub1=True, enable_link_sub2=True,
+                     link_sub1_weight=0.6, link_sub2_weight=0.6,
+                     engine="auto", parse_cache_key=None, min_edge_score=float("-inf")):
+    """
+    build_graph と同じ引数から PairScoreTable を作る。
+    表には min_edge_score（を PAIR_TABLE_FLOOR_STEP 刻みに切り下げた値）以上のペアだけを入れる。
+    parse_cache_key（source_fingerprint）があれば、特徴解析と表の両方を再実行間で使い回す
+    （キャッシュの表が min_edge_score を切り出せない場合だけ、floor を下げて作り直す）
+    """
+    floor = _table_floor(min_edge_score)
+    key = None
+    if parse_cache_key is not None:
+        key = (parse_cache_key, bool(enable_link_sub1), bool(enable_link_sub2),
+               float(link_sub1_weight), float(link_sub2_weight), tuple(subset) if subset else None)
+        table = PAIR_TABLE_CACHE.get(key)
+        if table is not None and table.covers(min_edge_score):
+            print(PAIR_TABLE_CACHE.stats_line())
+            return table
+        if table is not None:
+            floor = min(floor, table.floor)
+    members = parse_people(data_records, CANONICAL_MAP, STOPWORDS,
+                           CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET,
+                           token_category, enable_link_sub1, enable_link_sub2,
+                           cache_key=parse_cache_key)
+    if subset:
+        members = members.subset(subset)
+    table = build_pair_table(members, token_category, subcat_weights,
+                             link_sub1_weight, link_sub2_weight, engine=engine, floor=floor)
+    if key is not None:
+        PAIR_TABLE_CACHE.put(key, table)
+        print(PAIR_TABLE_CACHE.stats_line())
+    return table
+
+def budget_pair_table(max_edges: int, *args, **kwargs):
+    """
+    エッジ数の上限モード用。pair_score_table と同じ引数（min_edge_score 以外）で、
+    上限より多くのペアが入る floor の表を作り、(表, エッジ数が max_edges 本以下になるしきい値) を返す
+    """
+    floor = PAIR_TABLE_BUDGET_START_FLOOR
+    while True:
+        table = pair_score_table(*args, min_edge_score=floor, **kwargs)
+        if len(table) > max_edges or table.floor == float("-inf"):
+            return table, table.threshold_for_budget(max_edges)
+        floor = min(floor, table.floor)
+        floor = floor / 2 if floor >= 1.0 else float("-inf")
+
+def _graph_from_pairs(members: MemberFeatures, pairs):
+    """pairs=[(i, j, score, common_ids, common_features), ...] からグラフを作る"""
+    G = nx.Graph()
+    for i, name in enumerate(members.names):
+        G.add_node(name, size=members.size(i), label=name)
+    for i, j, score, ids, features in pairs:
+        G.add_edge(members.names[i], members.names[j],
+                   weight=score,
+                   common_features=features,
+                   common_count=len(ids))
+    return G
+
+def graph_from_table(table: PairScoreTable, min_edge_score: float, top_k: int = 0, mutual: bool = False):
+    """ペアスコア表から、しきい値以上（top_k>0 なら各メンバー上位 top_k 本）のエッジだけを持つグラフを作る"""
+    return _graph_from_pairs(table.members, table.select(min_edge_score, top_k, mutual))
+
+def edge_table_df(table: PairScoreTable, min_edge_score: float, top_k: int = 0, mutual: bool = False):
+    """エッジ一覧（重い順）の DataFrame。画面表示とCSVダウンロードの両方で使う"""
+    names = table.members.names
+    rows = []
+    for i, j, score, ids, features in table.select(min_edge_score, top_k, mutual):
+        rows.append({"A": names[i], "B": names[j], "score": score,
+                     "common_count": len(ids),
+                     "common_features": features})
+    if not rows:
+        return pd.DataFrame(columns=["A", "B", "score", "common_count", "common_features"])
+    return pd.DataFrame(rows).sort_values(["score","common_count"], ascending=False, kind="stable")
+
+def show_budget_summary(table: PairScoreTable, min_edge_score: float, container=None):
+    """エッジ数の上限モードで決まったしきい値と、ペアスコアのヒストグラムを表示する（既定はサイドバー）"""
+    container = container or st.sidebar
+    above = f"スコア{table.floor:g}以上の" if math.isfinite(table.floor) else ""
+    container.caption(f"自動で決めたしきい値: {min_edge_score:.2f}（エッジ {table.count(min_edge_score)}本 / "
+                      f"{above}候補 {len(table)}ペア）")
+    counts, edges = table.score_histogram()
+    if counts:
+        hist = pd.DataFrame({"ペア数": counts}, index=pd.Index([round(e, 2) for e in edges[:-1]], name="スコア"))
+        container.bar_chart(hist, height=150)
+
 # ===================== グラフ構築（JSON レコード） =====================
 def build_graph(data_records: list, min_edge_score: float,
                 token_category: dict, subcat_weights: dict, CANONICAL_MAP: dict, STOPWORDS: set,
                 CITY_TO_PREF: dict, PREF_ALIASES: dict, PREF_TO_REGION: dict, REGION_SET: set,
                 subset=None,
                 enable_link_sub1=True, enable_link_sub2=True,
-                link_sub1_weight=0.6, link_sub2_weight=0.6,):
-    """data_records は JSON の配列（list[dict]）を想定"""
+                link_sub1_weight=0.6, link_sub2_weight=0.6,
+                engine="auto", parse_cache_key=None,
+                top_k=0, mutual_knn=False):
+    """
+    data_records は JSON の配列（list[dict]）を想定。engine はスコア計算エンジン（SCORE_ENGINES）
+    parse_cache_key に source_fingerprint() を渡すと、特徴解析とペアスコア表を再実行間で使い回す
+    （しきい値だけ変えた再実行では、表からエッジを切り出すだけになる）
+    top_k>0 なら、しきい値を満たすエッジのうち各メンバーの上位 top_k 本だけ残す（mutual_knn で相互kNN）
+    """
     if subcat_weights is None: subcat_weights = {}
-    people = []
-    for r in data_records:
-        name = str(r.get("Name","")).strip()
-        if not name: continue
-        if subset and name not in subset: continue
-        feats = parse_features(
-            r.get("Features"), CANONICAL_MAP, STOPWORDS,
-            CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET,
-            token_category,enable_link_sub1, enable_link_sub2
-        )
-        people.append((name, feats))
+    if parse_cache_key is not None:
+        table = pair_score_table(data_records, token_category, subcat_weights, CANONICAL_MAP, STOPWORDS,
+                                 CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET,
+                                 subset=subset,
+                                 enable_link_sub1=enable_link_sub1, enable_link_sub2=enable_link_sub2,
+                                 link_sub1_weight=link_sub1_weight, link_sub2_weight=link_sub2_weight,
+                                 engine=engine, parse_cache_key=parse_cache_key, min_edge_score=min_edge_score)
+        return graph_from_table(table, min_edge_score, top_k, mutual_knn)
+    members = parse_people(data_records, CANONICAL_MAP, STOPWORDS,
+                           CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET,
+                           token_category, enable_link_sub1, enable_link_sub2)
+    if subset:
+        members = members.subset(subset)
+    pairs = score_member_pairs(members, min_edge_score, token_category, subcat_weights,
+                               link_sub1_weight, link_sub2_weight, engine=engine)
+    pairs = top_k_pairs(pairs, len(members), top_k, mutual_knn)
+    pretty = {}
+    return _graph_from_pairs(members, ((i, j, score, ids, _join_pretty(members, ids, pretty))
+                                       for i, j, score, ids in pairs))
 
-    G = nx.Graph()
-    for name, feats in people:
-        G.add_node(name, size=len(feats), label=name)
-
-    for (n1, f1), (n2, f2) in itertools.combinations(people, 2):
-        score, common = pair_score_and_common(f1, f2, token_category, subcat_weights, link_sub1_weight, link_sub2_weight)
-        if score >= min_edge_score and len(common) > 0:
-            def pretty(t):
-                if t.startswith("geo:city:")  : return t.split(":",2)[2]
-                if t.startswith("geo:pref:")  : return t.split(":",2)[2]
-                if t.startswith("geo:region:"): return t.split(":",2)[2]
-                if t.startswith("link:sub1:"): return f"sub1:{t.split(':',2)[2]}"
-                if t.startswith("link:sub2:"): return f"sub2:{t.split(':',2)[2]}"
-                return t
-            G.add_edge(n1, n2,
-                       weight=score,
-                       common_features="、".join(pretty(t) for t in common),
-                       common_count=len(common))
-    return G
+def pretty_token(t):
+    """ツールチップ・エッジ一覧用の表示名"""
+    if t.startswith("geo:city:")  : return t.split(":",2)[2]
+    if t.startswith("geo:pref:")  : return t.split(":",2)[2]
+    if t.startswith("geo:region:"): return t.split(":",2)[2]
+    if t.startswith("link:sub1:"): return f"sub1:{t.split(':',2)[2]}"
+    if t.startswith("link:sub2:"): return f"sub2:{t.split(':',2)[2]}"
+    return t
 
 
 
@@ -375,9 +1162,62 @@ def build_graph(data_records: list, min_edge_score: float,
 #  - ノード名を常時表示（font/scaling設定）
 #  - set_options は JSON 文字列のみ受け付けるため、json.dumps で渡す
 #  - エッジのタイトルにスコア＆共通特徴を表示
+#  - layout="physics" はブラウザで Barnes-Hut の物理演算（従来どおり）
+#    layout="spring"/"spectral" はサーバーで座標を1回だけ計算し、物理演算なしの固定座標で送る
+#    （大きなグラフでもブラウザ側の安定化計算が要らない）
+#  - 生成したHTMLは「グラフ＋表示オプション」のハッシュでキャッシュし、再実行時は作り直さない
 # --------------------------------------------------------
 
-def show_pyvis(G, height_px=800, label_font_size=16):
+LAYOUTS = ("physics", "spring", "spectral")
+# サイドバーの表示名 → layout
+LAYOUT_CHOICES = {"ブラウザで計算（物理演算）": "physics",
+                  "サーバーで計算（ばねモデル・固定）": "spring",
+                  "サーバーで計算（スペクトル・固定）": "spectral"}
+LAYOUT_SCALE_PX = 1000          # サーバー計算の座標（-1〜1）をこのピクセル幅に広げる
+PYVIS_HTML_CACHE = ResultCache("ネットワーク図HTMLキャッシュ", 8)
+LAYOUT_CACHE = ResultCache("レイアウトキャッシュ", 8)
+
+def graph_fingerprint(G) -> str:
+    """ノード・エッジとその属性から作るハッシュ（同じグラフなら同じ値）"""
+    h = hashlib.sha256()
+    for n, data in G.nodes(data=True):
+        h.update(f"n\0{n}\0{data.get('label', n)}\0{data.get('size', 0)}\n".encode("utf-8"))
+    for u, v, d in G.edges(data=True):
+        h.update(f"e\0{u}\0{v}\0{d.get('weight', 0)!r}\0{d.get('common_features', '')}\n".encode("utf-8"))
+    return h.hexdigest()
+
+def compute_layout(G, layout="spring", graph_key=None):
+    """サーバー側でノード座標を計算する {node: (x, y)}（重み付き。graph_key があればキャッシュ）"""
+    key = (graph_key, layout) if graph_key else None
+    if key is not None:
+        pos = LAYOUT_CACHE.get(key)
+        if pos is not None:
+            return pos
+    if G.number_of_nodes() == 0:
+        pos = {}
+    elif (layout == "spectral" and G.number_of_nodes() > 2 and np is not None
+          and (sp is not None or G.number_of_nodes() < 500)):
+        # グラフラプラシアンの固有ベクトルで配置する
+        # （networkx は500ノード未満なら numpy の密行列、それ以上は scipy の疎行列固有値計算を使う）
+        pos = nx.spectral_layout(G, weight="weight")
+    else:
+        # numpy/scipy があれば networkx がベクトル化した Fruchterman-Reingold で計算する
+        pos = nx.spring_layout(G, weight="weight", seed=0, iterations=50)
+    pos = {n: (float(x) * LAYOUT_SCALE_PX / 2, float(y) * LAYOUT_SCALE_PX / 2) for n, (x, y) in pos.items()}
+    if key is not None:
+        LAYOUT_CACHE.put(key, pos)
+    return pos
+
+def pyvis_html(G, height_px=800, label_font_size=16, layout="physics"):
+    """ネットワーク図のHTMLを作る（グラフ＋表示オプションが同じなら前回のHTMLを返す）"""
+    graph_key = graph_fingerprint(G)
+    key = (graph_key, int(height_px), int(label_font_size), layout)
+    html = PYVIS_HTML_CACHE.get(key)
+    if html is not None:
+        return html
+    static = layout != "physics"
+    pos = compute_layout(G, layout, graph_key=graph_key) if static else {}
+
     net = Network(height=f"{height_px}px", width="100%", notebook=False, directed=False)
     net.barnes_hut()
     options = {
@@ -391,14 +1231,27 @@ def show_pyvis(G, height_px=800, label_font_size=16):
       "physics": {"solver": "barnesHut", "stabilization": {"iterations": 200}},
       "interaction": {"hover": True, "tooltipDelay": 100}
     }
+    if static:
+        # 座標は計算済みなので物理演算はしない（曲線エッジの計算も省く）
+        options["physics"] = {"enabled": False}
+        options["edges"] = {"smooth": False}
     net.set_options(json.dumps(options, ensure_ascii=False))
     for n, data in G.nodes(data=True):
         label = data.get("label", n); title = f"{label}<br>特徴数: {data.get('size',0)}"
-        net.add_node(n, label=label, title=title)
+        if static:
+            x, y = pos[n]
+            net.add_node(n, label=label, title=title, x=x, y=y, physics=False)
+        else:
+            net.add_node(n, label=label, title=title)
     for u, v, d in G.edges(data=True):
         title = f"スコア: {d.get('weight',0)}<br>共通: {d.get('common_features','')}"
         net.add_edge(u, v, value=d.get("weight",1), title=title)
     html = net.generate_html()
+    PYVIS_HTML_CACHE.put(key, html)
+    return html
+
+def show_pyvis(G, height_px=800, label_font_size=16, layout="physics"):
+    html = pyvis_html(G, height_px=height_px, label_font_size=label_font_size, layout=layout)
     st.components.v1.html(html, height=height_px, scrolling=True)
 
 
@@ -419,19 +1272,30 @@ def render_network_app():
     st.title("相関図")
 
     # ---- Load all JSONs (fixed filenames) ----
+    parse_cache_key = source_fingerprint()
     data_records = load_json_any(OUT_NETWORK_JSON)
-    CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET = build_geo_dicts_from_json(
-        CITY_TO_PREF_JSON, PREF_ALIASES_JSON, PREF_TO_REGION_JSON)
-    TOKEN_CATEGORY = load_token_category_json(TOKEN_CATEGORY_JSON)
-    CANONICAL_MAP  = load_canonical_map(CANONICAL_MAP_JSON)
-    STOPWORDS      = load_stopwords(STOPWORDS_JSON)
-    SUBCAT_WEIGHTS = load_subcat_weights_json(SUBCAT_WEIGHTS_JSON)  # optional; empty if not found
+    dicts = network_dicts()  # 正規化済みの辞書バンドル（元JSONが変われば作り直される）
+    CITY_TO_PREF, PREF_ALIASES = dicts["CITY_TO_PREF"], dicts["PREF_ALIASES"]
+    PREF_TO_REGION, REGION_SET = dicts["PREF_TO_REGION"], dicts["REGION_SET"]
+    TOKEN_CATEGORY = dicts["TOKEN_CATEGORY"]
+    CANONICAL_MAP  = dicts["CANONICAL_MAP"]
+    STOPWORDS      = dicts["STOPWORDS"]
+    SUBCAT_WEIGHTS = dicts["SUBCAT_WEIGHTS"]  # optional; empty if not found
 
     # ---- UI: only parameters (file pickers removed) ----
     st.sidebar.header("表示パラメータ")
-    min_edge_score = st.sidebar.slider("エッジ採用しきい値（合計スコア）", 0.0, 20.0, 2.0, 0.5)
+    threshold_mode = st.sidebar.radio("しきい値の決め方", ["スライダで指定", "エッジ数の上限から自動"], horizontal=True)
+    if threshold_mode == "スライダで指定":
+        min_edge_score = st.sidebar.slider("エッジ採用しきい値（合計スコア）", 0.0, 20.0, 2.0, 0.5)
+        edge_budget = None
+    else:
+        edge_budget = st.sidebar.number_input("描画するエッジ数の上限", min_value=10, max_value=100000, value=500, step=50)
+        min_edge_score = None
+    top_k = st.sidebar.number_input("1人あたりの最大エッジ数（0なら制限なし）", min_value=0, max_value=50, value=0, step=1)
+    mutual_knn = st.sidebar.checkbox("お互いに上位同士のペアだけ繋ぐ（相互kNN）", value=False, disabled=top_k == 0)
     graph_height   = st.sidebar.number_input("グラフ高さ(px)", min_value=400, max_value=1600, value=800, step=50)
     label_font_size = st.sidebar.number_input("ラベル文字サイズ", min_value=8, max_value=30, value=16, step=1)
+    layout = LAYOUT_CHOICES[st.sidebar.selectbox("ノードの配置", list(LAYOUT_CHOICES))]
     st.sidebar.divider()
     enable_link_sub1 = st.sidebar.checkbox("subcategory1一致で“ゆるいつながり”を作る", value=True)
     enable_link_sub2 = st.sidebar.checkbox("subcategory2一致で“ゆるいつながり”を作る", value=True)
@@ -445,29 +1309,33 @@ def render_network_app():
     subset = selected if selected else None
 
     # ---- Build graph ----
-    G = build_graph(data_records, min_edge_score, TOKEN_CATEGORY, SUBCAT_WEIGHTS, CANONICAL_MAP, STOPWORDS,
-                    CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET,
-                    subset=subset,
-                    # 以下は UI を用意している場合のみ
-                    enable_link_sub1=enable_link_sub1, enable_link_sub2=enable_link_sub2,
-                    link_sub1_weight=link_sub1_weight, link_sub2_weight=link_sub2_weight)
+    # しきい値以外が同じなら表はキャッシュから取り出され、エッジの切り出しだけで済む
+    table_args = (data_records, TOKEN_CATEGORY, SUBCAT_WEIGHTS, CANONICAL_MAP, STOPWORDS,
+                  CITY_TO_PREF, PREF_ALIASES, PREF_TO_REGION, REGION_SET)
+    # 以下は UI を用意している場合のみ
+    table_kwargs = dict(subset=subset,
+                        enable_link_sub1=enable_link_sub1, enable_link_sub2=enable_link_sub2,
+                        link_sub1_weight=link_sub1_weight, link_sub2_weight=link_sub2_weight,
+                        parse_cache_key=parse_cache_key)
+    if edge_budget:
+        # 表のスコア分布からしきい値を決める（グラフは作らない）
+        table, min_edge_score = budget_pair_table(edge_budget, *table_args, **table_kwargs)
+        show_budget_summary(table, min_edge_score)
+    else:
+        table = pair_score_table(*table_args, min_edge_score=min_edge_score, **table_kwargs)
+    G = graph_from_table(table, min_edge_score, top_k, mutual_knn)
 
     col1, col2 = st.columns([3,2], gap="large")
     with col1:
         st.subheader("ネットワーク図")
-        show_pyvis(G, height_px=graph_height, label_font_size=label_font_size)
+        show_pyvis(G, height_px=graph_height, label_font_size=label_font_size, layout=layout)
 
     with col2:
         st.subheader("エッジ一覧（重い順）")
         if G.number_of_edges() == 0:
             st.info("エッジがありません。しきい値や辞書を調整してください。")
         else:
-            rows = []
-            for u, v, d in G.edges(data=True):
-                rows.append({"A": u, "B": v, "score": d.get("weight",0),
-                             "common_count": d.get("common_count",0),
-                             "common_features": d.get("common_features","")})
-            edge_df = pd.DataFrame(rows).sort_values(["score","common_count"], ascending=False)
+            edge_df = edge_table_df(table, min_edge_score, top_k, mutual_knn)
             st.dataframe(edge_df, use_container_width=True)
             csv_buf = io.StringIO()
             edge_df.to_csv(csv_buf, index=False)
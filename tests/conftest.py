@@ -0,0 +1,7 @@
+import os
+import sys
+
+# リポジトリ直下のモジュール（network_app.py など）を import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# data_extraction / analyze は import 時に OpenAI クライアントを作るので、ダミーのキーを入れておく
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,308 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+import analyze
+
+
+# ---- OpenAI クライアントの代わり ----
+
+class _Message:
+    def __init__(self, content):
+        self.content = content
+
+class _Choice:
+    def __init__(self, content):
+        self.message = _Message(content)
+        self.delta = _Message(content)
+
+class _Response:
+    def __init__(self, content):
+        self.choices = [_Choice(content)] if content is not None else []
+
+class FakeStream:
+    def __init__(self, chunks, delay):
+        self._chunks = chunks
+        self._delay = delay
+        self.closed = False
+        self.sent = 0
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            time.sleep(self._delay)
+            if self.closed:
+                return
+            self.sent += 1
+            yield _Response(chunk)
+
+    def close(self):
+        self.closed = True
+
+class FakeClient:
+    """reply(prompt) の文字列を返す。stream=True なら文字列を chunks 個に分けて delay 秒おきに返す"""
+
+    def __init__(self, reply=lambda prompt: "回答", delay=0.0, chunks=4, error=None):
+        self.reply = reply
+        self.delay = delay
+        self.n_chunks = chunks
+        self.error = error
+        self.calls = []
+        self.streams = []
+        self._lock = threading.Lock()
+        self.chat = self
+        self.completions = self
+
+    def create(self, model, messages, stream=False, timeout=None):
+        prompt = messages[-1]["content"]
+        with self._lock:
+            self.calls.append(prompt)
+        if self.error is not None:
+            raise self.error
+        text = self.reply(prompt)
+        if not stream:
+            time.sleep(self.delay)
+            return _Response(text)
+        size = max(1, -(-len(text) // self.n_chunks))
+        s = FakeStream([None] + [text[i:i + size] for i in range(0, len(text), size)], self.delay)
+        self.streams.append(s)
+        return s
+
+
+DATA = pd.DataFrame([
+    {"Name": "たろう", "Features": ["温泉", "サウナ", "名古屋", "野球観戦"]},
+    {"Name": "はなこ", "Features": ["サウナ", "名古屋", "読書"]},
+    {"Name": "じろう", "Features": ["温泉", "サウナ", "名古屋", "野球観戦", "釣り"]},
+    {"Name": "さぶろう", "Features": ["プログラミング"]},
+])
+
+@pytest.fixture(autouse=True)
+def fresh_answer_cache(tmp_path, monkeypatch):
+    # 辞書JSONの無いディレクトリで動かす（「似ている人」は辞書なしで計算される）
+    monkeypatch.chdir(tmp_path)
+    analyze.ANSWER_CACHE.clear()
+    yield
+    analyze.ANSWER_CACHE.clear()
+
+
+# ---- モード1の並列実行 ----
+
+def test_mode1_streams_run_concurrently():
+    client = FakeClient(reply=lambda prompt: "回答です", delay=0.05)
+    analyze.rank_similar_people("たろう", DATA)   # network_app の読み込みは計測に含めない
+    group = analyze.start_mode1_streams("たろう", client, DATA, timeout=5)
+    started = time.monotonic()
+    final = {key: (text, error) for key, text, done, error in group.updates() if done}
+    elapsed = time.monotonic() - started
+    assert set(final) == {"commons", "similar", "team"}
+    assert all(error is None for _, error in final.values())
+    # 3件 × 5回 × 0.05秒 を直列に待つと0.75秒かかる
+    assert elapsed < 0.6
+
+def test_timeout_counts_from_when_the_job_starts(monkeypatch):
+    # ワーカー1つのプールでは2件目は1件目の終了を待つが、その待ち時間はタイムアウトに含めない
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(analyze, "_executor", pool)
+    def slow(arg, timeout):
+        time.sleep(0.3)
+        yield arg
+    group = analyze.StreamGroup({"a": (slow, ("A",)), "b": (slow, ("B",))}, timeout=0.5)
+    final = {key: (text, error) for key, text, done, error in group.updates() if done}
+    assert final == {"a": ("A", None), "b": ("B", None)}
+    pool.shutdown()
+
+def test_timed_out_job_is_reported_and_stopped():
+    progress = []
+    def endless(timeout):
+        while True:
+            time.sleep(0.02)
+            progress.append(1)
+            yield "x"
+    group = analyze.StreamGroup({"slow": (endless, ())}, timeout=0.2)
+    final = [(key, error) for key, text, done, error in group.updates() if done]
+    assert len(final) == 1 and isinstance(final[0][1], TimeoutError)
+    time.sleep(0.1)
+    stopped_at = len(progress)
+    time.sleep(0.1)
+    assert len(progress) <= stopped_at + 1
+
+def test_abandoned_group_cancels_its_jobs():
+    progress = []
+    def endless(timeout):
+        while True:
+            time.sleep(0.02)
+            progress.append(1)
+            yield "x"
+    group = analyze.StreamGroup({"a": (endless, ())}, timeout=10)
+    updates = group.updates()
+    next(updates)
+    updates.close()   # 画面の再実行などで読むのをやめた
+    time.sleep(0.1)
+    stopped_at = len(progress)
+    time.sleep(0.1)
+    assert len(progress) <= stopped_at + 1
+
+
+# ---- ストリーミング表示 ----
+
+def test_chat_stream_yields_deltas_and_closes():
+    client = FakeClient(reply=lambda prompt: "温泉とサウナが共通点です", chunks=3)
+    deltas = list(analyze._chat_stream(client, "質問"))
+    assert "".join(deltas) == "温泉とサウナが共通点です" and len(deltas) == 3   # 空の断片は飛ばす
+    assert client.streams[0].closed
+
+def test_stream_group_reports_growing_text():
+    client = FakeClient(reply=lambda prompt: "  みんなとの共通点は温泉です  ", delay=0.01, chunks=4)
+    group = analyze.StreamGroup({"search": (analyze.stream_search_by_common, ("温泉", client, DATA))}, timeout=5)
+    updates = list(group.updates())
+    texts = [text for _, text, done, _ in updates if not done]
+    assert all(b.startswith(a) for a, b in zip(texts, texts[1:]))
+    assert updates[-1] == ("search", "みんなとの共通点は温泉です", True, None)
+
+def test_stream_group_reports_errors():
+    client = FakeClient(error=RuntimeError("API error"))
+    group = analyze.StreamGroup({"search": (analyze.stream_search_by_common, ("温泉", client, DATA))}, timeout=5)
+    (key, text, done, error), = list(group.updates())
+    assert done and isinstance(error, RuntimeError)
+
+
+# ---- 回答キャッシュと相乗り ----
+
+def test_answer_cache_hit_ttl_and_lru(monkeypatch):
+    cache = analyze.AnswerCache("test", max_entries=2, ttl_sec=10)
+    for key in ("a", "b", "c"):
+        state, flight = cache.begin(key)
+        assert state == "lead"
+        cache.complete(key, flight, key.upper())
+    assert cache.begin("a")[0] == "lead"          # 最近使われていない a は追い出されている
+    assert cache.begin("c") == ("hit", "C")
+    now = time.monotonic()
+    monkeypatch.setattr(analyze.time, "monotonic", lambda: now + 11)
+    assert cache.begin("c")[0] == "lead"          # 有効期限切れ
+
+def test_concurrent_identical_questions_share_one_request():
+    client = FakeClient(reply=lambda prompt: "温泉好きはたろうとじろう", delay=0.2)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _: analyze.request_search_by_common("温泉", client, DATA), range(4)))
+    assert results == ["温泉好きはたろうとじろう"] * 4
+    assert len(client.calls) == 1
+    assert analyze.request_search_by_common("温泉", client, DATA) == results[0]
+    assert len(client.calls) == 1
+    # 参照データが変われば別の質問として扱う
+    analyze.request_search_by_common("温泉", client, DATA.iloc[:2])
+    assert len(client.calls) == 2
+
+def test_followers_receive_the_streamed_text():
+    client = FakeClient(reply=lambda prompt: "サウナ仲間はたろうとはなこ", delay=0.05, chunks=4)
+    lead = analyze.stream_search_by_common("サウナ", client, DATA)
+    first = next(lead)
+    follower = analyze.stream_search_by_common("サウナ", client, DATA)
+    assert first + "".join(lead) == "".join(follower) == "サウナ仲間はたろうとはなこ"
+    assert len(client.calls) == 1
+
+def test_failed_answer_is_not_cached_and_reaches_followers():
+    release = threading.Event()
+    def failing():
+        yield "途中"
+        release.wait(2)
+        raise RuntimeError("API error")
+    lead = analyze._cached_answer("key", failing)
+    assert next(lead) == "途中"
+    follower = analyze._cached_answer("key", lambda: iter(["使われない"]))
+    assert next(follower) == "途中"
+    release.set()
+    with pytest.raises(RuntimeError):
+        list(lead)
+    with pytest.raises(RuntimeError):
+        list(follower)
+    assert list(analyze._cached_answer("key", lambda: iter(["再取得"]))) == ["再取得"]
+
+def test_abandoned_answer_is_not_cached():
+    lead = analyze._cached_answer("key", lambda: iter(["前半", "後半"]))
+    assert next(lead) == "前半"
+    lead.close()
+    assert list(analyze._cached_answer("key", lambda: iter(["やり直し"]))) == ["やり直し"]
+
+def test_abandoned_answer_is_finished_for_live_follower():
+    lead = analyze._cached_answer("key", lambda: iter(["前半", "後半"]))
+    assert next(lead) == "前半"
+    follower = analyze._cached_answer("key", lambda: pytest.fail("相乗りした側はAPIを呼ばない"))
+    assert next(follower) == "前半"
+    lead.close()
+    assert list(follower) == ["後半"]
+    assert list(analyze._cached_answer("key", lambda: pytest.fail("保存されているはず"))) == ["前半後半"]
+
+def test_follower_that_left_does_not_keep_abandoned_answer_alive():
+    lead = analyze._cached_answer("key", lambda: iter(["前半", "後半"]))
+    next(lead)
+    follower = analyze._cached_answer("key", lambda: iter([]))
+    next(follower)
+    follower.close()
+    lead.close()
+    assert list(analyze._cached_answer("key", lambda: iter(["やり直し"]))) == ["やり直し"]
+
+
+# ---- プロンプト用のメンバー一覧 ----
+
+def _crowd(n):
+    rows = [{"Name": f"メンバー{i}", "Features": [f"趣味{i}", "読書"]} for i in range(n)]
+    rows.append({"Name": "温泉好き", "Features": ["温泉", "サウナ"]})
+    rows.append({"Name": "本人", "Features": ["温泉", "野球観戦"]})
+    return rows
+
+def test_member_context_puts_target_first_and_ranks_by_overlap():
+    lines = analyze.member_context(_crowd(5), name="本人").splitlines()
+    assert lines[0] == "本人: 温泉, 野球観戦"
+    assert lines[1] == "温泉好き: 温泉, サウナ"
+    assert len(lines) == 7 and not lines[-1].startswith("（ほか")
+
+def test_member_context_respects_member_and_token_budget():
+    lines = analyze.member_context(_crowd(200), query="温泉", max_members=10).splitlines()
+    assert lines[0] == "温泉好き: 温泉, サウナ"
+    assert len(lines) == 11 and lines[-1] == "（ほか192人は関連が低いため省略）"
+
+    budget = 50
+    lines = analyze.member_context(_crowd(200), name="本人", token_budget=budget).splitlines()
+    assert sum(analyze.estimate_tokens(line) + 1 for line in lines[:-1]) <= budget
+    assert lines[0].startswith("本人:") and lines[-1].startswith("（ほか")
+
+def test_member_rows_merges_duplicates_and_string_features():
+    rows = analyze.member_rows([{"Name": "a", "Features": "温泉, サウナ,温泉"},
+                                {"Name": "a", "Features": ["読書", "サウナ"]},
+                                {"Name": " ", "Features": ["x"]}])
+    assert rows == [("a", ["温泉", "サウナ", "読書"])]
+
+def test_prompts_embed_the_compact_list_instead_of_the_dataframe():
+    prompt = analyze.prompt_major_commons("たろう", DATA)
+    assert "たろう: 温泉, サウナ, 名古屋, 野球観戦" in prompt
+    assert "Features" not in prompt
+
+
+# ---- 似ている人の順位付け ----
+
+def test_rank_similar_people_orders_by_shared_features():
+    ranking = analyze.rank_similar_people("たろう", DATA)
+    assert [(name, sorted(shared)) for name, _, shared in ranking] == [
+        ("じろう", sorted(["名古屋", "温泉", "野球観戦", "サウナ"])), ("はなこ", sorted(["名古屋", "サウナ"]))]
+    assert ranking[0][1] > ranking[1][1]
+    assert analyze.rank_similar_people("さぶろう", DATA) == []
+
+def test_similar_person_prompt_carries_the_local_ranking():
+    client = FakeClient(reply=lambda prompt: "紹介文")
+    assert analyze.request_similar_person("たろう", client, DATA) == "紹介文"
+    prompt = client.calls[0]
+    assert "1位 じろう:" in prompt and "2位 はなこ:" in prompt and "さぶろう" not in prompt
+
+def test_similar_person_without_llm(monkeypatch):
+    client = FakeClient()
+    monkeypatch.setattr(analyze, "SIMILAR_USE_LLM", False)
+    text = analyze.request_similar_person("たろう", client, DATA)
+    assert "**1位 じろう**" in text and not client.calls
+    assert "見つかりませんでした" in "".join(analyze.stream_similar_person("さぶろう", client, DATA))
+
+def test_similar_person_falls_back_to_ranking_on_llm_error():
+    client = FakeClient(error=RuntimeError("API error"))
+    assert "**1位 じろう**" in analyze.request_similar_person("たろう", client, DATA)
+    assert "**1位 じろう**" in "".join(analyze.stream_similar_person("たろう", client, DATA))
@@ -0,0 +1,348 @@
+import json
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_extraction as de
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    # キャッシュ・出力ファイルは tmp_path に作り、設定はテストごとに既定値へ戻す
+    monkeypatch.chdir(tmp_path)
+    de.configure_concurrency()
+    yield
+    de.configure_cache(enabled=False)
+    de.configure_concurrency()
+    de._page_reuse['reuse_after'] = None
+
+
+# ---- 並列実行 ----
+
+def _jobs(n):
+    return [(position, f"m{position}", (position, {'Name': f"m{position}"})) for position in range(n)]
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_iter_member_results_returns_every_member(monkeypatch, workers):
+    def fake_process_member(index, row):
+        time.sleep(0.001 * (index % 3))
+        return {'Name': row['Name']}
+    monkeypatch.setattr(de, "process_member", fake_process_member)
+    results = sorted(de.iter_member_results(_jobs(20), workers=workers))
+    assert [(p, k, r['Name']) for p, k, r in results] == [(p, f"m{p}", f"m{p}") for p in range(20)]
+
+def test_iter_member_results_bounds_in_flight_jobs(monkeypatch):
+    lock = threading.Lock()
+    state = {'running': 0, 'peak': 0}
+    def fake_process_member(index, row):
+        with lock:
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+        time.sleep(0.005)
+        with lock:
+            state['running'] -= 1
+        return {}
+    monkeypatch.setattr(de, "process_member", fake_process_member)
+    assert len(list(de.iter_member_results(_jobs(30), workers=3))) == 30
+    assert state['peak'] <= 3
+
+def test_host_semaphore_is_per_host():
+    de.configure_concurrency(per_host_limit=2)
+    a = de._host_semaphore("https://example.com/a")
+    assert a is de._host_semaphore("https://EXAMPLE.com/b")
+    assert a is not de._host_semaphore("https://example.org/")
+    assert a.acquire(blocking=False) and a.acquire(blocking=False)
+    assert not a.acquire(blocking=False)
+
+
+# ---- GPT応答のキャッシュ ----
+
+def test_run_gpt_to_keywords_uses_cache(monkeypatch):
+    calls = []
+    monkeypatch.setattr(de, "_chat", lambda request, **kwargs: calls.append(request) or "温泉,サウナ")
+    de.configure_cache(enabled=True)
+    assert de.run_gpt_to_keywords("自己紹介", de.script_for_introduction) == "温泉,サウナ"
+    assert de.run_gpt_to_keywords("自己紹介", de.script_for_introduction) == "温泉,サウナ"
+    assert len(calls) == 1
+    # 除外キーワードが変われば別の応答として取り直す
+    de.run_gpt_to_keywords("自己紹介", de.script_for_introduction, exclude_keywords=["温泉"])
+    assert len(calls) == 2
+
+
+# ---- 差分更新 ----
+
+def _fake_llm(monkeypatch, fetched="LPの本文"):
+    calls = []
+    monkeypatch.setattr(de, "_chat", lambda request, **kwargs: calls.append(request) or "温泉,サウナ")
+    monkeypatch.setattr(de, "fetch_lp_text", lambda url: fetched)
+    return calls
+
+def test_process_member_reuses_previous_keywords(monkeypatch):
+    calls = _fake_llm(monkeypatch)
+    row = {'Name': 'a/たろう/b', 'Introduction': '温泉が好き', 'URL': 'https://example.com/'}
+    first = de.process_member(0, row)
+    assert first['Name'] == 'たろう' and len(calls) == 2
+    second = de.process_member(0, row, previous=first)
+    assert len(calls) == 2
+    assert second['Features'] == first['Features']
+    assert de.same_fingerprint(second, first)
+
+def test_process_member_reextracts_changed_lp_only(monkeypatch):
+    calls = _fake_llm(monkeypatch)
+    row = {'Name': 'たろう', 'Introduction': '温泉が好き', 'URL': 'https://example.com/'}
+    first = de.process_member(0, row)
+    monkeypatch.setattr(de, "fetch_lp_text", lambda url: "新しいLPの本文")
+    second = de.process_member(0, row, previous=first)
+    assert len(calls) == 3 and calls[-1].startswith(de.script_for_LP)
+    assert second['intro_keywords'] == first['intro_keywords']
+    assert not de.same_fingerprint(second, first)
+
+def test_manifest_keeps_only_fingerprints_and_keywords(tmp_path):
+    record = {'position': 0, 'key': 'たろう', 'Name': 'たろう', 'Features': '温泉', 'LP_text': '長い本文' * 100,
+              'url': 'https://example.com/', 'intro_hash': 'i', 'intro_keywords': ['温泉'],
+              'lp_hash': 'l', 'lp_keywords': []}
+    path = str(tmp_path / "manifest.json")
+    de.save_manifest({'たろう': record}, path)
+    loaded = de.load_manifest(path)
+    assert set(loaded['たろう']) == set(de.MANIFEST_FIELDS)
+    assert de.same_fingerprint(record, loaded['たろう'])
+
+def test_load_manifest_ignores_other_versions(tmp_path):
+    path = tmp_path / "manifest.json"
+    path.write_text('{"version": -1, "members": {"a": {}}}', encoding="utf-8")
+    assert de.load_manifest(str(path)) == {}
+
+def _run_main(monkeypatch, *argv):
+    _roster().to_csv("DB.csv", index=False)
+    monkeypatch.setattr(de, "process_member", lambda index, row, previous=None: {
+        'Name': row['Name'], 'Features': '温泉', 'LP_text': '', 'url': de.url_of(row),
+        'intro_hash': de.intro_hash_of(row), 'intro_keywords': ['温泉'], 'lp_hash': '', 'lp_keywords': []})
+    de.main(["--no-cache", "--no-onehot-csv", *argv])
+
+def test_main_writes_manifest_only_when_asked(monkeypatch, tmp_path):
+    _run_main(monkeypatch)
+    assert not (tmp_path / de.MANIFEST_FILE).exists()
+    _run_main(monkeypatch, "--save-manifest")
+    assert set(de.load_manifest()) == {'a', 'b', 'c'}
+    (tmp_path / de.MANIFEST_FILE).unlink()
+    _run_main(monkeypatch, "--incremental")
+    assert set(de.load_manifest()) == {'a', 'b', 'c'}
+
+def test_member_keys_number_duplicate_names():
+    df = pd.DataFrame({'Name': ['a', 'b', 'a', None]})
+    assert de.member_keys(df) == ['a', 'b', 'a#2', '']
+
+
+# ---- 条件付きGET ----
+
+class FakeResponse:
+    def __init__(self, status_code, body=b"", headers=None, url=""):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.url = url
+        self._body = body
+
+    def iter_content(self, chunk_size=1):
+        for i in range(0, len(self._body), chunk_size):
+            yield self._body[i:i + chunk_size]
+
+    def close(self):
+        pass
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, timeout=None, headers=None, stream=False):
+        self.requests.append((url, dict(headers or {})))
+        return self.responses.pop(0)
+
+def test_fetch_lp_text_sends_conditional_get(monkeypatch):
+    html = "<html><body><p>温泉とサウナが好きです</p></body></html>".encode("utf-8")
+    session = FakeSession([FakeResponse(200, html, {'ETag': '"v1"'}), FakeResponse(304)])
+    monkeypatch.setattr(de, "_get_http_session", lambda: session)
+    de.configure_cache(enabled=True)
+    first = de.fetch_lp_text("https://example.com/")
+    assert "温泉とサウナが好きです" in first
+    assert de.fetch_lp_text("https://example.com/") == first
+    assert session.requests[0][1] == {}
+    assert session.requests[1][1] == {'If-None-Match': '"v1"'}
+    assert (de.page_store.fetched, de.page_store.not_modified) == (1, 1)
+
+def test_fetch_lp_text_caps_download_size(monkeypatch):
+    body = ("<p>" + "あ" * 1000 + "</p>").encode("utf-8")
+    session = FakeSession([FakeResponse(200, body)])
+    monkeypatch.setattr(de, "_get_http_session", lambda: session)
+    de.configure_concurrency(lp_max_bytes=300)
+    assert len(de.fetch_lp_text("https://example.com/")) < 110
+
+
+# ---- 自己紹介文のまとめ抽出 ----
+
+def _fake_batch_chat(monkeypatch, drop=()):
+    calls = []
+    def fake_chat(request, **kwargs):
+        if kwargs.get('response_format'):
+            ids = [line[4:] for line in request.splitlines() if line.startswith("### ")]
+            calls.append(('batch', ids))
+            return json.dumps({i: f"kw{i}" for i in ids if i not in drop})
+        calls.append(('single', request))
+        return "single"
+    monkeypatch.setattr(de, "_chat", fake_chat)
+    return calls
+
+def test_batched_intro_packs_members_into_one_request(monkeypatch):
+    calls = _fake_batch_chat(monkeypatch)
+    items = [(str(i), f"自己紹介{i}") for i in range(5)]
+    assert de.run_gpt_to_keywords_batched(items) == {str(i): f"kw{i}" for i in range(5)}
+    assert calls == [('batch', [str(i) for i in range(5)])]
+
+def test_batched_intro_retries_missing_members(monkeypatch):
+    calls = _fake_batch_chat(monkeypatch, drop={"2"})
+    results = de.run_gpt_to_keywords_batched([(str(i), f"自己紹介{i}") for i in range(4)])
+    assert results["2"] == "single" and results["0"] == "kw0"
+    assert [kind for kind, _ in calls] == ['batch', 'single']
+
+def test_batched_intro_results_do_not_leak_into_single_cache(monkeypatch):
+    calls = _fake_batch_chat(monkeypatch)
+    de.configure_cache(enabled=True)
+    items = [("0", "自己紹介0"), ("1", "自己紹介1")]
+    de.run_gpt_to_keywords_batched(items)
+    assert de.run_gpt_to_keywords_batched(items) == {"0": "kw0", "1": "kw1"}
+    assert len(calls) == 1
+    # 単発抽出は別プロンプトなので、まとめ抽出の結果は使わない
+    assert de.run_gpt_to_keywords("自己紹介0", de.script_for_introduction) == "single"
+    # 単発抽出の結果があれば、まとめ抽出でもそれを使う
+    assert de.run_gpt_to_keywords_batched(items)["0"] == "single"
+
+
+# ---- 追記ファイル ----
+
+def test_record_sink_appends_and_load_records_restores_row_order(tmp_path):
+    path = str(tmp_path / "records.jsonl")
+    sink = de.RecordSink(path)
+    sink.write({'run_started': 1.0})
+    for position in (2, 0, 1):
+        sink.write({'position': position, 'key': f"m{position}", 'Name': f"名前{position}"})
+    sink.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"position": 3, "key": "書き込み途中')
+    assert [r['position'] for r in de.load_records(path)] == [0, 1, 2]
+
+
+# ---- 中断からの再開 ----
+
+def _roster():
+    return pd.DataFrame({'Name': ['a', 'b', 'c'], 'Introduction': ['x', 'y', 'z'],
+                         'URL': ['https://a.example/', 'https://b.example/', 'https://c.example/']})
+
+def test_prepare_resume_keeps_only_unchanged_rows(tmp_path):
+    path = str(tmp_path / "records.jsonl")
+    df = _roster()
+    sink = de.RecordSink(path)
+    sink.write({'run_started': 123.0})
+    for position, (_, row) in enumerate(df.iterrows()):
+        sink.write({'position': position, 'key': row['Name'], 'Name': row['Name'],
+                    'intro_hash': de.intro_hash_of(row), 'url': de.url_of(row)})
+    sink.close()
+    df.loc[1, 'Introduction'] = 'changed'
+    df = pd.concat([df.iloc[[2]], df.iloc[[0, 1]]], ignore_index=True)   # 行の並べ替え
+
+    done, run_started = de.prepare_resume(de.member_keys(df), df, path)
+    assert done == {'a', 'c'} and run_started == 123.0
+    assert [(r['key'], r['position']) for r in de.load_records(path)] == [('c', 0), ('a', 1)]
+    # 書き直した後も開始時刻は残る（再開した実行がまた止まった場合用）
+    assert de.prepare_resume(de.member_keys(df), df, path)[1] == 123.0
+
+def test_resume_reuses_pages_fetched_by_interrupted_run(monkeypatch):
+    de.configure_cache(enabled=True)
+    signature = de.extractor_signature(**de._extract_options)
+    de.page_store.put("https://a.example/", None, None, "<p>a</p>", "保存済み", 8, extractor=signature)
+    session = FakeSession([FakeResponse(304)])
+    monkeypatch.setattr(de, "_get_http_session", lambda: session)
+
+    de._page_reuse['reuse_after'] = time.time() + 60   # 中断した実行より前に取ったページは取り直す
+    assert de.fetch_lp_text("https://a.example/") == "保存済み"
+    assert len(session.requests) == 1
+
+    de._page_reuse['reuse_after'] = time.time() - 60
+    assert de.fetch_lp_text("https://a.example/") == "保存済み"
+    assert len(session.requests) == 1 and de.page_store.reused == 1
+
+
+def test_configure_page_reuse_takes_the_earlier_of_resume_and_freshness():
+    de.configure_page_reuse()
+    assert de._page_reuse['reuse_after'] is None
+    de.configure_page_reuse(fresh_hours=2, now=10000.0)
+    assert de._page_reuse['reuse_after'] == 10000.0 - 7200
+    de.configure_page_reuse(run_started=5000.0, fresh_hours=2, now=10000.0)
+    assert de._page_reuse['reuse_after'] == 2800.0
+    de.configure_page_reuse(run_started=5000.0, fresh_hours=1, now=10000.0)
+    assert de._page_reuse['reuse_after'] == 5000.0
+
+
+# ---- 出力ステージ ----
+
+def _records():
+    return [{'Name': 'たろう', 'Features': '温泉,サウナ,野球', 'LP_text': ''},
+            {'Name': 'はなこ', 'Features': '野球,読書', 'LP_text': 'LP'},
+            {'Name': 'じろう', 'Features': '', 'LP_text': ''}]
+
+def test_write_outputs_onehot_csr_round_trip():
+    records = _records()
+    de.write_outputs(records)
+    npz = np.load(de.ONEHOT_NPZ)
+    with open(de.ONEHOT_VOCAB_JSON, encoding="utf-8") as f:
+        vocab = json.load(f)
+    assert bytes(npz['format']) == b"csr"
+    dense = np.zeros(tuple(npz['shape']), dtype=np.uint8)
+    for row in range(dense.shape[0]):
+        dense[row, npz['indices'][npz['indptr'][row]:npz['indptr'][row + 1]]] = 1
+
+    # 従来の get_dummies によるワンホットと一致する
+    expected = pd.Series([r['Features'] for r in records]).str.get_dummies(sep=",")
+    assert vocab == {'rows': [r['Name'] for r in records], 'columns': list(expected.columns)}
+    assert (dense == expected.to_numpy()).all()
+    onehot_csv = pd.read_csv("onehot.csv", encoding="utf-8-sig", index_col="Name")
+    assert (onehot_csv.to_numpy() == expected.to_numpy()).all()
+
+def test_write_outputs_json_and_wide_csv():
+    de.write_outputs(_records(), dense_onehot=False)
+    with open("out.json", encoding="utf-8") as f:
+        assert json.load(f)[1] == {'Name': 'はなこ', 'Features': ['野球', '読書']}
+    wide = pd.read_csv("out_splited_wide.csv", encoding="utf-8-sig", keep_default_na=False)
+    assert list(wide.columns) == ['Name', 'Feature_1', 'Feature_2', 'Feature_3']
+    assert list(wide.iloc[1]) == ['はなこ', '野球', '読書', '']
+
+
+# ---- 長いLPの分割抽出 ----
+
+class ByteEncoding:
+    """1バイト=1トークンのエンコーディング（トークン境界が必ず文字の途中に来るようにする）"""
+
+    def encode(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode_bytes(self, tokens):
+        return bytes(tokens)
+
+@pytest.mark.parametrize("chunk_tokens", [1, 2, 4, 5, 7])
+def test_split_by_tokens_keeps_multibyte_characters(monkeypatch, chunk_tokens):
+    monkeypatch.setattr(de, "tiktoken", object())
+    monkeypatch.setattr(de, "_encoding", ByteEncoding())
+    text = "温泉とサウナabc野球観戦" * 3
+    chunks = de.split_by_tokens(text, chunk_tokens)
+    assert "".join(chunks) == text
+    assert all("�" not in c for c in chunks)
+
+def test_lp_chunks_are_merged_in_order_without_duplicates(monkeypatch):
+    replies = {"A" * 10: "温泉,サウナ", "B" * 10: "サウナ,野球,読書", "C" * 10: "映画"}
+    monkeypatch.setattr(de, "_chat", lambda request, **kwargs: replies[request.rsplit("\n", 1)[-1]])
+    monkeypatch.setattr(de, "tiktoken", None)
+    de.configure_concurrency(lp_chunk_tokens=10, lp_max_chunks=2)
+    merged = de.run_gpt_to_lp_keywords("A" * 10 + "B" * 10 + "C" * 10, exclude_keywords=["野球"])
+    assert merged == "温泉,サウナ,読書"
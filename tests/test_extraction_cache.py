@@ -0,0 +1,62 @@
+import time
+
+from extraction_cache import KeywordCache, PageStore, content_key
+
+
+# ---- KeywordCache ----
+
+def test_content_key_depends_on_every_part():
+    base = content_key("gpt-4o-mini", "script", [], "text")
+    assert base == content_key("gpt-4o-mini", "script", [], "text")
+    assert base != content_key("gpt-4o-mini", "script", ["温泉"], "text")
+    assert base != content_key("gpt-4o-mini", "script2", [], "text")
+
+def test_keyword_cache_round_trip_and_stats(tmp_path):
+    cache = KeywordCache(tmp_path / "kw.sqlite")
+    assert cache.get("k") is None
+    cache.put("k", "温泉,サウナ")
+    assert cache.get("k") == "温泉,サウナ"
+    assert (cache.hits, cache.misses, cache.stores) == (1, 1, 1)
+    cache.close()
+    reopened = KeywordCache(tmp_path / "kw.sqlite")
+    assert reopened.get("k") == "温泉,サウナ"
+    reopened.close()
+
+def test_keyword_cache_expires_old_entries(tmp_path):
+    cache = KeywordCache(tmp_path / "kw.sqlite", max_age_days=0)
+    cache.put("k", "v")
+    time.sleep(0.01)
+    assert cache.get("k") is None
+    cache.evict()
+    assert cache.evicted == 1
+    cache.close()
+
+def test_keyword_cache_evicts_least_recently_used_over_size(tmp_path):
+    cache = KeywordCache(tmp_path / "kw.sqlite", max_mb=25 / (1024 * 1024))
+    for key in ("a", "b", "c"):
+        cache.put(key, "x" * 10)
+        time.sleep(0.01)
+    assert cache.get("a") == "x" * 10   # a を最近使ったことにする
+    cache.evict()
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    cache.close()
+
+
+# ---- PageStore ----
+
+def test_page_store_round_trip(tmp_path):
+    store = PageStore(tmp_path / "pages.sqlite")
+    assert store.get("https://example.com/") is None
+    store.put("https://example.com/", '"v1"', "Mon, 01 Jan 2024 00:00:00 GMT", "<p>本文</p>", "本文", 20,
+              extractor="sig")
+    entry = store.get("https://example.com/")
+    assert (entry['text'], entry['size'], entry['extractor']) == ("本文", 20, "sig")
+    assert store.get_html("https://example.com/") == "<p>本文</p>"
+    assert PageStore.conditional_headers(entry) == {
+        'If-None-Match': '"v1"', 'If-Modified-Since': "Mon, 01 Jan 2024 00:00:00 GMT"}
+    assert PageStore.conditional_headers(None) == {}
+    store.update_text("https://example.com/", "本文2", "sig2")
+    assert store.get("https://example.com/")['extractor'] == "sig2"
+    assert store.urls() == ["https://example.com/"]
+    store.close()
@@ -0,0 +1,52 @@
+import pytest
+
+import html_extract
+from html_extract import html_to_text, html_to_text_legacy, extractor_signature, resolve_engine
+
+SAMPLE_HTML = """<!DOCTYPE html>
+<html><head><title>タイトル</title><style>p { color: red; }</style></head>
+<body>
+  <nav>メニュー</nav>
+  <h1>自己紹介</h1>
+  <p>温泉と<b>サウナ</b>が好きです。<!-- コメント --></p>
+  <div hidden>隠し要素</div>
+  <div aria-hidden="true">読み上げ対象外</div>
+  <p style="display:none">非表示</p>
+  <script>var x = "スクリプト";</script>
+  <ul><li>野球観戦</li><li>読書</li></ul>
+  <footer>メニュー</footer>
+</body></html>
+"""
+
+ENGINES = ["bs4"] + (["lxml"] if html_extract.lxml is not None else [])
+
+
+# ---- 従来の抽出との互換 ----
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_matches_legacy_without_dedupe_or_cap(engine):
+    assert html_to_text(SAMPLE_HTML, engine=engine, max_chars=0, dedupe=False) == html_to_text_legacy(SAMPLE_HTML)
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_dedupe_drops_repeated_strings(engine):
+    text = html_to_text(SAMPLE_HTML, engine=engine, max_chars=0)
+    assert text.count("メニュー") == 1
+    assert "温泉と" in text and "隠し要素" not in text and "スクリプト" not in text
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_max_chars_caps_output(engine):
+    assert len(html_to_text("<p>" + "あ" * 50 + "</p><p>い</p>", engine=engine, max_chars=10)) == 10
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_hidden_style_with_spaces(engine):
+    # 従来の抽出は "display: none" のように空白があると非表示と判定できなかった
+    html = '<p style="Display: None">非表示</p><p>表示</p>'
+    assert html_to_text(html, engine=engine) == "表示"
+
+def test_empty_html():
+    assert html_to_text("") == "" and html_to_text("   ") == ""
+
+def test_signature_tracks_settings():
+    assert extractor_signature("bs4", 100, True) == "bs4:100:1"
+    assert extractor_signature("bs4", 100, True) != extractor_signature("bs4", 100, False)
+    assert resolve_engine("auto") == ("lxml" if html_extract.lxml is not None else "bs4")
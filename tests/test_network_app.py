@@ -0,0 +1,462 @@
+import itertools
+import json
+import os
+import random
+import re
+
+import networkx as nx
+import pytest
+from pyvis.network import Network
+
+import network_app
+from network_app import (normalize_key, canonicalize_token, geo_canonicalize, geo_expand_tokens,
+                         pair_score_and_common, pretty_token)
+
+
+# ---- テスト用の辞書とメンバー ----
+
+CITIES = [("名古屋", "愛知県"), ("豊橋", "愛知県"), ("堺", "大阪府"), ("神戸", "兵庫県"), ("札幌", "北海道")]
+REGIONS = {"愛知県": "東海", "静岡県": "東海", "大阪府": "関西", "兵庫県": "関西", "北海道": "北海道"}
+HOBBIES = [f"趣味{i}" for i in range(80)]
+
+def _write_json(path, obj):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+
+def write_dict_files(directory):
+    rnd = random.Random(3)
+    _write_json(os.path.join(directory, network_app.CITY_TO_PREF_JSON), [{"city": c, "pref": p} for c, p in CITIES])
+    _write_json(os.path.join(directory, network_app.PREF_ALIASES_JSON), {"愛知": "愛知県", "大阪": "大阪府"})
+    _write_json(os.path.join(directory, network_app.PREF_TO_REGION_JSON),
+                [{"pref": p, "region": r} for p, r in REGIONS.items()])
+    _write_json(os.path.join(directory, network_app.TOKEN_CATEGORY_JSON), [
+        {"token": h, "category": rnd.choice(["hobby", "role", "industry", "other"]),
+         "subcategory1": rnd.choice(["sports", "music", "food", "other"]),
+         "subcategory2": rnd.choice(["running", "jazz", "other"])} for h in HOBBIES[:60]])
+    _write_json(os.path.join(directory, network_app.CANONICAL_MAP_JSON), {"onsen": "温泉", "ＳＡＵＮＡ": "サウナ"})
+    _write_json(os.path.join(directory, network_app.STOPWORDS_JSON), ["旅行", "趣味79"])
+    _write_json(os.path.join(directory, network_app.SUBCAT_WEIGHTS_JSON), [
+        {"category": "hobby", "subcategory1": "sports", "subcategory2": "running", "weight": 1.4},
+        {"category": "hobby", "subcategory1": "music", "weight": 0.7},
+        {"category": "role", "weight": 1.3}])
+
+def make_records(n, seed=7):
+    rnd = random.Random(seed)
+    extras = ["名古屋", "豊橋", "堺", "愛知", "大阪", "関西", "東海", "北海道", "onsen", "温泉", "ＳＡＵＮＡ", "旅行", " 趣味 2 "]
+    records = []
+    for i in range(n):
+        feats = rnd.sample(HOBBIES, rnd.randint(2, 10)) + rnd.sample(extras, rnd.randint(0, 4))
+        records.append({"Name": f"メンバー{i}", "Features": feats if i % 3 else ",".join(feats)})
+    return records
+
+@pytest.fixture(scope="module")
+def bundle(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("dicts")
+    write_dict_files(str(directory))
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        return network_app.compile_dict_bundle(path=None)
+    finally:
+        os.chdir(cwd)
+
+@pytest.fixture(scope="module")
+def records():
+    return make_records(120)
+
+@pytest.fixture(autouse=True)
+def clear_result_caches():
+    for cache in (network_app.PARSE_CACHE, network_app.PAIR_TABLE_CACHE, network_app.PYVIS_HTML_CACHE,
+                  network_app.LAYOUT_CACHE):
+        cache.clear()
+
+def dict_args(b):
+    """build_graph の token_category 以降の辞書引数"""
+    return (b["TOKEN_CATEGORY"], b["SUBCAT_WEIGHTS"], b["CANONICAL_MAP"], b["STOPWORDS"],
+            b["CITY_TO_PREF"], b["PREF_ALIASES"], b["PREF_TO_REGION"], b["REGION_SET"])
+
+def reference_features(raw, b, sub1=True, sub2=True):
+    """従来の parse_features（トークンごとに正規化・地理展開する実装）"""
+    if raw is None: return set()
+    items = raw if isinstance(raw, list) else str(raw).split(",")
+    toks = set()
+    for x in items:
+        if not str(x).strip(): continue
+        canon = canonicalize_token(normalize_key(x), b["CANONICAL_MAP"])
+        if not canon or normalize_key(canon) in b["STOPWORDS"]: continue
+        geo = (b["CITY_TO_PREF"], b["PREF_ALIASES"], b["PREF_TO_REGION"], b["REGION_SET"])
+        if any(geo_canonicalize(normalize_key(canon), *geo)):
+            toks |= geo_expand_tokens(normalize_key(canon), *geo)
+            continue
+        tok = normalize_key(canon)
+        toks.add(tok)
+        _, s1, s2 = b["TOKEN_CATEGORY"].get(tok, ("other", "other", "other"))
+        if sub1 and s1 and s1 != "other": toks.add(f"link:sub1:{s1}")
+        if sub2 and s2 and s2 != "other": toks.add(f"link:sub2:{s2}")
+    return toks
+
+def reference_edges(records, b, min_edge_score, w1=0.6, w2=0.6):
+    """従来の build_graph と同じ全ペア比較で (A, B, 属性) を追加順に返す"""
+    people = [(r["Name"], reference_features(r["Features"], b)) for r in records]
+    edges = []
+    for (n1, f1), (n2, f2) in itertools.combinations(people, 2):
+        score, common = pair_score_and_common(f1, f2, b["TOKEN_CATEGORY"], b["SUBCAT_WEIGHTS"], w1, w2)
+        if common and score >= min_edge_score:
+            edges.append((n1, n2, {"weight": score, "common_features": "、".join(pretty_token(t) for t in common),
+                                   "common_count": len(common)}))
+    return edges
+
+
+# ---- スコア計算エンジン ----
+
+def graph_edges(G):
+    return [(u, v, dict(d)) for u, v, d in G.edges(data=True)]
+
+def edge_map(G):
+    """追加順を無視した比較用（ペアスコア表からのグラフはスコアの降順に追加される）"""
+    return {frozenset((u, v)): dict(d) for u, v, d in G.edges(data=True)}
+
+def test_python_engine_matches_reference(bundle, records):
+    G = network_app.build_graph(records, 3.0, *dict_args(bundle), engine="python")
+    assert graph_edges(G) == reference_edges(records, bundle, 3.0)
+    assert list(G.nodes) == [r["Name"] for r in records]
+
+@pytest.mark.skipif(network_app.sp is None, reason="scipy が無い")
+@pytest.mark.parametrize("min_edge_score", [float("-inf"), 0.0, 2.6, 5.0, 100.0])
+def test_sparse_engine_matches_python(bundle, records, min_edge_score):
+    python = network_app.build_graph(records, min_edge_score, *dict_args(bundle), engine="python")
+    sparse = network_app.build_graph(records, min_edge_score, *dict_args(bundle), engine="sparse")
+    assert graph_edges(sparse) == graph_edges(python)
+
+def test_sparse_engine_falls_back_without_scipy(monkeypatch, bundle, records):
+    expected = graph_edges(network_app.build_graph(records, 3.0, *dict_args(bundle), engine="python"))
+    monkeypatch.setattr(network_app, "sp", None)
+    assert graph_edges(network_app.build_graph(records, 3.0, *dict_args(bundle), engine="sparse")) == expected
+
+
+# ---- 転置インデックスによる候補生成 ----
+
+@pytest.mark.parametrize("heavy_min_df", [network_app.HEAVY_TOKEN_MIN_DF, 2])
+@pytest.mark.parametrize("min_edge_score", [float("-inf"), 0.0, 2.6, 5.0, 9.0])
+def test_index_engine_matches_python(monkeypatch, bundle, records, heavy_min_df, min_edge_score):
+    # heavy_min_df=2 ではほとんどのトークンが高頻度扱いになり、上限値による枝刈りの経路を通る
+    monkeypatch.setattr(network_app, "HEAVY_TOKEN_MIN_DF", heavy_min_df)
+    python = network_app.build_graph(records, min_edge_score, *dict_args(bundle), engine="python")
+    index = network_app.build_graph(records, min_edge_score, *dict_args(bundle), engine="index")
+    assert graph_edges(index) == graph_edges(python)
+
+def test_index_engine_does_not_enumerate_a_shared_prefecture():
+    # 全員が同じ県（高頻度トークン）を持ち、低頻度の趣味を共有するのは一部のペアだけ
+    people = [(f"m{i}", {"geo:pref:愛知県", "geo:region:東海", f"趣味{i // 2}"}) for i in range(400)]
+    members = network_app.MemberFeatures.from_people(people)
+    w = [network_app.token_weight(t, {}, {}, 0.6, 0.6) for t in members.vocab]
+    heavy_only = w[members.vocab.index("geo:pref:愛知県")] + w[members.vocab.index("geo:region:東海")]
+
+    candidates = list(network_app._candidate_pairs_index(members, w, heavy_only + 0.5))
+    assert candidates == [(i, i + 1) for i in range(0, 400, 2)]
+    # しきい値が県・地方の重みだけで届く場合は、全ペアが（1回ずつ）エッジになる
+    candidates = list(network_app._candidate_pairs_index(members, w, heavy_only))
+    assert len(candidates) == len(set(candidates)) == 400 * 399 // 2
+
+def test_index_engine_groups_partially_shared_heavy_tokens(monkeypatch):
+    monkeypatch.setattr(network_app, "HEAVY_TOKEN_MIN_DF", 2)
+    people = [("a", {"x", "y"}), ("b", {"x", "y"}), ("c", {"x", "z"}), ("d", {"y", "z"}), ("e", {"x", "y", "z"})]
+    members = network_app.MemberFeatures.from_people(people)
+    for t in (0.5, 1.0, 1.5, 2.0, 2.5):
+        assert (network_app.score_member_pairs(members, t, {}, {}, 0.6, 0.6, engine="index")
+                == network_app.score_member_pairs(members, t, {}, {}, 0.6, 0.6, engine="python"))
+
+def test_index_engine_with_negative_weights():
+    members = network_app.MemberFeatures.from_people([("a", {"x", "y"}), ("b", {"x", "y"}), ("c", {"x"})])
+    category = {"x": ("hobby", "s", "s"), "y": ("hobby", "neg", "neg")}
+    weights = {("hobby", "neg", "neg"): -0.5}
+    args = (category, weights, 0.6, 0.6)
+    assert (network_app.score_member_pairs(members, 0.5, *args, engine="index")
+            == network_app.score_member_pairs(members, 0.5, *args, engine="python"))
+
+
+# ---- 特徴解析のキャッシュ ----
+
+def parse_args(b):
+    return (b["CANONICAL_MAP"], b["STOPWORDS"], b["CITY_TO_PREF"], b["PREF_ALIASES"], b["PREF_TO_REGION"],
+            b["REGION_SET"], b["TOKEN_CATEGORY"])
+
+def test_parse_people_reuses_cached_members(bundle, records):
+    first = network_app.parse_people(records, *parse_args(bundle), True, True, cache_key="fp")
+    assert network_app.parse_people(records, *parse_args(bundle), True, True, cache_key="fp") is first
+    assert network_app.parse_people(records, *parse_args(bundle), False, True, cache_key="fp") is not first
+    assert network_app.parse_people(records, *parse_args(bundle), True, True, cache_key="fp2") is not first
+
+def test_cached_build_graph_matches_uncached(bundle, records):
+    expected = edge_map(network_app.build_graph(records, 4.0, *dict_args(bundle)))
+    for _ in range(2):
+        cached = network_app.build_graph(records, 4.0, *dict_args(bundle), parse_cache_key="fp")
+        assert edge_map(cached) == expected
+    assert network_app.PARSE_CACHE.hits + network_app.PAIR_TABLE_CACHE.hits >= 1
+
+def test_source_fingerprint_tracks_file_changes(tmp_path):
+    path = tmp_path / "out_network.json"
+    missing = network_app.source_fingerprint([str(path)])
+    path.write_text("[]", encoding="utf-8")
+    created = network_app.source_fingerprint([str(path)])
+    assert created != missing
+    path.write_text("[{}]", encoding="utf-8")
+    assert network_app.source_fingerprint([str(path)]) != created
+
+
+# ---- ペアスコア表 ----
+
+@pytest.fixture(scope="module")
+def members(bundle, records):
+    return network_app.parse_people(records, *parse_args(bundle), True, True)
+
+def full_table(members, bundle, floor=float("-inf")):
+    return network_app.build_pair_table(members, bundle["TOKEN_CATEGORY"], bundle["SUBCAT_WEIGHTS"], 0.6, 0.6,
+                                        engine="python", floor=floor)
+
+def all_pairs(members, bundle):
+    return network_app.score_member_pairs(members, float("-inf"), bundle["TOKEN_CATEGORY"], bundle["SUBCAT_WEIGHTS"],
+                                          0.6, 0.6, engine="python")
+
+@pytest.mark.parametrize("min_edge_score", [float("-inf"), 2.6, 5.0, 7.2, 100.0])
+def test_select_matches_filter_in_score_order(members, bundle, min_edge_score):
+    table = full_table(members, bundle)
+    expected = [(i, j, score, ids) for i, j, score, ids in all_pairs(members, bundle) if score >= min_edge_score]
+    expected.sort(key=lambda p: -p[2])   # 安定ソートなので同点は i<j の辞書順
+    selected = table.select(min_edge_score)
+    assert [p[:4] for p in selected] == expected
+    assert table.count(min_edge_score) == len(expected)
+    assert all(p[4] == "、".join(pretty_token(t) for t in members.decode(p[3])) for p in selected)
+    assert table.select(min_edge_score) is selected
+
+@pytest.mark.parametrize("max_edges", [0, 1, 10, 250, 3000, 10 ** 6])
+def test_threshold_for_budget_is_the_smallest_within_budget(members, bundle, max_edges):
+    table = full_table(members, bundle)
+    threshold = table.threshold_for_budget(max_edges)
+    assert table.count(threshold) <= max_edges
+    lower = [s for s in set(p[2] for p in all_pairs(members, bundle)) if s < threshold]
+    if lower:
+        assert table.count(max(lower)) > max_edges
+
+def test_threshold_for_budget_on_empty_table(members):
+    assert network_app.PairScoreTable(members, []).threshold_for_budget(10) == 0.0
+
+def test_floor_table_matches_full_table_above_floor(members, bundle):
+    full = full_table(members, bundle)
+    floored = full_table(members, bundle, floor=4.0)
+    assert floored.covers(4.0) and floored.covers(6.0) and not floored.covers(3.9)
+    assert len(floored) == full.count(4.0)
+    for t in (4.0, 5.0, 8.0):
+        assert floored.select(t) == full.select(t)
+
+def test_pair_score_table_rebuilds_below_cached_floor(bundle, records):
+    args = (records, *dict_args(bundle))
+    table = network_app.pair_score_table(*args, parse_cache_key="fp", min_edge_score=6.5)
+    assert table.floor == 6.0
+    assert network_app.pair_score_table(*args, parse_cache_key="fp", min_edge_score=7.0) is table
+    lower = network_app.pair_score_table(*args, parse_cache_key="fp", min_edge_score=3.0)
+    assert lower.floor == 2.0 and lower.select(7.0) == table.select(7.0)
+
+def test_edge_table_df_orders_by_score(members, bundle):
+    df = network_app.edge_table_df(full_table(members, bundle), 5.0)
+    assert list(df.columns) == ["A", "B", "score", "common_count", "common_features"]
+    assert df["score"].is_monotonic_decreasing and (df["score"] >= 5.0).all()
+    empty = network_app.edge_table_df(full_table(members, bundle), 1000.0)
+    assert empty.empty and list(empty.columns) == list(df.columns)
+
+
+# ---- 辞書バンドル ----
+
+@pytest.fixture
+def dict_dir(tmp_path, monkeypatch):
+    write_dict_files(str(tmp_path))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+def test_dict_bundle_is_saved_and_reused(dict_dir, monkeypatch, bundle):
+    path = str(dict_dir / "bundle.pkl")
+    first = network_app.load_dict_bundle(path)
+    assert os.path.exists(path)
+    assert {k: first[k] for k in bundle if k != "sources"} == {k: bundle[k] for k in bundle if k != "sources"}
+
+    def fail(*args, **kwargs):
+        raise AssertionError("作り直さないはず")
+    monkeypatch.setattr(network_app, "compile_dict_bundle", fail)
+    assert network_app.load_dict_bundle(path)["CITY_TO_PREF"] == first["CITY_TO_PREF"]
+    # 更新時刻だけ変わった場合は、内容ハッシュが同じなので作り直さない
+    stopwords = dict_dir / network_app.STOPWORDS_JSON
+    os.utime(stopwords, ns=(stopwords.stat().st_atime_ns, stopwords.stat().st_mtime_ns + 10 ** 9))
+    assert network_app.load_dict_bundle(path)["STOPWORDS"] == first["STOPWORDS"]
+
+def test_dict_bundle_rebuilds_when_content_changes(dict_dir):
+    path = str(dict_dir / "bundle.pkl")
+    network_app.load_dict_bundle(path)
+    _write_json(str(dict_dir / network_app.STOPWORDS_JSON), ["旅行", "趣味1"])
+    assert normalize_key("趣味1") in network_app.load_dict_bundle(path)["STOPWORDS"]
+
+def test_dict_bundle_without_save_does_not_write(dict_dir):
+    path = str(dict_dir / "bundle.pkl")
+    assert network_app.load_dict_bundle(path, save=False)["CITY_TO_PREF"]
+    assert not os.path.exists(path)
+
+def test_dict_bundle_without_optional_weights(dict_dir):
+    os.remove(network_app.SUBCAT_WEIGHTS_JSON)
+    assert network_app.compile_dict_bundle(path=None)["SUBCAT_WEIGHTS"] == {}
+
+
+# ---- トークン展開表 ----
+
+@pytest.mark.parametrize("sub1,sub2", [(True, True), (False, True), (False, False)])
+def test_parse_features_matches_reference(bundle, records, sub1, sub2):
+    d = parse_args(bundle)
+    expander = network_app.TokenExpander(*d, sub1, sub2)
+    for r in records + [{"Features": ["名古屋", None, "", " ", 3, "ＳＡＵＮＡ"]}, {"Features": None}]:
+        expected = reference_features(r["Features"], bundle, sub1, sub2)
+        assert network_app.parse_features(r["Features"], *d, sub1, sub2) == expected
+        assert network_app.parse_features(r["Features"], *d, sub1, sub2, expander=expander) == expected
+
+def test_default_expander_is_shared_per_dictionary_set(bundle):
+    d = parse_args(bundle)
+    expander = network_app.default_token_expander(*d, True, True)
+    assert network_app.default_token_expander(*d, True, True) is expander
+    assert network_app.default_token_expander(*d, True, False) is not expander
+    other = dict(bundle["CANONICAL_MAP"])
+    assert network_app.default_token_expander(other, *d[1:], True, True) is not expander
+
+def test_unseen_tokens_are_bounded(bundle):
+    expander = network_app.TokenExpander(*parse_args(bundle), True, True, max_unseen=3)
+    for i in range(10):
+        assert expander.expand(f"未知語{i}") == frozenset({f"未知語{i}"})
+    assert len(expander._unseen) == 3
+
+
+# ---- 語彙を共有したトークン番号表現 ----
+
+def test_member_features_round_trip():
+    people = [("a", {"温泉", "サウナ"}), ("b", set()), ("c", {"サウナ", "野球"})]
+    members = network_app.MemberFeatures.from_people(people)
+    assert members.vocab == sorted({"温泉", "サウナ", "野球"})
+    assert [set(members.tokens(i)) for i in range(len(members))] == [feats for _, feats in people]
+    assert [members.size(i) for i in range(3)] == [2, 0, 2]
+    assert all(list(row) == sorted(row) for row in members.rows)
+    sub = members.subset(["c", "a"])
+    assert sub.names == ["a", "c"] and sub.vocab is members.vocab and sub.tokens(1) == members.tokens(2)
+
+def test_member_features_common_matches_set_intersection(members):
+    for i in range(0, len(members), 7):
+        for j in range(len(members)):
+            assert members.common(i, j) == sorted(set(members.rows[i]) & set(members.rows[j]))
+
+def test_score_pairs_decodes_common_tokens_in_string_order(bundle, records):
+    people = [(r["Name"], reference_features(r["Features"], bundle)) for r in records[:30]]
+    scored = network_app.score_pairs(people, 0.0, bundle["TOKEN_CATEGORY"], bundle["SUBCAT_WEIGHTS"], 0.6, 0.6,
+                                     engine="python")
+    for i, j, score, common in scored:
+        expected = pair_score_and_common(people[i][1], people[j][1], bundle["TOKEN_CATEGORY"],
+                                         bundle["SUBCAT_WEIGHTS"], 0.6, 0.6)
+        assert (score, common) == expected
+
+
+# ---- 上位k本だけ残すモード ----
+
+def brute_top_k(pairs, n, k, mutual):
+    ranked = {}
+    for m in range(n):
+        incident = [p for p, pair in enumerate(pairs) if m in pair[:2]]
+        incident.sort(key=lambda p: (-pairs[p][2], p))
+        for p in incident[:k]:
+            ranked[p] = ranked.get(p, 0) + 1
+    need = 2 if mutual else 1
+    return [pair for p, pair in enumerate(pairs) if ranked.get(p, 0) >= need]
+
+@pytest.mark.parametrize("mutual", [False, True])
+@pytest.mark.parametrize("k", [1, 2, 5])
+def test_top_k_pairs_matches_brute_force(members, bundle, k, mutual):
+    pairs = [p for p in all_pairs(members, bundle) if p[2] >= 3.0]
+    assert network_app.top_k_pairs(pairs, len(members), k, mutual) == brute_top_k(pairs, len(members), k, mutual)
+
+def test_top_k_pairs_breaks_ties_by_position():
+    pairs = [(0, 1, 1.0), (0, 2, 1.0), (0, 3, 1.0)]
+    assert network_app.top_k_pairs(pairs, 4, 1) == pairs                 # 1〜3 はそれぞれ唯一のエッジを残す
+    assert network_app.top_k_pairs(pairs, 4, 1, mutual=True) == [(0, 1, 1.0)]
+    assert network_app.top_k_pairs(pairs, 4, 0) is pairs
+
+@pytest.mark.parametrize("mutual", [False, True])
+def test_top_k_graph_is_the_same_with_and_without_the_table(bundle, records, mutual):
+    plain = network_app.build_graph(records, 3.0, *dict_args(bundle), top_k=3, mutual_knn=mutual)
+    cached = network_app.build_graph(records, 3.0, *dict_args(bundle), top_k=3, mutual_knn=mutual,
+                                     parse_cache_key="fp")
+    assert edge_map(cached) == edge_map(plain)
+    if mutual:
+        # 相互kNNでは、残ったエッジは両端の上位3本に入っているので次数は3以下
+        assert all(deg <= 3 for _, deg in plain.degree())
+
+
+# ---- エッジ数の上限モード ----
+
+@pytest.mark.parametrize("max_edges", [0, 5, 100, 1500, 10 ** 6])
+def test_budget_pair_table_matches_full_table(members, bundle, records, max_edges):
+    table, threshold = network_app.budget_pair_table(max_edges, records, *dict_args(bundle), parse_cache_key="fp")
+    full = full_table(members, bundle)
+    assert threshold == full.threshold_for_budget(max_edges)
+    assert table.covers(threshold)
+    assert table.select(threshold) == full.select(threshold)
+
+def test_budget_pair_table_keeps_floor_when_pairs_suffice(bundle, records):
+    table, _ = network_app.budget_pair_table(10, records, *dict_args(bundle))
+    assert table.floor == network_app.PAIR_TABLE_BUDGET_START_FLOOR
+
+
+# ---- 1人を起点にした類似度ランキング ----
+
+@pytest.mark.parametrize("target", [0, 17, 119])
+def test_similar_members_matches_pair_scores(members, bundle, target):
+    expected = []
+    for i, j, score, ids in all_pairs(members, bundle):
+        if target in (i, j):
+            expected.append((j if i == target else i, score, ids))
+    expected.sort(key=lambda x: (-x[1], x[0]))
+    name = members.names[target]
+    args = (bundle["TOKEN_CATEGORY"], bundle["SUBCAT_WEIGHTS"])
+    assert network_app.similar_members(members, name, *args, k=5) == expected[:5]
+    assert network_app.similar_members(members, name, *args, k=0) == expected
+    assert network_app.similar_members(members, "いない人", *args) == []
+
+
+# ---- pyvis_html ----
+
+def _edges_dataset(html):
+    return re.search(r"edges = new vis\.DataSet\((.*?)\);", html, re.S).group(1)
+
+def test_pyvis_html_edges_match_add_edge():
+    G = nx.Graph()
+    for n in ("A", "B", "C"):
+        G.add_node(n, label=n, size=2)
+    G.add_edge("A", "B", weight=3.5, common_features="温泉")
+    G.add_edge("B", "C", weight=2.0, common_features="野球")
+    html = network_app.pyvis_html(G, height_px=321)
+
+    net = Network(height="321px", width="100%", notebook=False, directed=False)
+    for n, data in G.nodes(data=True):
+        net.add_node(n, label=data["label"], title=f"{data['label']}<br>特徴数: {data['size']}")
+    for u, v, d in G.edges(data=True):
+        net.add_edge(u, v, value=d["weight"], title=f"スコア: {d['weight']}<br>共通: {d['common_features']}")
+    assert _edges_dataset(html) == _edges_dataset(net.generate_html())
+
+def test_pyvis_html_is_cached_per_graph_and_options(bundle, records):
+    G = network_app.build_graph(records[:20], 5.0, *dict_args(bundle))
+    html = network_app.pyvis_html(G)
+    assert network_app.pyvis_html(G.copy()) is html
+    assert network_app.pyvis_html(G, height_px=500) is not html
+    G.add_edge(records[0]["Name"], records[1]["Name"], weight=99.0, common_features="x")
+    assert network_app.pyvis_html(G) is not html
+
+@pytest.mark.parametrize("layout", ["spring", "spectral"])
+def test_static_layout_fixes_node_positions(bundle, records, layout):
+    G = network_app.build_graph(records[:20], 5.0, *dict_args(bundle))
+    key = network_app.graph_fingerprint(G)
+    pos = network_app.compute_layout(G, layout, graph_key=key)
+    assert set(pos) == set(G.nodes)
+    assert network_app.compute_layout(G, layout, graph_key=key) is pos
+    html = network_app.pyvis_html(G, layout=layout)
+    assert '"physics": false' in html and '"x": ' in html